@@ -7,9 +7,14 @@ it_only=false
 ignore_cloud=true # default
 ignore_special=false
 #ignore_special=true
+only_branch= # top level ou name, e.g. itops: only accounts anywhere below it. empty: all branches
 temp_file=aws_profile_list.txt
 role=okta_ro_role
+source_profile=Voltron_DCN
+region=us-east-1
 my_csv=aws_account_list.csv
+tree_file=aws_org_tree.json # written by get_org_list.py next to the csv
+profile_builder_script=$(dirname "$0")/aws_profile_builder.py
 
 
 function parse_args {
@@ -20,45 +25,22 @@ function parse_args {
 }
 
 parse_args $@
-echo "" > $temp_file
-
-IFS=,
-printf "$TIMESTAMP $PROC_NAME: skip flags: it_only: %s ignore_cloud: %s ignore_special: %s\n" $it_only $ignore_cloud $ignore_special
-while read -r aws_profile_name aws_account_id ou ou_name status
-do
-    # lower case
-    aws_profile_name_lc=$(echo $aws_profile_name | tr '[:upper:]' '[:lower:]')
-
-    if [[ "$it_only" = true && "$ou_name" != "itops" ]]; then
-        printf "$TIMESTAMP $PROC_NAME: skipping NON-IT OPS account: %s %s\n" $aws_profile_name
-        continue
-
-    elif [[ "$status" != ACTIVE* ]]; then
-        printf "$TIMESTAMP $PROC_NAME: skipping NON-ACTIVE account: %s %s\n" $aws_profile_name $ou_name
-        continue
-
-    elif [[ "$ignore_cloud" = true && ( "$aws_profile_name_lc" == *cloud* || "$ou_name" == *cloud* ) ]]; then
-    #elif [[ "$ignore_cloud" = true && ( "$ou_name" == *no_policy* || "$ou_name" == "unmanaged" ) ]]; then
-        printf "$TIMESTAMP $PROC_NAME: skipping CLOUD account: %s ou: %s status: %s \n" $aws_profile_name $ou_name $status
-        continue
-
-    elif [[ "$ignore_special" = true && ( "$aws_profile_name" == *ITOPs_Kubernetes* ) ]]; then
-        printf "$TIMESTAMP $PROC_NAME: skipping special account: %s ou: %s status: %s \n" $aws_profile_name $ou_name $status
-        continue
-    fi
-
-    printf "$TIMESTAMP $PROC_NAME: profile: %s account id: %s ou: %s ou name: %s status: %s\n" $aws_profile_name $aws_account_id $ou $ou_name $status
-
-    # add AWS profile
-    aws configure set source_profile Voltron_DCN --profile $aws_profile_name
-    aws configure set role_arn arn:aws:iam::$aws_account_id:role/$role --profile $aws_profile_name
-    aws configure set region us-east-1 --profile $aws_profile_name
-
-    # add profile temp file for processing
-    echo "$aws_profile_name" >> $temp_file
-
-done < "$my_csv"
-
-echo "$TIMESTAMP $PROC_NAME: total aws profiles captured: $(wc -l $temp_file)"
-
 
+# the profiles of all accounts are written to the aws config in one go rather than
+# through three aws configure set calls per account
+BUILDER_ARGS="--csv $my_csv --profile-list $temp_file --source-profile $source_profile --role $role --region $region --tree $tree_file"
+if [[ "$it_only" = true ]]; then
+    BUILDER_ARGS="$BUILDER_ARGS --it-only"
+fi
+if [[ "$ignore_cloud" != true ]]; then
+    BUILDER_ARGS="$BUILDER_ARGS --include-cloud"
+fi
+if [[ "$ignore_special" = true ]]; then
+    BUILDER_ARGS="$BUILDER_ARGS --ignore-special"
+fi
+if [[ -n "$only_branch" ]]; then
+    BUILDER_ARGS="$BUILDER_ARGS --only-branch $only_branch"
+fi
+
+echo "$TIMESTAMP $PROC_NAME: executing: python3 $profile_builder_script $BUILDER_ARGS"
+python3 $profile_builder_script $BUILDER_ARGS
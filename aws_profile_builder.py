@@ -0,0 +1,264 @@
+import argparse
+import csv
+import datetime
+import os
+import re
+import sys
+import tempfile
+
+import ss_org_tree
+
+PROC_NAME = 'aws_profile_builder'
+
+default_source_profile = 'Voltron_DCN'
+default_role = 'okta_ro_role'
+default_region = 'us-east-1'
+
+# section header of the aws cli config
+RE_SECTION = re.compile(r'^\s*\[\s*([^\]]+?)\s*\]\s*$')
+# header of a profile section, [default] or [profile <name>]. others, e.g. [sso-session <name>] or
+# [services <name>], are kept as they are
+RE_PROFILE = re.compile(r'^(?:profile\s+(.+)|(default))$')
+RE_KEY = re.compile(r'^\s*([^=\s]+)\s*=')
+
+
+def get_timestamp():
+    return datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f%z')
+
+
+def config_path():
+    '''
+    :returns: aws cli config file, AWS_CONFIG_FILE or ~/.aws/config as the aws cli resolves it
+    '''
+    return os.path.expanduser(os.environ.get('AWS_CONFIG_FILE', '~/.aws/config'))
+
+
+def read_accounts(filename):
+    '''
+    :type filename: str
+    :param filename: aws_account_list.csv of get_org_list.py
+    :returns: list of (aws_profile_name, aws_account_id, ou, ou_name, status)
+    '''
+    with open(filename, newline='') as fp:
+        reader = csv.reader(fp)
+        next(reader, None) # header
+        return [tuple(row[:5]) for row in reader if len(row) >= 5]
+
+
+def select_profiles(accounts, it_only=False, ignore_cloud=True, ignore_special=False, only_branch=None, tree=None):
+    '''
+    apply the account filters of aws_configurate.sh
+    :type accounts: list
+    :param accounts: (aws_profile_name, aws_account_id, ou, ou_name, status) rows, e.g. from read_accounts
+    :type it_only: bool
+    :param it_only: only accounts in the itops ou
+    :type ignore_cloud: bool
+    :param ignore_cloud: skip accounts with cloud in their name or ou name
+    :type ignore_special: bool
+    :param ignore_special: skip ITOPs_Kubernetes accounts
+    :type only_branch: str
+    :param only_branch: top level ou name, only accounts anywhere below it
+    :type tree: ss_org_tree.OrgTree
+    :param tree: org tree, required with only_branch
+    :returns: list of (aws_profile_name, aws_account_id)
+    '''
+    profiles = []
+    for aws_profile_name, aws_account_id, ou, ou_name, status in accounts:
+        if it_only and ou_name != 'itops':
+            print(f'{get_timestamp()} {PROC_NAME}: skipping NON-IT OPS account: {aws_profile_name}')
+            continue
+
+        if only_branch:
+            branch = tree.branch(aws_account_id)
+            if branch is None or branch.name != only_branch:
+                print(f'{get_timestamp()} {PROC_NAME}: skipping account outside of {only_branch}: {aws_profile_name} ou: {ou_name}')
+                continue
+
+        if not status.startswith('ACTIVE'):
+            print(f'{get_timestamp()} {PROC_NAME}: skipping NON-ACTIVE account: {aws_profile_name} {ou_name}')
+            continue
+
+        if ignore_cloud and ('cloud' in aws_profile_name.lower() or 'cloud' in ou_name):
+            print(f'{get_timestamp()} {PROC_NAME}: skipping CLOUD account: {aws_profile_name} ou: {ou_name} status: {status}')
+            continue
+
+        if ignore_special and 'ITOPs_Kubernetes' in aws_profile_name:
+            print(f'{get_timestamp()} {PROC_NAME}: skipping special account: {aws_profile_name} ou: {ou_name} status: {status}')
+            continue
+
+        print(f'{get_timestamp()} {PROC_NAME}: profile: {aws_profile_name} account id: {aws_account_id} ou: {ou} ou name: {ou_name} status: {status}')
+        profiles.append((aws_profile_name, aws_account_id))
+
+    return profiles
+
+
+def parse_config(text):
+    '''
+    split an aws cli config into its sections, keeping every line as is
+    :type text: str
+    :param text: config file contents
+    :returns: tuple of (lines before the first section, list of [profile name, list of lines])
+              the header line is the first line of every section. the name is None for sections
+              other than profiles
+    '''
+    head = []
+    sections = []
+    for line in text.splitlines(keepends=True):
+        m = RE_SECTION.match(line)
+        if m:
+            profile = RE_PROFILE.match(m.group(1))
+            sections.append([(profile.group(1) or profile.group(2)) if profile else None, [line]])
+        elif sections:
+            sections[-1][1].append(line)
+        else:
+            head.append(line)
+    return head, sections
+
+
+def set_keys(lines, values):
+    '''
+    set keys of a section the way aws configure set does: existing keys are replaced in place,
+    missing ones appended after the last key, other keys and comments are left alone
+    :type lines: list
+    :param lines: section lines, header first
+    :type values: dict
+    :param values: key to value
+    :returns: new list of lines
+    '''
+    lines = list(lines)
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+
+    missing = dict(values)
+    last_key = 0
+    for i, line in enumerate(lines[1:], 1):
+        m = RE_KEY.match(line)
+        if not m:
+            continue
+        last_key = i
+        key = m.group(1)
+        if key in missing:
+            lines[i] = f'{key} = {missing.pop(key)}\n'
+
+    added = [f'{key} = {value}\n' for key, value in missing.items()]
+    lines[last_key + 1:last_key + 1] = added
+    return lines
+
+
+def write_atomic(path, text, mode=0o600):
+    '''
+    write through a temporary file in the same directory and rename it over path, so concurrent
+    readers (running scans) see either the old or the new file
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        pass
+
+    fd, tmp = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(text)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def build_profiles(profiles, config=None, source_profile=default_source_profile, role=default_role, region=default_region):
+    '''
+    add or update a profile section per account in the aws cli config, in a single write.
+    sections whose keys already hold these values are left untouched, and the file is not
+    written at all when nothing changed
+    :type profiles: list
+    :param profiles: (aws_profile_name, aws_account_id), e.g. from select_profiles
+    :type config: str
+    :param config: aws cli config file, default: see config_path
+    :returns: tuple of (added, updated, unchanged) counts
+    '''
+    config = config or config_path()
+    try:
+        with open(config) as fp:
+            text = fp.read()
+    except FileNotFoundError:
+        text = ''
+
+    head, sections = parse_config(text)
+    by_name = {}
+    for section in sections:
+        if section[0] is not None:
+            by_name.setdefault(section[0], section)
+
+    added = updated = unchanged = 0
+    for aws_profile_name, aws_account_id in profiles:
+        values = {'source_profile': source_profile,
+                  'role_arn': f'arn:aws:iam::{aws_account_id}:role/{role}',
+                  'region': region}
+        section = by_name.get(aws_profile_name)
+        if section is None:
+            # blank line between sections, as the aws cli leaves them
+            if sections and not sections[-1][1][-1].endswith('\n'):
+                sections[-1][1][-1] += '\n'
+            if sections and sections[-1][1][-1].strip():
+                sections[-1][1].append('\n')
+            section = [aws_profile_name, set_keys([f'[profile {aws_profile_name}]\n'], values)]
+            sections.append(section)
+            by_name[aws_profile_name] = section
+            added += 1
+            continue
+
+        lines = set_keys(section[1], values)
+        if lines == section[1]:
+            unchanged += 1
+        else:
+            section[1] = lines
+            updated += 1
+
+    if added or updated:
+        if sections and head and not head[-1].endswith('\n'):
+            head[-1] += '\n'
+        write_atomic(config, ''.join(head) + ''.join(''.join(lines) for _, lines in sections))
+
+    return added, updated, unchanged
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Write an aws cli profile per active account of aws_account_list.csv, replacing '
+                                                 'three aws configure set calls per account with one write of the config.')
+    parser.add_argument('--csv', default='aws_account_list.csv', help='account list of get_org_list.py, default: aws_account_list.csv')
+    parser.add_argument('--profile-list', default='aws_profile_list.txt',
+                        help='profiles to scan, one per line, default: aws_profile_list.txt')
+    parser.add_argument('--config', default=None, help=f'aws cli config to write, default: {config_path()}')
+    parser.add_argument('--source-profile', default=default_source_profile, help=f'default: {default_source_profile}')
+    parser.add_argument('--role', default=default_role, help=f'role assumed in every account, default: {default_role}')
+    parser.add_argument('--region', default=default_region, help=f'default: {default_region}')
+    parser.add_argument('--it-only', action='store_true', help='only accounts in the itops ou')
+    parser.add_argument('--include-cloud', action='store_true', help='keep accounts with cloud in their name or ou name')
+    parser.add_argument('--ignore-special', action='store_true', help='skip ITOPs_Kubernetes accounts')
+    parser.add_argument('--only-branch', default=None, help='top level ou name, only accounts anywhere below it')
+    parser.add_argument('--tree', default='aws_org_tree.json', help='org tree of get_org_list.py, read with --only-branch')
+
+    args = parser.parse_args()
+
+    print(f'{get_timestamp()} {PROC_NAME}: skip flags: it_only: {args.it_only} ignore_cloud: {not args.include_cloud} '
+          f'ignore_special: {args.ignore_special} only_branch: {args.only_branch}')
+
+    try:
+        tree = ss_org_tree.OrgTree.load(args.tree) if args.only_branch else None
+    except ss_org_tree.OrgTreeError as e:
+        print(f'{get_timestamp()} {PROC_NAME}: {e}', file=sys.stderr)
+        sys.exit(1)
+
+    profiles = select_profiles(read_accounts(args.csv), it_only=args.it_only, ignore_cloud=not args.include_cloud,
+                               ignore_special=args.ignore_special, only_branch=args.only_branch, tree=tree)
+
+    added, updated, unchanged = build_profiles(profiles, args.config, args.source_profile, args.role, args.region)
+
+    write_atomic(args.profile_list, ''.join(f'{aws_profile_name}\n' for aws_profile_name, _ in profiles), mode=0o644)
+
+    print(f'{get_timestamp()} {PROC_NAME}: total aws profiles captured: {len(profiles)} added: {added} updated: {updated} '
+          f'unchanged: {unchanged} config: {args.config or config_path()}')
@@ -0,0 +1,371 @@
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import random
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import bench_ss_converter
+
+COLLECTOR = 'get_org_list.py'
+
+# org size tiers: ou levels below the root, child ous per ou, accounts per ou and root, policies attached per ou
+TIERS = {
+    'small': {'depth': 2, 'fanout': 4, 'accounts': 5, 'policies': 2},
+    'medium': {'depth': 3, 'fanout': 6, 'accounts': 10, 'policies': 2},
+    '10k': {'depth': 3, 'fanout': 10, 'accounts': 9, 'policies': 2},
+}
+DEFAULT_TIERS = ['small']
+
+POLICY_TYPES = ['SERVICE_CONTROL_POLICY', 'TAG_POLICY']
+ORG_ID = 'o-bench00001'
+MASTER_ACCOUNT_ID = '100000000000'
+
+
+class _HTTPResponse(object):
+    '''
+    enough of a botocore http response for the client to parse a stand-in result
+    '''
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+class StandInOrganizations(object):
+    '''
+    local stand-in for the Organizations API, answering a real botocore client from a synthetic org.
+
+    every root and ou holds the same number of accounts and attached policies, FullAWSAccess is
+    attached everywhere as in a real org. some accounts can also be listed under a second ou, as
+    ListAccountsForParent can return while an account is being moved. calls can be throttled with TooManyRequestsException at
+    random, or once they exceed a quota of calls per second, and take a fixed latency
+    '''
+
+    def __init__(self, depth=2, fanout=4, accounts=5, policies=2, policy_pool=20, throttle=0.0, quota=None,
+                 latency=0.0, duplicates=0, seed=1):
+        '''
+        :param depth:       ou levels below the root
+        :type depth:        int
+        :param fanout:      child ous per ou
+        :type fanout:       int
+        :param accounts:    accounts per root and ou
+        :type accounts:     int
+        :param policies:    policies attached per ou besides FullAWSAccess, alternating service control and tag policies
+        :type policies:     int
+        :param policy_pool: policies of each type the ous pick from, 0 for a policy of its own per attachment
+        :type policy_pool:  int
+        :param throttle:    share of calls throttled at random
+        :type throttle:     float
+        :param quota:       calls per second above which calls are throttled, None for no quota
+        :type quota:        float
+        :param latency:     seconds every call takes
+        :type latency:      float
+        :param duplicates:  accounts of an ou also listed under the next ou
+        :type duplicates:   int
+        '''
+        self.rng = random.Random(seed)
+        self.throttle = throttle
+        self.quota = quota
+        self.latency = latency
+        # bound now, so the latency is not counted as collector sleep once time.sleep is wrapped
+        self.sleep = time.sleep
+        self.calls = collections.Counter()
+        self.throttled = collections.Counter()
+        self.lock = threading.Lock()
+        self.tokens = quota or 0
+        self.stamp = time.monotonic()
+
+        self.accounts = {}
+        self.parent_accounts = collections.defaultdict(list)
+        self.parent_ous = collections.defaultdict(list)
+        self.policies = {}
+        self.attached = collections.defaultdict(list)
+        self.pools = {policy_type: [] for policy_type in POLICY_TYPES}
+
+        self.root = {'Id': 'r-bnch', 'Arn': f'arn:aws:organizations::{MASTER_ACCOUNT_ID}:root/{ORG_ID}/r-bnch',
+                     'Name': 'Root', 'PolicyTypes': [{'Type': policy_type, 'Status': 'ENABLED'} for policy_type in POLICY_TYPES]}
+        self.full_access = self._policy('SERVICE_CONTROL_POLICY', 'FullAWSAccess', aws_managed=True)
+        self.attached['r-bnch'].append(self.full_access)
+        self._add_accounts('r-bnch', accounts)
+
+        ous = 0
+        level = ['r-bnch']
+        for _ in range(depth):
+            children = []
+            for parent_id in level:
+                for _ in range(fanout):
+                    ous += 1
+                    ou_id = f'ou-bnch-{ous:08d}'
+                    self.parent_ous[parent_id].append({'Id': ou_id, 'Arn': f'arn:aws:organizations::{MASTER_ACCOUNT_ID}:ou/{ORG_ID}/{ou_id}',
+                                                       'Name': f'ou {ous}'})
+                    self.attached[ou_id].append(self.full_access)
+                    for idx in range(policies):
+                        policy_type = POLICY_TYPES[idx % len(POLICY_TYPES)]
+                        pool = self.pools[policy_type]
+                        if policy_pool and len(pool) >= policy_pool:
+                            policy_id = self.rng.choice(pool)
+                        else:
+                            policy_id = self._policy(policy_type)
+                            pool.append(policy_id)
+                        if policy_id not in self.attached[ou_id]:
+                            self.attached[ou_id].append(policy_id)
+                    self._add_accounts(ou_id, accounts)
+                    children.append(ou_id)
+            level = children
+        self.ous = ous
+
+        ou_ids = [ou['Id'] for children in self.parent_ous.values() for ou in children]
+        for idx in range(duplicates if len(ou_ids) > 1 else 0):
+            ou_id = ou_ids[idx % len(ou_ids)]
+            if idx // len(ou_ids) < len(self.parent_accounts[ou_id]):
+                self.parent_accounts[ou_ids[(idx + 1) % len(ou_ids)]].append(self.parent_accounts[ou_id][idx // len(ou_ids)])
+
+    def _policy(self, policy_type, name=None, aws_managed=False):
+        policy_id = f'p-{len(self.policies) + 1:08d}'
+        self.policies[policy_id] = {'Id': policy_id,
+                                    'Arn': f'arn:aws:organizations::{MASTER_ACCOUNT_ID}:policy/{ORG_ID}/{policy_type.lower()}/{policy_id}',
+                                    'Name': name or f'policy {len(self.policies) + 1}', 'Description': '',
+                                    'Type': policy_type, 'AwsManaged': aws_managed}
+        return policy_id
+
+    def _add_accounts(self, parent_id, count):
+        for _ in range(count):
+            idx = len(self.accounts) + 1
+            account_id = f'{int(MASTER_ACCOUNT_ID) + idx:012d}'
+            self.accounts[account_id] = {'Id': account_id, 'Arn': f'arn:aws:organizations::{MASTER_ACCOUNT_ID}:account/{ORG_ID}/{account_id}',
+                                         'Email': f'aws+{account_id}@example.com', 'Name': f'bench account {idx}',
+                                         'Status': 'SUSPENDED' if idx % 50 == 0 else 'ACTIVE', 'JoinedMethod': 'CREATED',
+                                         'JoinedTimestamp': datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(hours=idx)}
+            self.parent_accounts[parent_id].append(account_id)
+
+    def _over_quota(self):
+        now = time.monotonic()
+        self.tokens = min(self.quota, self.tokens + (now - self.stamp) * self.quota)
+        self.stamp = now
+        if self.tokens < 1:
+            return True
+        self.tokens -= 1
+        return False
+
+    @staticmethod
+    def _page(items, key, params):
+        size = params.get('MaxResults', 20)
+        start = int(params.get('NextToken') or 0)
+        result = {key: items[start:start + size], 'ResponseMetadata': {'HTTPStatusCode': 200}}
+        if start + size < len(items):
+            result['NextToken'] = str(start + size)
+        return result
+
+    def _targets(self, policy_id):
+        return [{'TargetId': target_id, 'Arn': f'arn:aws:organizations::{MASTER_ACCOUNT_ID}:target/{target_id}', 'Name': target_id,
+                 'Type': 'ROOT' if target_id.startswith('r-') else 'ORGANIZATIONAL_UNIT'}
+                for target_id, policy_ids in self.attached.items() if policy_id in policy_ids]
+
+    def handle(self, model, params, **kwargs):
+        '''
+        before-call handler of the client, its result replaces the http request
+        '''
+        operation = model.name
+        params = json.loads(params['body'] or b'{}')
+        if self.latency:
+            self.sleep(self.latency)
+
+        with self.lock:
+            self.calls[operation] += 1
+            throttled = (self.throttle and self.rng.random() < self.throttle) or (self.quota and self._over_quota())
+            if throttled:
+                self.throttled[operation] += 1
+        if throttled:
+            return _HTTPResponse(400), {'Error': {'Code': 'TooManyRequestsException', 'Message': 'AWS Organizations can\'t complete your request because another request is already in progress. Try again later.'},
+                                        'ResponseMetadata': {'HTTPStatusCode': 400}}
+
+        if operation == 'ListAccounts':
+            result = self._page(list(self.accounts.values()), 'Accounts', params)
+        elif operation == 'ListRoots':
+            result = self._page([self.root], 'Roots', params)
+        elif operation == 'ListAccountsForParent':
+            result = self._page([self.accounts[a] for a in self.parent_accounts[params['ParentId']]], 'Accounts', params)
+        elif operation == 'ListOrganizationalUnitsForParent':
+            result = self._page(self.parent_ous[params['ParentId']], 'OrganizationalUnits', params)
+        elif operation == 'ListPoliciesForTarget':
+            result = self._page([self.policies[p] for p in self.attached[params['TargetId']] if self.policies[p]['Type'] == params['Filter']],
+                                'Policies', params)
+        elif operation == 'ListPolicies':
+            result = self._page([p for p in self.policies.values() if p['Type'] == params['Filter']], 'Policies', params)
+        elif operation == 'ListTargetsForPolicy':
+            result = self._page(self._targets(params['PolicyId']), 'Targets', params)
+        else:
+            return _HTTPResponse(400), {'Error': {'Code': 'InvalidInputException', 'Message': f'{operation} is not stood in for'},
+                                        'ResponseMetadata': {'HTTPStatusCode': 400}}
+        return _HTTPResponse(200), result
+
+    def client(self, config=None):
+        '''
+        :returns: Organizations client of boto3 answered by the stand-in
+        '''
+        import boto3
+
+        session = boto3.Session(aws_access_key_id='bench', aws_secret_access_key='bench', region_name='us-east-1')
+        client = session.client('organizations', config=config)
+        client.meta.events.register('before-call.organizations', self.handle)
+        return client
+
+
+def run_collector(folder, org, stats_file, collector_args):
+    '''
+    run the collector of folder in this interpreter against the stand-in, from the current directory.
+    time.sleep is wrapped to sum what the collector sleeps, over all its threads
+    '''
+    import boto3
+
+    slept = [0.0]
+    lock = threading.Lock()
+    real_sleep = time.sleep
+
+    def counting_sleep(seconds):
+        with lock:
+            slept[0] += seconds
+        real_sleep(seconds)
+
+    stand_in = StandInOrganizations(**org)
+
+    boto3.client = lambda *args, **kwargs: stand_in.client(kwargs.get('config'))
+    time.sleep = counting_sleep
+    sys.path.insert(0, folder)
+    sys.argv = [COLLECTOR] + collector_args
+
+    code = 0
+    time_start = time.perf_counter()
+    try:
+        runpy.run_path(os.path.join(folder, COLLECTOR), run_name='__main__')
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except Exception:
+        code = 1
+    elapsed = time.perf_counter() - time_start
+
+    rows = 0
+    if os.path.exists('aws_account_list.csv'):
+        with open('aws_account_list.csv') as f:
+            rows = sum(1 for _ in f) - 1
+
+    with open(stats_file, 'w') as f:
+        json.dump({'seconds': round(elapsed, 2), 'exit': code, 'calls': dict(stand_in.calls), 'throttled': dict(stand_in.throttled),
+                   'slept': round(slept[0], 2), 'accounts_listed': rows, 'accounts': len(stand_in.accounts), 'ous': stand_in.ous}, f)
+    return code
+
+
+def benchmark(folder, org, collector_args, work_dir):
+    '''
+    run one crawl in a fresh interpreter
+
+    :returns: dict of the crawl stats with the peak rss in MB
+    '''
+    run_dir = tempfile.mkdtemp(prefix='crawl.', dir=work_dir)
+    stats_file = os.path.join(run_dir, 'stats.json')
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-collector', folder, '--org', json.dumps(org), '--stats', stats_file,
+           '--collector-args', ' '.join(collector_args)]
+    with open(os.path.join(run_dir, 'collector.log'), 'w') as log:
+        proc = subprocess.Popen(cmd, cwd=run_dir, stdout=log, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(proc.pid, 0)
+
+    if not os.path.exists(stats_file):
+        return None
+    with open(stats_file) as f:
+        stats = json.load(f)
+    # ru_maxrss is in KB on linux and bytes on macOS. includes the stand-in org, the same for every revision
+    stats['peak_mb'] = round(rusage.ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 1024), 1)
+    stats['log'] = os.path.join(run_dir, 'collector.log')
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=('Benchmark get_org_list.py against a local stand-in for the Organizations API.\n'
+                                                  'Records wall time, API calls per operation, throttles, time slept and peak RSS\n'
+                                                  'per tier and revision. No AWS credentials or calls are needed.\n\n'
+                                                  'tiers (ou depth / child ous per ou / accounts per ou / policies per ou):\n' +
+                                                  '\n'.join(f'  {name:<8} {t["depth"]} / {t["fanout"]} / {t["accounts"]} / {t["policies"]}'
+                                                            for name, t in TIERS.items())),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--rev', dest='revs', action='append', default=[],
+                        help=f'git revision to benchmark, repeat to compare (default: {bench_ss_converter.WORKTREE})')
+    parser.add_argument('--tier', dest='tiers', action='append', default=[], choices=sorted(TIERS),
+                        help=f'org size tier, repeat for several (default: {" ".join(DEFAULT_TIERS)})')
+    parser.add_argument('--depth', type=int, default=None, help='custom tier: ou levels below the root')
+    parser.add_argument('--fanout', type=int, default=4, help='custom tier: child ous per ou')
+    parser.add_argument('--accounts', type=int, default=5, help='custom tier: accounts per root and ou')
+    parser.add_argument('--policies', type=int, default=2, help='custom tier: policies attached per ou besides FullAWSAccess')
+    parser.add_argument('--policy-pool', type=int, default=20,
+                        help='policies of each type the ous share, 0 for a policy per attachment (default: 20)')
+    parser.add_argument('--throttle', type=float, default=0.0, help='share of calls throttled at random (default: 0)')
+    parser.add_argument('--quota', type=float, default=None, help='calls per second above which calls are throttled (default: none)')
+    parser.add_argument('--duplicates', type=int, default=0,
+                        help='accounts also listed under a second ou, every account is still expected once in the list (default: 0)')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds every call takes (default: 0.02)')
+    parser.add_argument('--collector-args', default='', help='extra arguments passed to the collector, e.g. "--workers 8 --rate 20"')
+    parser.add_argument('--results', default=None, help='append one JSON record per tier and revision to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the crawl folders with the collector logs and lists')
+    # internal: one crawl, run by benchmark() in a fresh interpreter
+    parser.add_argument('--run-collector', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--org', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--stats', default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.run_collector:
+        sys.exit(run_collector(args.run_collector, json.loads(args.org), args.stats, args.collector_args.split()))
+
+    revs = args.revs or [bench_ss_converter.WORKTREE]
+    tiers = {name: dict(TIERS[name]) for name in args.tiers}
+    if args.depth is not None:
+        tiers['custom'] = {'depth': args.depth, 'fanout': args.fanout, 'accounts': args.accounts, 'policies': args.policies}
+    if not tiers:
+        tiers = {name: dict(TIERS[name]) for name in DEFAULT_TIERS}
+
+    work_dir = tempfile.mkdtemp(prefix='bench_org_collector.')
+    failed = False
+    try:
+        folders = [bench_ss_converter.checkout(rev, os.path.join(work_dir, f'rev{idx}')) for idx, rev in enumerate(revs)]
+
+        print(f'{"tier":<8} {"revision":<20} {"ous":>6} {"accounts":>8} {"listed":>8} {"seconds":>8} {"calls":>7} '
+              f'{"throttled":>9} {"slept s":>8} {"peak MB":>8} {"exit":>5}')
+        for name, tier in tiers.items():
+            org = dict(tier, policy_pool=args.policy_pool, throttle=args.throttle, quota=args.quota, latency=args.latency,
+                       duplicates=args.duplicates)
+            for rev, folder in zip(revs, folders):
+                stats = benchmark(folder, org, args.collector_args.split(), work_dir)
+                if stats is None:
+                    print(f'{name:<8} {rev:<20} failed to run')
+                    failed = True
+                    continue
+
+                print(f'{name:<8} {rev:<20} {stats["ous"]:>6} {stats["accounts"]:>8} {stats["accounts_listed"]:>8} '
+                      f'{stats["seconds"]:>8.2f} {sum(stats["calls"].values()):>7} {sum(stats["throttled"].values()):>9} '
+                      f'{stats["slept"]:>8.1f} {stats["peak_mb"]:>8.0f} {stats["exit"]:>5}')
+                print(f'{"":<29} ' + ' '.join(f'{operation}={count}' for operation, count in sorted(stats['calls'].items())))
+                if stats['exit'] != 0 or stats['accounts_listed'] != stats['accounts']:
+                    failed = True
+                    print(f'{"":<29} incomplete crawl, ' + (f'see {stats["log"]}' if args.keep else 'rerun with --keep for the collector log'))
+
+                if args.results:
+                    record = dict(tier=name, revision=rev, collector_args=args.collector_args, org=org,
+                                  python=platform.python_version(), time=time.strftime('%F %T%z'), **stats)
+                    record.pop('log')
+                    with open(args.results, 'a') as f:
+                        f.write(json.dumps(record) + '\n')
+    finally:
+        if args.keep:
+            print(f'crawl folders kept in {work_dir}')
+        else:
+            shutil.rmtree(work_dir)
+
+    sys.exit(1 if failed else 0)
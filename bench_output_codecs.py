@@ -0,0 +1,78 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import bench_ss_converter
+import ss_output
+
+DEFAULT_CODECS = ['none', 'gzip:1', 'gzip:6', 'gzip:9', 'zstd:1', 'zstd:3', 'zstd:9', 'zstd:19']
+
+
+def parse_codec(spec):
+    '''
+    :param spec:    codec[:level], e.g. gzip:6
+    :type spec:     str
+
+    :returns: tuple of (codec, level or None)
+    '''
+    codec, _, level = spec.partition(':')
+    if codec not in ss_output.CODECS:
+        raise ValueError(f'unknown codec: {codec}')
+    return codec, int(level) if level else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare converter wall time and output size per output codec on a synthetic report')
+    parser.add_argument('--codec', dest='codecs', action='append', default=[],
+                        help=f'codec[:level] to benchmark, repeat to compare (default: {" ".join(DEFAULT_CODECS)})')
+    parser.add_argument('--resources', type=int, default=100, help='resources per resource type and region')
+    parser.add_argument('--regions', type=int, default=4, help='regions per regional service')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per codec, best run is reported')
+    parser.add_argument('--report', default=None, help='existing results file to use instead of a synthetic one')
+    parser.add_argument('--converter-args', default='', help='extra arguments passed to the converter, e.g. "--stream"')
+
+    args = parser.parse_args()
+    specs = args.codecs or DEFAULT_CODECS
+
+    work_dir = tempfile.mkdtemp(prefix='bench_output_codecs.')
+    try:
+        results_file = args.report
+        if not results_file:
+            results_file = os.path.join(work_dir, 'scoutsuite_results_bench.js')
+            bench_ss_converter.generate_report(results_file, {'resources': args.resources, 'regions': args.regions,
+                                                              'services': None})
+        print(f'report: {results_file} size: {os.path.getsize(results_file) / 2 ** 20:.1f} MB')
+        print(f'{"codec":<10} {"seconds":>9} {"MB written":>11} {"ratio":>7} {"peak MB":>9}')
+
+        for spec in specs:
+            codec, level = parse_codec(spec)
+            if codec == 'zstd' and ss_output.zstandard is None:
+                print(f'{spec:<10} skipped, zstandard is not installed')
+                continue
+
+            json_out = os.path.join(work_dir, f'report.scoutsuite.bench.txt{ss_output.CODEC_SUFFIXES[codec]}')
+            extra_args = ['--codec', codec] + (['--level', str(level)] if level is not None else []) + args.converter_args.split()
+
+            best = None
+            for _ in range(args.repeat):
+                result = bench_ss_converter.run_converter(bench_ss_converter.BASEFOLDER, results_file, json_out, extra_args)
+                if result[2] != 0:
+                    print(f'{spec}: converter exited with {result[2]}')
+                    break
+                if best is None or result[0] < best[0]:
+                    best = result
+
+            if best is None:
+                continue
+
+            size = os.path.getsize(json_out)
+            with ss_output.open_input(json_out) as f:
+                plain = sum(len(line) for line in f)
+            print(f'{spec:<10} {best[0]:>9.2f} {size / 2 ** 20:>11.2f} {plain / size:>7.1f} {best[1]:>9.0f}')
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        shutil.rmtree(work_dir)
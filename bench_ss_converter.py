@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import ss_output
+
+BASEFOLDER = os.path.abspath(os.path.dirname(__file__))
+CONVERTER = 'ss_converter_aws.py'
+WORKTREE = 'worktree'
+
+# report size tiers: resources per resource type and region, regions, services (None is all)
+TIERS = {
+    'small': {'resources': 20, 'regions': 2, 'services': 8},
+    'medium': {'resources': 100, 'regions': 4, 'services': None},
+    'large': {'resources': 400, 'regions': 8, 'services': None},
+    'xlarge': {'resources': 1000, 'regions': 17, 'services': None},
+}
+DEFAULT_TIERS = ['small', 'medium']
+
+
+def generate_report(results_file, tier):
+    '''
+    write a synthetic report for the tier in a separate interpreter. ru_maxrss of the converter
+    includes the memory of the process it was forked from, so the bench itself is kept small
+    '''
+    cmd = [sys.executable, os.path.join(BASEFOLDER, 'gen_scoutsuite_report.py'), results_file,
+           '--resources', str(tier['resources']), '--regions', str(tier['regions'])]
+    if tier['services']:
+        cmd += ['--services', str(tier['services'])]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+
+
+def checkout(rev, dest):
+    '''
+    extract a revision of the runner into dest, or return the working tree
+
+    :param rev:     git revision, or "worktree" for the current files
+    :type rev:      str
+    :param dest:    folder to extract to
+    :type dest:     str
+    '''
+    if rev == WORKTREE:
+        return BASEFOLDER
+
+    os.makedirs(dest)
+    archive = subprocess.run(['git', '-C', BASEFOLDER, 'archive', rev], check=True, stdout=subprocess.PIPE).stdout
+    subprocess.run(['tar', '-x', '-C', dest], input=archive, check=True)
+    return dest
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_converter(folder, results_file, json_out, extra_args):
+    '''
+    run one conversion in a fresh interpreter
+
+    :returns: tuple of (wall seconds, peak rss in MB, exit code)
+    '''
+    cmd = [sys.executable, os.path.join(folder, CONVERTER), '-s', results_file, '-d', json_out] + extra_args
+    time_start = time.perf_counter()
+    proc = subprocess.Popen(cmd)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - time_start
+    # ru_maxrss is in KB on linux and bytes on macOS
+    peak = rusage.ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 1024)
+    return elapsed, peak, _exit_code(status)
+
+
+def count_events(json_out):
+    '''
+    :returns: tuple of (events, uncompressed bytes) of a converted report
+    '''
+    events = size = 0
+    with ss_output.open_input(json_out) as f:
+        for line in f:
+            events += 1
+            size += len(line)
+    return events, size
+
+
+def benchmark(folder, results_file, json_out, extra_args, repeat):
+    '''
+    convert the report repeat times and keep the fastest run
+
+    :returns: dict of seconds, peak_mb, events, events_per_sec, output_bytes, or None if the converter failed
+    '''
+    best = None
+    for _ in range(repeat):
+        elapsed, peak, code = run_converter(folder, results_file, json_out, extra_args)
+        if code != 0:
+            print(f'converter exited with {code}: {" ".join(extra_args)}', file=sys.stderr)
+            return None
+        if best is None or elapsed < best[0]:
+            best = elapsed, peak
+
+    events, output_bytes = count_events(json_out)
+    return {
+        'seconds': round(best[0], 3),
+        'peak_mb': round(best[1], 1),
+        'events': events,
+        'events_per_sec': round(events / best[0]),
+        'output_bytes': output_bytes,
+        'output_bytes_written': os.path.getsize(json_out),
+    }
+
+
+def load_baseline(path):
+    '''
+    :returns: dict of (tier, revision, converter_args) to the benchmark record of a previous --results file
+    '''
+    baseline = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                baseline[(record['tier'], record['revision'], record['converter_args'])] = record
+    return baseline
+
+
+def check_regression(record, baseline, max_regression):
+    '''
+    :returns: list of regression messages against the matching baseline record
+    '''
+    previous = baseline.get((record['tier'], record['revision'], record['converter_args']))
+    if previous is None:
+        return []
+
+    messages = []
+    if record['events_per_sec'] < previous['events_per_sec'] * (1 - max_regression):
+        messages.append(f'events/s {previous["events_per_sec"]} -> {record["events_per_sec"]}')
+    if record['peak_mb'] > previous['peak_mb'] * (1 + max_regression):
+        messages.append(f'peak MB {previous["peak_mb"]} -> {record["peak_mb"]}')
+    if record['events'] != previous['events']:
+        messages.append(f'events {previous["events"]} -> {record["events"]}')
+    return messages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=('Benchmark ss_converter_aws.py on synthetic reports across size tiers.\n'
+                                                  'Records wall time, events/s, output bytes and peak RSS per tier and revision.\n\n'
+                                                  'tiers (resources per type and region / regions / services):\n' +
+                                                  '\n'.join(f'  {name:<8} {t["resources"]} / {t["regions"]} / {t["services"] or "all"}'
+                                                            for name, t in TIERS.items())),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--rev', dest='revs', action='append', default=[],
+                        help=f'git revision to benchmark, repeat to compare (default: {WORKTREE})')
+    parser.add_argument('--tier', dest='tiers', action='append', default=[], choices=sorted(TIERS),
+                        help=f'size tier, repeat for several (default: {" ".join(DEFAULT_TIERS)})')
+    parser.add_argument('--resources', type=int, default=None, help='custom tier: resources per resource type and region')
+    parser.add_argument('--regions', type=int, default=4, help='custom tier: regions per regional service')
+    parser.add_argument('--services', type=int, default=None, help='custom tier: number of services (default: all)')
+    parser.add_argument('--report', default=None, help='existing results file to benchmark instead of synthetic tiers')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per revision, best run is reported')
+    parser.add_argument('--converter-args', default='', help='extra arguments passed to the converter, e.g. "--stream"')
+    parser.add_argument('--results', default=None, help='append one JSON record per tier and revision to this file')
+    parser.add_argument('--baseline', default=None,
+                        help='results file of an earlier run, exit 1 if a tier regressed against it')
+    parser.add_argument('--max-regression', type=float, default=.1,
+                        help='allowed events/s drop and peak RSS growth against the baseline (default: 0.1)')
+
+    args = parser.parse_args()
+    revs = args.revs or [WORKTREE]
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+
+    tiers = {name: TIERS[name] for name in args.tiers}
+    if args.resources:
+        tiers['custom'] = {'resources': args.resources, 'regions': args.regions, 'services': args.services}
+    if not tiers and not args.report:
+        tiers = {name: TIERS[name] for name in DEFAULT_TIERS}
+
+    work_dir = tempfile.mkdtemp(prefix='bench_ss_converter.')
+    regressions = []
+    try:
+        reports = []
+        if args.report:
+            reports.append(('report', args.report))
+        for name, tier in tiers.items():
+            results_file = os.path.join(work_dir, f'scoutsuite_results_{name}.js')
+            generate_report(results_file, tier)
+            reports.append((name, results_file))
+
+        folders = [checkout(rev, os.path.join(work_dir, f'rev{idx}')) for idx, rev in enumerate(revs)]
+
+        print(f'{"tier":<8} {"revision":<20} {"report MB":>9} {"events":>9} {"seconds":>8} {"events/s":>9} '
+              f'{"out MB":>8} {"peak MB":>8}')
+        for name, results_file in reports:
+            for rev, folder in zip(revs, folders):
+                json_out = os.path.join(work_dir, f'report.scoutsuite.{name}.txt')
+                result = benchmark(folder, results_file, json_out, args.converter_args.split(), args.repeat)
+                if result is None:
+                    print(f'{name:<8} {rev:<20} failed')
+                    continue
+
+                record = dict(tier=name, revision=rev, converter_args=args.converter_args,
+                              report_bytes=os.path.getsize(results_file), python=platform.python_version(),
+                              time=time.strftime('%F %T%z'), **result)
+                print(f'{name:<8} {rev:<20} {record["report_bytes"] / 2 ** 20:>9.1f} {record["events"]:>9} '
+                      f'{record["seconds"]:>8.2f} {record["events_per_sec"]:>9} '
+                      f'{record["output_bytes_written"] / 2 ** 20:>8.1f} {record["peak_mb"]:>8.0f}')
+
+                if args.results:
+                    with open(args.results, 'a') as f:
+                        f.write(json.dumps(record) + '\n')
+
+                for message in check_regression(record, baseline, args.max_regression):
+                    regressions.append(f'{name} {rev}: {message}')
+    finally:
+        shutil.rmtree(work_dir)
+
+    for message in regressions:
+        print(f'REGRESSION {message}', file=sys.stderr)
+    sys.exit(1 if regressions else 0)
@@ -4,6 +4,12 @@ RUNNER_DIR=/opt/scoutsuite_runner
 REPORT_DIR=/opt/reports.scoutsuite
 LOGDIR=$RUNNER_DIR/log
 SS_CONVERTER_SCRIPT=$RUNNER_DIR/ss_converter_aws.py
+SS_CONVERTER_BATCH_SCRIPT=$RUNNER_DIR/ss_converter_batch.py
+MAX_CONVERT_WORKERS=4 # report conversion worker processes
+OUTPUT_CODEC=none # none, gzip or zstd, keep in line with scoutsuite_runner.sh
+CONVERT_CACHE_DIR=$REPORT_DIR/.cache.converter # keep in line with scoutsuite_runner.sh, re-runs of unchanged results are linked from it
+HEC_URL= # keep in line with scoutsuite_runner.sh, remediated reports are posted to the same collector
+HEC_TOKEN_FILE=$RUNNER_DIR/.hec_token
 
 REPORT_BASE=20*-*
 LOGFILE=$LOGDIR/collector.scoutsuite_runner.log
@@ -14,10 +20,12 @@ TIMESTAMP=`date +"%Y-%m-%d %H:%M:%S.%3N%z"`
 PROC_NAME="report_conversion_check"
 
 CNUM=0
+PENDING_REPORTS=()   # results files queued for batch conversion
+declare -A PENDING_DATES # results file -> timestamp to reset its converted file to
 
 # get date from folder based on latest file
 function get_latest_date() {
-	DATE_FOLDER=`find $1 -type f -name 'report.scoutsuite.*.txt' -exec stat \{} --printf="%y\n" \; | sort -n -r | head -n 1`
+	DATE_FOLDER=`find $1 -type f -name 'report.scoutsuite.*.txt*' -exec stat \{} --printf="%y\n" \; | sort -n -r | head -n 1`
 }
 
 echo "$TIMESTAMP $PROC_NAME: begin checking for missing converted scoutsuite reports" >> $LOGFILE
@@ -53,32 +61,50 @@ for FOLDER in `find $REPORT_DIR/$REPORT_BASE -mindepth 1 -maxdepth 1 -mtime +1 -
         [[ "$ORIG_REPORT" =~ scoutsuite_results_(.*)\.js ]]
         EXTRACTED_PROFILE="${BASH_REMATCH[1]}"      
 
-        # check for converted report
-        CHK_REPORT_CONVERTED=`find $FOLDER -type f -name "$PREFIX_REPORT_FILE.*" ` 
-        if [ -z "$CHK_REPORT_CONVERTED" ] || [ ! -s "$CHK_REPORT_CONVERTED" ] ; then
+        # check for converted report, under the suffix of any codec (ss_output.CODEC_SUFFIXES). a report
+        # can be there under several, e.g. after the codec changed, any complete one will do.
+        # a delta conversion with no changes is empty, its hash sidecar marks it complete
+        CHK_REPORT_CONVERTED=""
+        for CODEC_SUFFIX in "" .gz .zst; do
+            CONVERTED_FILE="$ORIG_REPORT_FOLDER/$PREFIX_REPORT_FILE.$EXTRACTED_PROFILE.txt$CODEC_SUFFIX"
+            if [ -s "$CONVERTED_FILE" ] || ( [ -f "$CONVERTED_FILE" ] && [ -f "$ORIG_REPORT_FOLDER/$PREFIX_REPORT_FILE.$EXTRACTED_PROFILE.txt.hashes" ] ); then
+                CHK_REPORT_CONVERTED=$CONVERTED_FILE
+                break
+            fi
+        done
+        if [ -z "$CHK_REPORT_CONVERTED" ]; then
             echo -e "$TIMESTAMP $PROC_NAME: detected missing or incomplete converted JSON report file. attempting again. folder: $FOLDER_BASE date: $FOLDER_TS target file name: report.scoutsuite.$EXTRACTED_PROFILE.txt" >> $LOGFILE
 
             # for debugging, skip actual convertion remediation
             #continue
-            CHK_FLAG=0
-            echo "$TIMESTAMP $PROC_NAME: converting $ORIG_REPORT >> $ORIG_REPORT_FOLDER/report.scoutsuite.$EXTRACTED_PROFILE.txt" >> $LOGFILE
-            #echo python3 $SS_CONVERTER_SCRIPT -s "$ORIG_REPORT" -d "$ORIG_REPORT_FOLDER/report.scoutsuite.$EXTRACTED_PROFILE.txt"
-            python3 $SS_CONVERTER_SCRIPT -s "$ORIG_REPORT" -d "$ORIG_REPORT_FOLDER/report.scoutsuite.$EXTRACTED_PROFILE.txt"
-            CHK_FLAG=$? # return 0 if success
-
-            if [ $CHK_FLAG == 0 ]; then
-                CNUM=$((CNUM+1))
-                # reset timestamp for easier maintenance
-                touch -d "$DATE_FOLDER" $ORIG_REPORT_FOLDER/report.scoutsuite.$EXTRACTED_PROFILE.txt
-            else
-                echo -e "$TIMESTAMP $PROC_NAME: failed converstion attempt again folder: $FOLDER_BASE  date: $FOLDER_TS  target file name: report.scoutsuite.$EXTRACTED_PROFILE.txt" >> $LOGFILE
-            fi
+            echo "$TIMESTAMP $PROC_NAME: queueing conversion $ORIG_REPORT >> $ORIG_REPORT_FOLDER/report.scoutsuite.$EXTRACTED_PROFILE.txt" >> $LOGFILE
+            PENDING_REPORTS+=("$ORIG_REPORT")
+            PENDING_DATES["$ORIG_REPORT"]="$DATE_FOLDER"
         fi
 
     fi
 
 done
 
+CONVERT_ARGS="--workers $MAX_CONVERT_WORKERS --stream --codec $OUTPUT_CODEC --cache-dir $CONVERT_CACHE_DIR"
+if [ -n "$HEC_URL" ]; then
+    export SS_HEC_TOKEN=`cat $HEC_TOKEN_FILE`
+    CONVERT_ARGS="$CONVERT_ARGS --hec-url $HEC_URL"
+fi
+
+# convert all queued reports in one process pool
+if [ ${#PENDING_REPORTS[@]} -gt 0 ]; then
+    while IFS=$'\t' read -r CHK_STATUS ORIG_REPORT CONVERTED_REPORT EVENT_COUNT ELAPSED; do
+        if [ "$CHK_STATUS" == "OK" ]; then
+            CNUM=$((CNUM+1))
+            # reset timestamp for easier maintenance
+            touch -d "${PENDING_DATES[$ORIG_REPORT]}" "$CONVERTED_REPORT"
+        else
+            echo -e "$TIMESTAMP $PROC_NAME: failed converstion attempt again. results file: $ORIG_REPORT  target file name: $CONVERTED_REPORT" >> $LOGFILE
+        fi
+    done < <(printf '%s\n' "${PENDING_REPORTS[@]}" | python3 $SS_CONVERTER_BATCH_SCRIPT $CONVERT_ARGS - 2>> $LOGFILE)
+fi
+
 te1=`date +%s`
 duration=$((te1 - ts1))
 
@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import random
+
+import ss_converter_aws
+
+ACCOUNT_ID = '123456789012'
+REGIONS = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'eu-west-1', 'eu-central-1',
+           'ap-southeast-1', 'ap-southeast-2', 'ap-northeast-1', 'sa-east-1', 'ca-central-1',
+           'eu-west-2', 'eu-west-3', 'eu-north-1', 'ap-south-1', 'ap-northeast-2', 'us-gov-west-1']
+# services ScoutSuite reports without regions
+GLOBAL_SERVICES = {'iam', 'route53', 's3'}
+# static settings ScoutSuite stores as a flat dict instead of a collection of resources
+SETTINGS_FIELDS = {('iam', 'password_policy')}
+SERVICE_GROUPS = {
+    'compute': ['awslambda', 'ec2', 'elb', 'elbv2', 'emr'],
+    'database': ['elasticache', 'rds', 'redshift'],
+    'management': ['cloudformation', 'cloudtrail', 'cloudwatch', 'config'],
+    'messaging': ['ses', 'sns', 'sqs'],
+    'network': ['directconnect', 'route53', 'vpc'],
+    'security': ['acm', 'iam', 'kms', 'secretsmanager'],
+    'storage': ['efs', 's3'],
+}
+LEVELS = ['warning', 'danger']
+
+
+def _tags(rnd):
+    return [{'Key': 'owner', 'Value': rnd.choice(['secops', 'platform', 'data', 'web'])},
+            {'Key': 'env', 'Value': rnd.choice(['dev', 'stg', 'prd'])}]
+
+
+def _resource(rnd, service, field, idx, region=None):
+    '''
+    one resource as ScoutSuite stores it, with common fields plus a few shaped after the resource type
+
+    :returns: tuple of (key, resource)
+    '''
+    key = f'{field[:3]}-{rnd.getrandbits(40):010x}'
+    resource = {
+        'arn': f'arn:aws:{service}:{region or ""}:{ACCOUNT_ID}:{field}/{key}',
+        'id': key,
+        'name': f'{service}-{field}-{idx}',
+        'tags': _tags(rnd),
+        'CreationDate': f'20{rnd.randint(15, 20)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T00:00:00+00:00',
+    }
+
+    if field == 'security_groups':
+        resource['rules'] = {direction: {'count': 2, 'protocols': {
+            'TCP': {'ports': {str(rnd.choice([22, 80, 443, 3389, 5432])): {
+                'cidrs': [{'CIDR': rnd.choice(['0.0.0.0/0', '10.0.0.0/8', '172.16.0.0/12'])}]}}}}}
+            for direction in ('ingress', 'egress')}
+        resource['vpc_id'] = f'vpc-{rnd.getrandbits(32):08x}'
+    elif field == 'instances':
+        resource['State'] = {'Code': 16, 'Name': rnd.choice(['running', 'stopped'])}
+        resource['InstanceType'] = rnd.choice(['t3.micro', 'm5.large', 'c5.xlarge'])
+        resource['network_interfaces'] = {f'eni-{rnd.getrandbits(32):08x}': {
+            'PrivateIpAddress': f'10.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}',
+            'Groups': [{'GroupId': f'sg-{rnd.getrandbits(32):08x}'}]}}
+    elif field in ('roles', 'users', 'groups', 'policies'):
+        resource['inline_policies'] = {f'policy-{i}': {'PolicyDocument': {'Version': '2012-10-17', 'Statement': [
+            {'Effect': 'Allow', 'Action': rnd.sample(['s3:GetObject', 's3:PutObject', 'ec2:Describe*', 'iam:PassRole', '*'], 2),
+             'Resource': '*'}]}} for i in range(rnd.randint(0, 2))}
+    elif field == 'buckets':
+        resource['versioning_status_enabled'] = rnd.random() < .5
+        resource['default_encryption_enabled'] = rnd.random() < .7
+        resource['grantees'] = {}
+    elif field in ('volumes', 'snapshots', 'filesystems'):
+        resource['Encrypted'] = rnd.random() < .6
+        resource['Size'] = rnd.choice([8, 20, 100, 500])
+
+    if region:
+        resource['region'] = region
+    resource['flagged'] = rnd.random() < .1
+    return key, resource
+
+
+def _service(rnd, service, fields, regions, resources, findings):
+    '''
+    results of one service: resources per region (or global), counts, findings and filters
+    '''
+    results_service = {'filters': {f'{service}-filter-{i}': {'description': 'synthetic filter',
+                                                             'path': f'{service}.regions.id.{fields[0]}.id'}
+                                   for i in range(rnd.randint(0, 2))}}
+    flagged_paths = []
+
+    def collection(field, region=None):
+        items = {}
+        for idx in range(resources):
+            key, resource = _resource(rnd, service, field, idx, region)
+            items[key] = resource
+            if resource['flagged']:
+                flagged_paths.append(f'{service}.regions.{region}.{field}.{key}' if region else f'{service}.{field}.{key}')
+        return items
+
+    if service in GLOBAL_SERVICES:
+        for field in fields:
+            if (service, field) in SETTINGS_FIELDS:
+                results_service[field] = {'MinimumPasswordLength': 14, 'RequireSymbols': True, 'MaxPasswordAge': 90,
+                                          'PasswordReusePrevention': 24, 'ExpirePasswords': True}
+                continue
+            if field == 'permissions':
+                results_service[field] = {'Action': {f'{service}:Action{i}': {
+                    'Allow': {'roles': {'Resource': {'*': [f'role-{i}']}}}} for i in range(resources)}}
+                continue
+            results_service[field] = collection(field)
+            results_service[f'{field}_count'] = resources
+    else:
+        results_service['regions'] = {}
+        for region in regions:
+            results_region = {'id': region, 'name': region, 'region': region}
+            for field in fields:
+                results_region[field] = collection(field, region)
+                results_region[f'{field}_count'] = resources
+            results_service['regions'][region] = results_region
+        results_service['regions_count'] = len(regions)
+        for field in fields:
+            results_service[f'{field}_count'] = resources * len(regions)
+
+    results_service['findings'] = {}
+    for i in range(findings):
+        items = rnd.sample(flagged_paths, min(len(flagged_paths), rnd.randint(0, 5)))
+        results_service['findings'][f'{service}-finding-{i:03d}'] = {
+            'checked_items': resources * max(len(regions), 1),
+            'compliance': [{'name': 'CIS Amazon Web Services Foundations', 'reference': f'{i % 5}.{i % 3}', 'version': '1.2.0'}],
+            'dashboard_name': fields[0].replace('_', ' ').title(),
+            'description': f'synthetic {service} finding {i}',
+            'display_path': f'{service}.regions.id.{fields[0]}.id',
+            'flagged_items': len(items),
+            'id_suffix': None,
+            'items': items,
+            'level': rnd.choice(LEVELS),
+            'path': f'{service}.regions.id.{fields[0]}.id',
+            'rationale': 'synthetic rationale',
+            'references': ['https://docs.aws.amazon.com/'],
+            'remediation': None,
+            'service': service,
+        }
+    return results_service
+
+
+def make_report(path, resources=100, regions=4, services=None, findings=20, seed=0, profile='bench'):
+    '''
+    write a synthetic scoutsuite_results_*.js shaped like a real ScoutSuite AWS report
+
+    every service the converter extracts (ss_converter_aws.SERVICE_EV_FIELDS) gets its resource types,
+    regional services across the regions, plus findings, filters, service group external attack
+    surface, sg_map/subnet_map, last_run and metadata
+
+    :param path:    destination of the synthetic report
+    :type path:     str
+    :param resources:   resources per resource type, per region for regional services
+    :type resources:    int
+    :param regions:     number of regions for regional services
+    :type regions:      int
+    :param services:    number of services, taken in name order. default all of SERVICE_EV_FIELDS
+    :type services:     int
+    :param findings:    findings per service
+    :type findings:     int
+    :param seed:    random seed, same parameters and seed give the same report
+    :type seed:     int
+    :param profile:     aws profile name, written as the environment
+    :type profile:      str
+    '''
+    rnd = random.Random(seed)
+    service_names = sorted(ss_converter_aws.SERVICE_EV_FIELDS)[:services]
+    region_names = REGIONS[:regions]
+
+    results_services = {}
+    for service in service_names:
+        results_services[service] = _service(rnd, service, ss_converter_aws.SERVICE_EV_FIELDS[service],
+                                             region_names, resources, findings)
+
+    sg_map = {}
+    subnet_map = {}
+    if 'ec2' in results_services:
+        for region in region_names:
+            for key, sg in results_services['ec2']['regions'][region]['security_groups'].items():
+                sg_map[key] = {'region': region, 'vpc_id': sg['vpc_id']}
+    if 'vpc' in results_services:
+        for region in region_names:
+            for key, vpc in results_services['vpc']['regions'][region]['vpcs'].items():
+                subnet_id = f'subnet-{rnd.getrandbits(32):08x}'
+                subnet_map[subnet_id] = {'region': region, 'vpc_id': key, 'cidr_block': '10.0.0.0/24'}
+
+    service_groups = {}
+    for group, members in SERVICE_GROUPS.items():
+        surface = {}
+        for _ in range(len([s for s in members if s in results_services]) * resources // 10):
+            ip = f'{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}'
+            surface[ip] = {'InstanceName': f'host-{ip}', 'PublicDnsName': f'ec2-{ip.replace(".", "-")}.compute.amazonaws.com',
+                           'protocols': {'TCP': {'ports': {'443': {'cidrs': [{'CIDR': '0.0.0.0/0'}]}}}}}
+        service_groups[group] = {'summaries': {'external_attack_surface': surface}}
+
+    summary = {service: {'checked_items': resources, 'flagged_items': len(results['findings']),
+                         'max_level': 'danger', 'resources_count': resources, 'rules_count': len(results['findings'])}
+               for service, results in results_services.items()}
+
+    report = {
+        'account_id': ACCOUNT_ID,
+        'environment': profile,
+        'last_run': {'ruleset_about': 'default', 'ruleset_name': 'default', 'run_parameters': {'excluded_regions': [],
+                     'regions': region_names, 'services': service_names, 'skipped_services': []},
+                     'summary': summary, 'time': '2020-01-01 00:00:00+00:00', 'version': '5.10.0'},
+        'metadata': {group: {service: {'resources': {field: {'count': f'services.{service}.{field}_count'}
+                                                     for field in ss_converter_aws.SERVICE_EV_FIELDS[service]},
+                                       'summaries': {}}
+                             for service in members if service in results_services}
+                     for group, members in SERVICE_GROUPS.items()},
+        'partition': 'aws',
+        'provider_code': 'aws',
+        'provider_name': 'Amazon Web Services',
+        'result_format': 'json',
+        'service_groups': service_groups,
+        'service_list': service_names,
+        'services': results_services,
+        'sg_map': sg_map,
+        'subnet_map': subnet_map,
+    }
+
+    with open(path, 'w') as f:
+        print('scoutsuite_results =', file=f)
+        json.dump(report, f, separators=(',', ': '), sort_keys=True)
+        f.write('\n')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write a synthetic ScoutSuite AWS results file for testing and benchmarking the converter')
+    parser.add_argument('output', help='destination file, or a folder to write scoutsuite_results_<profile>.js into')
+    parser.add_argument('--resources', type=int, default=100, help='resources per resource type and region')
+    parser.add_argument('--regions', type=int, default=4, help=f'regions per regional service, at most {len(REGIONS)}')
+    parser.add_argument('--services', type=int, default=None,
+                        help=f'number of services, at most {len(ss_converter_aws.SERVICE_EV_FIELDS)} (default: all)')
+    parser.add_argument('--findings', type=int, default=20, help='findings per service')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--profile', default='bench', help='aws profile name of the report')
+
+    args = parser.parse_args()
+
+    path = args.output
+    if os.path.isdir(path):
+        path = os.path.join(path, f'scoutsuite_results_{args.profile}.js')
+    make_report(path, args.resources, args.regions, args.services, args.findings, args.seed, args.profile)
+    print(f'{path} {os.path.getsize(path) / 2 ** 20:.1f} MB')
@@ -1,25 +1,65 @@
 import argparse
 import boto3
+import botocore.config
+import botocore.exceptions
+import collections
+import concurrent.futures
 import re
 import csv
+import io
 import json
+import os
+import random
 import sys
 import datetime
+import threading
 import time
 import traceback
 
+import ss_org_tree
+import ss_output
+
 csv_headers = ['aws_profile_name', 'aws_account_id', 'ou', 'ou_name', 'status']
+PARTIAL_SUFFIX = '.partial' # lists being written by a running crawl
 
 client_type = 'organizations'
 default_region = 'us-east-1'
 
-next_token = None
-max_results = 20
-backoff = 1 # backoff by fibonnacci
+max_results = 20 # largest page size the Organizations list calls accept
+workers = 4 # threads issuing API calls while walking the ous
+api_rate = 4 # starting API calls per second shared by all threads
+api_max_rate = 10 # ceiling the rate climbs back to between throttles, keep around the Organizations quota of the management account
+api_min_rate = 0.5 # floor the rate is cut down to on throttles
+rate_step = 0.5 # calls per second the rate climbs by per second of calls without throttles
+rate_backoff = 0.5 # factor the rate is cut by per throttle
+retries = 8 # attempts per call after the first, before the collector gives up
+backoff = 0.5 # seconds, base of the exponential backoff between attempts
+max_backoff = 20 # seconds, cap of the backoff between attempts
+
+policy_types = ['SERVICE_CONTROL_POLICY','TAG_POLICY']
+# policy: list the policies of each type once, then the targets of every policy (policies + targets calls)
+# target: list the policies of each type attached to every ou and root (2 x ous calls)
+POLICY_MODES = ['policy', 'target']
+
+# error codes Organizations throttles with, those cut the rate as well as being retried
+THROTTLE_CODES = {'TooManyRequestsException', 'ThrottlingException', 'Throttling'}
+# transient server side errors, retried without touching the rate, as is any other HTTP 5xx
+RETRY_CODES = THROTTLE_CODES | {'ServiceException', 'ServiceUnavailableException', 'InternalFailure'}
+# connection failures and timeouts raised by botocore before a response, retried without touching the rate
+RETRY_EXCEPTIONS = (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError)
 
 client = None
+limiter = None
+journal = None
+lists = None # OrgLists streaming the account list and details as the crawl resolves them
+api_calls = collections.Counter() # calls per operation, retries included
+api_throttles = collections.Counter() # throttled calls per operation
+api_retries = collections.Counter() # retried calls per operation
+backoff_slept = 0.0 # seconds slept backing off, summed over the threads
+stats_lock = threading.Lock()
 master_account = {}
 master_ou = {}
+org_tree = ss_org_tree.OrgTree() # roots, ous and account placement, indexed for path lookups
 
 time_start = datetime.datetime.now()
 
@@ -29,7 +69,7 @@ def get_timestamp():
 
 
 def run_setup():
-    global client
+    global client, limiter, retries
 
     parser = argparse.ArgumentParser()
 
@@ -48,15 +88,58 @@ def run_setup():
                          default=None,
                          dest='aws_secret_access_key',
                          help='AWS Secret Access Key')
+    parser.add_argument('--codec',
+                         choices=ss_output.CODECS,
+                         default='none',
+                         help='Compress the account and org detail files while writing, adds .gz or .zst to their names')
+    parser.add_argument('--level',
+                         type=int,
+                         default=None,
+                         help='Compression level, default: gzip 6, zstd 3')
+    parser.add_argument('--workers',
+                         type=int,
+                         default=workers,
+                         help=f'Threads issuing API calls while walking the ous, default: {workers}')
+    parser.add_argument('--rate',
+                         type=float,
+                         default=api_rate,
+                         help=f'Starting API calls per second shared by all threads, adapted to throttles from there. default: {api_rate}')
+    parser.add_argument('--max-rate',
+                         type=float,
+                         default=api_max_rate,
+                         help=f'Ceiling of the adapted API call rate, default: {api_max_rate}')
+    parser.add_argument('--policies',
+                         choices=POLICY_MODES,
+                         default='policy',
+                         help='Collect the policies attached to ous per policy (one call per policy, default) or per ou (two calls per ou)')
+    parser.add_argument('--journal',
+                         default='aws_org_collector.journal',
+                         help='Checkpoint journal of the crawl, removed once the lists are written. default: aws_org_collector.journal')
+    parser.add_argument('--resume',
+                         action='store_true',
+                         help='Rebuild the crawl from the journal of a failed run and continue only the unfinished work')
+    parser.add_argument('--retries',
+                         type=int,
+                         default=retries,
+                         help=f'Attempts per throttled or failed API call after the first, default: {retries}')
 
     args = parser.parse_args()
 
+    retries = args.retries
+    limiter = TokenBucket(args.rate, max_rate=max(args.rate, args.max_rate))
+
+    # throttles, transient errors and connection failures are retried by api_call, which also slows the
+    # shared rate down on throttles, rather than by botocore
+    config = botocore.config.Config(retries={'max_attempts': 0})
     if args.profile:
             session = boto3.Session(profile_name=args.profile)
-            client = session.client(client_type)
+            client = session.client(client_type, config=config)
     else:
-            client = boto3.client(client_type, aws_access_key_id=args.aws_access_key_id, aws_secret_access_key=args.aws_secret_access_key)
-    
+            client = boto3.client(client_type, aws_access_key_id=args.aws_access_key_id, aws_secret_access_key=args.aws_secret_access_key,
+                                  config=config)
+
+    return args
+
 
 def copy_list(account, ou=None):
     '''
@@ -79,73 +162,358 @@ def copy_list(account, ou=None):
 
     master_account[account_id]['org_id'] = account['Arn'].split('/')[1]
 
-def append_ou_policies(ou_id, policy_type, next_token=None, last_check=None):
+class TokenBucket(object):
     '''
-    iterate through specified service control or tag policy and copy to ou info
-    :type ou_id: str
-    :param ou_id: ou reference
-    :type policy_type: str
-    :param policy_type: service control or tag policy
-    :type next_token: str
-    :param next_token: paginator token
-    :type last_check: datetime
-    :param last_check: timestamp of the last iteration of this API
+    token bucket shared by every collector thread. Organizations throttles per management account
+    rather than per caller, so all API calls draw from this one bucket instead of sleeping on their own.
+
+    the rate adapts AIMD style: it climbs by rate_step per second of successful calls up to max_rate
+    and is cut by rate_backoff on a throttle, down to api_min_rate
     '''
 
-    try:
-        if next_token is None:
-            time_check = datetime.datetime.now()
-            response = client.list_policies_for_target(TargetId=ou_id,Filter=policy_type, MaxResults=max_results)
+    def __init__(self, rate, burst=None, max_rate=None):
+        '''
+        :type rate: float
+        :param rate: starting API calls per second
+        :type burst: int
+        :param burst: calls allowed back to back after an idle period, default: rate
+        :type max_rate: float
+        :param max_rate: ceiling of the rate, default: rate
+        '''
+        self.rate = rate
+        self.max_rate = max_rate or rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.cut = 0.0
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.waited = 0.0
+        self.low = rate
+
+    def acquire(self):
+        '''
+        take a token, sleeping until it is due. tokens are reserved under the lock and slept for
+        outside it, so waiting threads are released in arrival order at the configured rate
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            self.calls += 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.waited += delay
+
+        if delay:
+            time.sleep(delay)
+
+    def succeeded(self):
+        with self.lock:
+            # rate calls are made per second, each adds its share of the step
+            self.rate = min(self.max_rate, self.rate + rate_step / self.rate)
+
+    def throttled(self):
+        '''
+        cut the rate. the threads throttled by the same burst all report it, the rate is only cut
+        once per second so one burst does not collapse it to the floor
+        '''
+        with self.lock:
+            now = time.monotonic()
+            if now - self.cut < 1:
+                return
+            self.cut = now
+            self.rate = max(api_min_rate, self.rate * rate_backoff)
+            # drop the burst credit earned at the old rate
+            self.tokens = min(self.tokens, 1)
+            self.low = min(self.low, self.rate)
+            print(f'{get_timestamp()} throttled, api rate cut to {self.rate:.2f}/s')
+
+
+class CrawlJournal(object):
+    '''
+    append-only checkpoint of the crawl, one JSON line per API result it is built from:
+        start       policy mode of the crawl
+        accounts    a list_accounts page and the token of the next page
+        roots       the roots
+        policies    the policies of every type (policy mode)
+        targets     the targets of one policy (policy mode)
+        ou          a merged ou: its policies (target mode), accounts and child ous
+
+    resuming replays these through the same code as a live crawl. the pending frontier is not
+    written, it is rebuilt from the journaled ous: every child ou without a record of its own is
+    still to visit. a line cut short by the failure is dropped
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.policy_mode = None
+        self.accounts = []
+        self.accounts_token = None
+        self.accounts_done = False
+        self.roots = None
+        self.policies = None
+        self.targets = {}
+        self.visited = {}
+        self._fp = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, datetime.datetime):
+            return {'$datetime': value.isoformat()}
+        raise TypeError(f'cannot journal {type(value).__name__}')
+
+    @staticmethod
+    def _decode(obj):
+        if len(obj) == 1 and '$datetime' in obj:
+            return datetime.datetime.fromisoformat(obj['$datetime'])
+        return obj
+
+    def replay(self):
+        '''
+        load the journal of a previous run
+        :returns: byte offset of the end of the last complete record
+        '''
+        end = 0
+        with open(self.path, 'rb') as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line, object_hook=self._decode)
+                except ValueError:
+                    print(f'{get_timestamp()} journal {self.path}: dropping incomplete record at offset {end}')
+                    break
+                end += len(line)
+
+                record_type = record['t']
+                if record_type == 'start':
+                    self.policy_mode = record['policies']
+                elif record_type == 'accounts':
+                    self.accounts.append(record['items'])
+                    self.accounts_token = record['next']
+                    self.accounts_done = record['next'] is None
+                elif record_type == 'roots':
+                    self.roots = record['items']
+                elif record_type == 'policies':
+                    self.policies = record['items']
+                elif record_type == 'targets':
+                    self.targets[record['policy']] = record['items']
+                elif record_type == 'ou':
+                    self.visited[record['id']] = record
+        return end
+
+    def open(self, policy_mode, resume=False):
+        '''
+        :type policy_mode: str
+        :param policy_mode: policy mode of this run, a resumed crawl keeps the one it was started with
+        :type resume: bool
+        :param resume: replay and append to an existing journal, otherwise start a new one
+        :returns: policy mode to crawl with
+        '''
+        if resume and os.path.exists(self.path):
+            end = self.replay()
+            self._fp = open(self.path, 'r+', encoding='utf-8')
+            self._fp.seek(end)
+            self._fp.truncate()
+            print(f'{get_timestamp()} resuming from journal {self.path}: account pages={len(self.accounts)} '
+                  f'accounts done={self.accounts_done} ous={len(self.visited)} policy targets={len(self.targets)}')
+            if self.policy_mode:
+                if self.policy_mode != policy_mode:
+                    print(f'{get_timestamp()} journal was started with --policies {self.policy_mode}, resuming with it')
+                return self.policy_mode
         else:
-            time_check = datetime.datetime.now()
-
-            # if there's a token specified, last_check timestamp must be provided
-            assert(type(last_check) == datetime.datetime)
-            run_diff = (time_check - last_check).total_seconds()
-
-            if run_diff < 1:
-                delta = round(1 - run_diff, 6)
-                print(f'{get_timestamp()} sleeping for: {delta} seconds')
-                time.sleep(delta)
-
-            response = client.list_policies_for_target(NextToken=next_token, MaxResults=max_results)
-
-            last_check = time_check
-    except Exception as e:
-        if type(e).__name__ == "TooManyRequestsException":
-            print(f'{get_timestamp()} force sleeping for: {backoff} second')
-            time.sleep(backoff)
-            backoff += backoff
-            # retry
-            append_ou_policies(ou_id, policy_type, next_token, time_check)
+            if resume:
+                print(f'{get_timestamp()} no journal to resume at {self.path}, starting over')
+            self._fp = open(self.path, 'w', encoding='utf-8')
+
+        self.write('start', policies=policy_mode, time=get_timestamp())
+        return policy_mode
+
+    def write(self, record_type, **fields):
+        '''
+        append a record, flushed so it survives the collector failing right after
+        '''
+        line = json.dumps(dict(t=record_type, **fields), default=self._encode)
+        with self._lock:
+            self._fp.write(line)
+            self._fp.write('\n')
+            self._fp.flush()
+
+    def close(self, remove=False):
+        if self._fp:
+            self._fp.close()
+            self._fp = None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _done(result):
+    '''
+    :returns: future already holding a result replayed from the journal
+    '''
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+
+def _retry_wait(operation, attempt, reason, throttle=False):
+    '''
+    count a retry and sleep its backoff
+    :type attempt: int
+    :param attempt: failed attempt, from 0
+    :type reason: str
+    :param reason: error code or exception name, printed
+    :type throttle: bool
+    :param throttle: counted as a throttle as well
+    '''
+    global backoff_slept
+
+    # full jitter keeps the throttled threads from retrying in lock step
+    delay = random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+    with stats_lock:
+        if throttle:
+            api_throttles[operation] += 1
+        api_retries[operation] += 1
+        backoff_slept += delay
+    print(f'{get_timestamp()} {operation} {reason}, retry {attempt + 1}/{retries} in {delay:.2f}s')
+    time.sleep(delay)
+
+
+def api_call(operation, **kwargs):
+    '''
+    call the Organizations API through the shared rate limiter. throttles, transient errors, HTTP 5xx
+    and connection failures are retried with jittered exponential backoff up to retries times,
+    anything else is raised
+    :type operation: str
+    :param operation: client method name, e.g. list_roots
+    :returns: response
+    '''
+    method = getattr(client, operation)
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        with stats_lock:
+            api_calls[operation] += 1
+        try:
+            response = method(**kwargs)
+        except botocore.exceptions.ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+            if (code not in RETRY_CODES and status < 500) or attempt == retries:
+                raise
+            if code in THROTTLE_CODES:
+                limiter.throttled()
+            _retry_wait(operation, attempt, code, code in THROTTLE_CODES)
+        except RETRY_EXCEPTIONS as e:
+            if attempt == retries:
+                raise
+            _retry_wait(operation, attempt, type(e).__name__)
+        else:
+            limiter.succeeded()
+            return response
+
+
+def iter_pages(operation, key, next_token=None, **kwargs):
+    '''
+    iterate the pages of a paginated Organizations API call, at the maximum page size.
+    pages are requested through api_call rather than a boto3 paginator, which cannot retry a page
+    once its call raised, so a throttled page is retried with the same token instead of being dropped
+    :type operation: str
+    :param operation: client method name, e.g. list_accounts
+    :type key: str
+    :param key: response key holding the items, e.g. Accounts
+    :type next_token: str
+    :param next_token: token of the page to start from, e.g. journaled by a failed run
+    :returns: generator of (items, token of the next page or None)
+    '''
+    while True:
+        if next_token:
+            page = api_call(operation, MaxResults=max_results, NextToken=next_token, **kwargs)
         else:
-            print(f'{get_timestamp()} print traceback: \n{traceback.format_exc()}')
-            sys.exit(1)
+            page = api_call(operation, MaxResults=max_results, **kwargs)
 
-    resp_code = response['ResponseMetadata'].get('HTTPStatusCode')
+        next_token = page.get('NextToken')
+        yield page[key], next_token
 
-    if resp_code != 200:
-        print(f'{get_timestamp()} response error: {resp_code}')
-        time.sleep(1)
+        if not next_token:
+            return
 
-    next_token = response.get('NextToken')
-    ou = master_ou[ou_id]
 
-    if not ou.get('policy_detail'):
-        ou['policy_detail'] = {}
+def paginate(operation, key, **kwargs):
+    '''
+    iterate the items of a paginated Organizations API call, see iter_pages
+    '''
+    for items, _ in iter_pages(operation, key, **kwargs):
+        yield from items
 
-    ou_policy_head = ou['policy_detail']
 
-    # append if policies captured do not exit
-    if not ou_policy_head.get(policy_type):
-        ou_policy_detail = ou['policy_detail'][policy_type] = {}
+def collect_accounts(next_token=None):
+    '''
+    copy the accounts of every list_accounts page, journaling each page along with the token of the next
+    :type next_token: str
+    :param next_token: token of the page to start from
+    '''
+    for items, next_token in iter_pages('list_accounts', 'Accounts', next_token):
+        for account in items:
+            copy_list(account)
+        if journal:
+            journal.write('accounts', items=items, next=next_token)
+
+
+def list_ou_policies(ou_id):
+    '''
+    collect the service control and tag policies attached to an ou or root
+    :type ou_id: str
+    :param ou_id: ou reference
+    :returns: dict of policy type to dict of policy id to policy summary
+    '''
+    policy_detail = {}
+    for policy_type in policy_types:
+        policy_detail[policy_type] = {policy['Id']: policy for policy in paginate('list_policies_for_target', 'Policies',
+                                                                                   TargetId=ou_id, Filter=policy_type)}
+    return policy_detail
+
+
+def list_policy_targets(policy_id):
+    '''
+    collect the roots, ous and accounts a policy is attached to
+    :type policy_id: str
+    :param policy_id: policy reference
+    :returns: list of targets
+    '''
+    targets = list(paginate('list_targets_for_policy', 'Targets', PolicyId=policy_id))
+    if journal:
+        journal.write('targets', policy=policy_id, items=targets)
+    return targets
+
+
+def invert_policy_targets(attached):
+    '''
+    invert the targets of every policy into the policies attached to each root and ou, in the shape
+    list_ou_policies gives. policies attached to accounts directly are not tracked, as before
+    :type attached: list
+    :param attached: list of (policy summary, future of its targets)
+    :returns: dict of root or ou id to dict of policy type to dict of policy id to policy summary
+    '''
+    policy_map = {}
+    for policy, targets in attached:
+        for target in targets.result():
+            if target.get('Type') == 'ACCOUNT':
+                continue
+            detail = policy_map.setdefault(target['TargetId'], {policy_type: {} for policy_type in policy_types})
+            detail[policy['Type']][policy['Id']] = policy
+    return policy_map
 
-    for policy in response['Policies']:
-        ou_policy_detail[policy['Id']] = policy
 
-    # if there are more policies to collect, make recursive call along with the tracking references
-    if next_token:
-        append_ou_policies(ou_id, policy_type, next_token, time_check)
+def list_children(parent_id):
+    '''
+    collect the accounts and ous directly under an ou or root
+    :type parent_id: str
+    :param parent_id: ou id
+    :returns: tuple of (accounts, ous)
+    '''
+    accounts = list(paginate('list_accounts_for_parent', 'Accounts', ParentId=parent_id))
+    ous = list(paginate('list_organizational_units_for_parent', 'OrganizationalUnits', ParentId=parent_id))
+    return accounts, ous
 
 
 def copy_ou(ou, parent_id=None):
@@ -183,9 +551,7 @@ def copy_ou(ou, parent_id=None):
         else:
             master_ou[parent_id]['child_id'].append(ou_id)
 
-    # append policy information for ou
-    for policy_type in ['SERVICE_CONTROL_POLICY','TAG_POLICY']:
-            append_ou_policies(ou_id, policy_type)
+    org_tree.add_ou(ou_id, ou.get('Name'), master_ou[ou_id]['Type'], parent_id)
 
 
 def append_ou_info(account_id, ou_reference=None):
@@ -220,270 +586,290 @@ def append_ou_info(account_id, ou_reference=None):
         ou_detail['message'] = 'not associated to an ou'
 
 
-def process_accounts(parent_id, next_token=None, idx=0, count=0, last_check=0):
+def process_accounts(parent_id, accounts):
     '''
-    based on parent id, gather all ous and associated accounts for tracking
+    append ou information to the accounts directly under an ou or root
     :type parent_id: str
     :param parent_id: ou id
-    :type next_token: str
-    :param next_token: token for pagination
-    :type idx: int
-    :param idx: iterator index for tracking
-    :type count: int
-    :param count: count of total accounts
-    '''
-
-    # iterate through all orgs from parent
-    try:
-        if next_token == None:
-            time_check = datetime.datetime.now()
-            response = client.list_accounts_for_parent(ParentId=parent_id, MaxResults=max_results)
-
-        else:
-            time_check = datetime.datetime.now()
-            run_diff = (time_check - last_check).total_seconds()
-
-            if run_diff < 1:
-                delta = round(1 - run_diff, 6)
-                print(f'{get_timestamp()} sleeping for: {delta} seconds')
-                time.sleep(delta)
-
-            response = client.list_accounts_for_parent(ParentId=parent_id, NextToken=next_token, MaxResults=max_results)
-
-            last_check = time_check
-    except Exception as e:
-        print(f'{get_timestamp()} printing traceback: \n{traceback.format_exc()}')
-        if type(e).__name__ == "TooManyRequestsException":
-            print(f'{get_timestamp()} force sleeping for: {backoff} second')
-            time.sleep(backoff)
-            backoff += backoff
-            return
-        else:
-            sys.exit(1)
-
-    '''response.keys()
-    dict_keys(['Children', 'NextToken', 'ResponseMetadata'])
+    :type accounts: list
+    :param accounts: accounts listed for the parent
     '''
-
-    resp_code = response['ResponseMetadata'].get('HTTPStatusCode')
-
-    if resp_code != 200:
-        print(f'{get_timestamp()} response error: {resp_code}')
-        time.sleep(1)
-
-    next_token = response.get('NextToken')
-    idx += 1
     ou_id = parent_id if 'r-' not in parent_id else None
 
-    for account in response['Accounts']:
+    for account in accounts:
+        # already written under another parent, its record is gone from master_account. the first parent is kept
+        if lists and account['Id'] in lists.written:
+            print(f'{get_timestamp()} account ou validation check: orig ou={org_tree.account_ou.get(account["Id"])} new ou={parent_id} '
+                  f'aws_account_id={account["Id"]}, keeping orig ou')
+            continue
+
         # add accounts
         if account['Id'] not in master_account:
             print(f'account is missing from original list: aws_account_id={account["Id"]} aws_account_name={account["Name"]}')
+            copy_list(account)
 
         # append some final relevant org info for account
         append_ou_info(account['Id'], ou_id)
+        org_tree.add_account(account['Id'], parent_id)
 
-    count += len(response['Accounts'])
-    print(f'processed aws accounts for ou={parent_id}: count={len(response["Accounts"])} total={count}')
-
-    # if there are more policies to collect, make recursive call along with the tracking references
-    if next_token:
-        process_accounts(parent_id, next_token, idx, count, time_check)
-'''             
-        append_ou_policies(ou_id, policy_type, next_token, last_check)
+        # the account is complete once its ou is known
+        if lists:
+            lists.write_account(account['Id'])
 
-        resp_accounts = client.list_accounts_for_parent(ParentId=ou_id)
-        for account in resp_accounts['Accounts']:
-            # add accounts
-            if account['Id'] not in master_account:
-                print(f'accout is missing from original list: aws_account_id={account["Id"]} aws_account_name={account["Name"]}')
+    print(f'processed aws accounts for ou={parent_id}: count={len(accounts)}')
 
-            # append some final relevant org info for account
-            append_ou_info(account['Id'], ou_id)
 
-'''
-
-def process_org_units(parent_id, next_token=None, idx=0):
+def process_org_units(roots, workers, policy_mode='policy'):
     '''
-    based on parent id, gather all ous and associated accounts for tracking
-    :type parent_id: str
-    :param parent_id: ou id
-    :type next_token: str
-    :param next_token: token for pagination
-    :type idx: int
-    :param idx: iterator index for tracking
-    :type count: int
-    :param count: count of total accounts
+    walk the ous breadth first from the roots. the policies and children of every ou are listed
+    on a bounded thread pool, while the results are merged here in breadth first order, so the
+    master lists come out the same no matter which calls finish first
+    :type roots: list
+    :param roots: roots from list_roots
+    :type workers: int
+    :param workers: number of threads issuing API calls
+    :type policy_mode: str
+    :param policy_mode: policy: list the targets of every policy alongside the walk and invert them
+                        once it is done. target: list the policies of every ou as it is visited
+
+    results already in the journal of a resumed crawl are replayed instead of listed again,
+    new ones are journaled as they are merged.
+
+    a merged ou is complete once its child ous are copied and its policies known, it is then
+    handed to lists and dropped. in policy mode the merged ous wait for the policy targets, which
+    are listed first and usually done after the first levels
     '''
+    visited = journal.visited if journal else {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        frontier = collections.deque()
+        attached = []
+        pending = collections.deque()
+        policy_map = None if policy_mode == 'policy' else {}
+        targets_done = 0
+
+        def flush_ous(wait=False):
+            nonlocal policy_map, targets_done
+            if policy_map is None:
+                while targets_done < len(attached) and (wait or attached[targets_done][1].done()):
+                    attached[targets_done][1].result()
+                    targets_done += 1
+                if targets_done < len(attached):
+                    return
+                policy_map = invert_policy_targets(attached)
+
+            while pending:
+                ou_id = pending.popleft()
+                policy_detail = master_ou[ou_id]['policy_detail']
+                for policy_type, policies in policy_map.pop(ou_id, {}).items():
+                    policy_detail[policy_type].update(policies)
+                if lists:
+                    lists.write_ou(ou_id)
+
+        def visit(ou, parent_id=None, depth=0):
+            copy_ou(ou, parent_id)
+            record = visited.get(ou['Id'])
+            if record:
+                policies = _done(record['policies']) if policy_mode == 'target' else None
+                children = _done((record['accounts'], record['ous']))
+            else:
+                policies = pool.submit(list_ou_policies, ou['Id']) if policy_mode == 'target' else None
+                children = pool.submit(list_children, ou['Id'])
+            frontier.append((ou['Id'], depth, policies, children, record is not None))
 
-    # iterate through all orgs from parent
-    try:
-        if next_token == None:
-            last_check = datetime.datetime.now()
-            response = client.list_organizational_units_for_parent(ParentId=parent_id,  MaxResults=max_results)
-
-        else:
-            time_check = datetime.datetime.now()
-            run_diff = (time_check - last_check).total_seconds()
-
-            if run_diff < 1:
-                delta = round(1 - run_diff, 6)
-                print(f'sleeping for: {delta} seconds')
-                time.sleep(delta)
-
-            response = client.list_organizational_units_for_parent(ParentId=parent_id, NextToken=next_token, MaxResults=max_results)
-
-            last_check = time_check
-    except Exception as e:
-        print(f'printing traceback: \n{traceback.format_exc()}')
-        if type(e).__name__ == "TooManyRequestsException":
-            print(f'force sleeping for: {backoff} second')
-            time.sleep(backoff)
-            backoff += backoff
-            return
-        else:
-            sys.exit(1)
-
-    '''response.keys()
-    dict_keys(['Children', 'NextToken', 'ResponseMetadata'])
+        try:
+            if policy_mode == 'policy':
+                policies = journal.policies if journal else None
+                if policies is None:
+                    policies = [policy for policy_type in policy_types for policy in paginate('list_policies', 'Policies', Filter=policy_type)]
+                    if journal:
+                        journal.write('policies', items=policies)
+
+                targets = journal.targets if journal else {}
+                for policy in policies:
+                    if policy['Id'] in targets:
+                        attached.append((policy, _done(targets[policy['Id']])))
+                    else:
+                        attached.append((policy, pool.submit(list_policy_targets, policy['Id'])))
+                print(f'{get_timestamp()} collecting targets of policies: count={len(attached)}')
+
+            for root in roots:
+                visit(root)
+
+            while frontier:
+                ou_id, depth, policies, children, replayed = frontier.popleft()
+
+                # policy mode fills these in from the policy targets before the ou is written
+                master_ou[ou_id]['policy_detail'] = policies.result() if policies else {policy_type: {} for policy_type in policy_types}
+
+                accounts, ous = children.result()
+                if journal and not replayed:
+                    journal.write('ou', id=ou_id, policies=policies.result() if policies else None, accounts=accounts, ous=ous)
+                process_accounts(ou_id, accounts)
+
+                # queue the child ous behind the rest of this level
+                for ou in ous:
+                    print(f'tracking OU details: ou_id={ou["Id"]} parent_id={ou_id} ou_depth={depth + 1}')
+                    visit(ou, ou_id, depth + 1)
+
+                pending.append(ou_id)
+                flush_ous()
+                if lists:
+                    lists.flush()
+
+            flush_ous(wait=True)
+        except BaseException:
+            # do not wait for the calls still queued before failing
+            for _, _, policies, children, _ in frontier:
+                if policies:
+                    policies.cancel()
+                children.cancel()
+            for _, targets in attached:
+                targets.cancel()
+            raise
+
+
+class OrgLists(object):
     '''
+    the account list csv, plus account and org details as JSON lines and the indexed org tree,
+    written as the crawl resolves each account and ou rather than once it is done. records are
+    dropped from master_account and master_ou once written, the org tree is what stays in memory.
 
-    resp_code = response['ResponseMetadata'].get('HTTPStatusCode')
-
-    if resp_code != 200:
-        print(f'{get_timestamp()} response error: {resp_code}')
-        time.sleep(1)
-
-    next_token = response.get('NextToken')
-    idx += 1
-
-    # process each ou for its associated accounts and then traverse for child ous
-    for ou in response['OrganizationalUnits']:
-        ou_id = ou['Id']
-        print(f'tracking OU details: ou_id={ou_id} parent_id={parent_id}')
-
-        copy_ou(ou, parent_id)
-
-        # hard enforce rate limiting
-        time.sleep(.1)
-
-        print(f'processing aws accounts for ou={ou_id}: ou_depth={idx}')
-
-        # gather accounts associated to ou 
-        process_accounts(ou_id)
-
-        process_org_units(ou_id, next_token, idx)
-
+    the lists are written to .partial files and moved into place by finalize_lists, so a failed
+    crawl leaves the lists of the last complete one. the csv .partial is flushed per ou and may be
+    followed while the crawl runs
+    '''
 
-def finalize_lists(filename_account_list='aws_account_list.csv', filename_accounts='aws_account_detail.txt', filename_orgs='aws_orgs_detail.txt'):
+    def __init__(self, filename_account_list='aws_account_list.csv', filename_accounts='aws_account_detail.txt',
+                 filename_orgs='aws_orgs_detail.txt', codec='none', level=None, filename_tree='aws_org_tree.json'):
+        '''
+        :type codec: str
+        :param codec: compress the detail files while writing (none, gzip, zstd), their codec suffix is added.
+                      the csv is read by aws_configurate.sh and is never compressed
+        :type level: int
+        :param level: compression level, default per codec
+        :type filename_tree: str
+        :param filename_tree: org tree with the ou path of every account, see ss_org_tree.py. never compressed either
+        '''
+        suffix = ss_output.CODEC_SUFFIXES[codec]
+        self.filename_tree = filename_tree
+        self.paths = [filename_account_list, filename_accounts + suffix, filename_orgs + suffix]
+        self.written = set()
+        self.ous = 0
 
-    fpa = open(filename_account_list, 'w')
-    fp_accounts = open(filename_accounts, 'w')
-    fp_orgs = open(filename_orgs, 'w')
+        self.fpa = open(filename_account_list + PARTIAL_SUFFIX, 'w')
+        self.fp_accounts = io.TextIOWrapper(ss_output.open_sink(filename_accounts + suffix + PARTIAL_SUFFIX, codec, level), encoding='utf-8')
+        self.fp_orgs = io.TextIOWrapper(ss_output.open_sink(filename_orgs + suffix + PARTIAL_SUFFIX, codec, level), encoding='utf-8')
 
-    account_writer = csv.writer(fpa, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-    # write csv header
-    account_writer.writerow(csv_headers)
+        self.account_writer = csv.writer(self.fpa, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        # write csv header
+        self.account_writer.writerow(csv_headers)
 
-    for aws_account_id in master_account:
-        account = master_account[aws_account_id]
+    def write_account(self, aws_account_id):
+        account = master_account.pop(aws_account_id)
+        self.written.add(aws_account_id)
 
         temp_ou_name = account.get('ou_detail').get('ou_name') if account.get('ou_detail') else None
 
         # write to account csv
-        account_writer.writerow([
+        self.account_writer.writerow([
                     re.sub(r'[ _,\/]', '_', account['Name']).replace('__','_'),
                     #re.sub(r'[ _,()]', '_', account['Name']).replace('__','_'),
                     #account['Name'].replace(' ', '_').replace(',','_'),
-                    aws_account_id, 
+                    aws_account_id,
                     account.get('ou'),
                     temp_ou_name,
                     account['Status']])
 
         # write account detail
-        fp_accounts.write(json.dumps(account))
-        fp_accounts.write('\n')
-
-    for org_id in master_ou:
-        fp_orgs.write(json.dumps(master_ou[org_id]))
-        fp_orgs.write('\n')
+        self.fp_accounts.write(json.dumps(account))
+        self.fp_accounts.write('\n')
 
-    # close fps
-    fpa.close()
-    fp_accounts.close()
-    fp_orgs.close()
+    def write_ou(self, ou_id):
+        self.fp_orgs.write(json.dumps(master_ou.pop(ou_id)))
+        self.fp_orgs.write('\n')
+        self.ous += 1
 
+    def flush(self):
+        # only the csv, flushing the compressed details this often would cost their ratio
+        self.fpa.flush()
 
-if __name__ == "__main__":
-    run_setup()
-
-    # collect all accounts under root
-    print(f'begin collecting aws accounts from root.')
-
-    list_iter = 0
-
-    while(True):
-
-        print(f'processing list pull: idx={list_iter}')
-        try:
-            if next_token is None:
-                last_check = datetime.datetime.now()
-                response = client.list_accounts()
-            else:
-                time_check = datetime.datetime.now()
-
-                run_diff = (time_check - last_check).total_seconds()
-
-                if run_diff < 1:
-                    delta = round(1 - run_diff, 6)
-                    print(f'sleeping for: {delta} seconds')
-                    time.sleep(delta)
-
-                response = client.list_accounts(NextToken=next_token, MaxResults=max_results)
-
-                last_check = time_check
-        except Exception as e:
-            print(f'printing traceback: \n{traceback.format_exc()}')
-            if type(e).__name__ == "TooManyRequestsException":
-                print(f'force sleeping for: {backoff} second')
-                time.sleep(backoff)
-                backoff += backoff
-                continue
-            else:
-                sys.exit(1)
-
-        '''response.keys()
-        dict_keys(['Accounts', 'NextToken', 'ResponseMetadata'])
+    def close(self, complete=True):
+        '''
+        :type complete: bool
+        :param complete: move the lists into place, otherwise leave the .partial files of a failed crawl
         '''
+        self.fpa.close()
+        self.fp_accounts.close()
+        self.fp_orgs.close()
 
-        resp_code = response['ResponseMetadata'].get('HTTPStatusCode')
+        if complete:
+            for path in self.paths:
+                os.replace(path + PARTIAL_SUFFIX, path)
+            org_tree.index()
+            org_tree.dump(self.filename_tree)
 
-        if resp_code != 200:
-            print(f'{get_timestamp()} response error: {resp_code}')
 
-        next_token = response.get('NextToken')
+def finalize_lists():
+    '''
+    write the accounts and ous the crawl never placed, then move the lists and org tree into place
+    '''
+    for aws_account_id in list(master_account):
+        print(f'{get_timestamp()} account not found under any ou: aws_account_id={aws_account_id}')
+        lists.write_account(aws_account_id)
 
-        for account in response['Accounts']:
-            copy_list(account)
+    for org_id in list(master_ou):
+        lists.write_ou(org_id)
 
-        # if no more entries, exit
-        if not next_token:
-            break
-        list_iter += 1
+    lists.close()
 
-    print(f'{get_timestamp()} completed collecting aws accounts from root. count={len(master_account)}')
-    print(f'{get_timestamp()} begin collecting org units from root.')
 
-    resp_roots = client.list_roots()
-    for root in resp_roots['Roots']:
-        parent_id = root['Id']
-        copy_ou(root)
+if __name__ == "__main__":
+    args = run_setup()
+
+    journal = CrawlJournal(args.journal)
+    policy_mode = journal.open(args.policies, args.resume)
+    lists = OrgLists(codec=args.codec, level=args.level)
 
-        # gather accounts not associated to an ou 
-        process_accounts(parent_id)     
-        process_org_units(parent_id)
+    try:
+        # collect all accounts under root, continuing after the last journaled page on resume
+        print(f'begin collecting aws accounts from root.')
+
+        for items in journal.accounts:
+            for account in items:
+                copy_list(account)
+
+        if not journal.accounts_done:
+            try:
+                collect_accounts(journal.accounts_token)
+            except botocore.exceptions.ClientError as e:
+                # tokens of a failed run may have expired, accounts already copied are updated in place
+                if not journal.accounts_token or e.response.get('Error', {}).get('Code') != 'InvalidInputException':
+                    raise
+                print(f'{get_timestamp()} journaled list_accounts token rejected, listing accounts from the start')
+                collect_accounts()
+
+        print(f'{get_timestamp()} completed collecting aws accounts from root. count={len(master_account)}')
+        print(f'{get_timestamp()} begin collecting org units from root. workers={args.workers} rate={args.rate} policies={policy_mode}')
+
+        roots = journal.roots
+        if roots is None:
+            roots = list(paginate('list_roots', 'Roots'))
+            journal.write('roots', items=roots)
+
+        process_org_units(roots, args.workers, policy_mode)
+    except Exception:
+        print(f'{get_timestamp()} printing traceback: \n{traceback.format_exc()}')
+        journal.close()
+        lists.close(complete=False)
+        print(f'{get_timestamp()} progress kept in {args.journal}, rerun with --resume to continue')
+        sys.exit(1)
 
-    print(f'{get_timestamp()} completed collecting org units from root. count={len(master_ou)}')
+    print(f'{get_timestamp()} completed collecting org units from root. count={lists.ous} accounts={len(lists.written)}')
+    print(f'{get_timestamp()} api calls={sum(api_calls.values())} throttled={sum(api_throttles.values())} paced={limiter.waited:.1f}s '
+          f'backoff={backoff_slept:.1f}s rate: final={limiter.rate:.2f}/s low={limiter.low:.2f}/s')
+    for operation in sorted(api_calls):
+        print(f'{get_timestamp()} api operation={operation} calls={api_calls[operation]} throttled={api_throttles[operation]} retried={api_retries[operation]}')
 
     '''
     from pprint import pprint as pp
@@ -514,8 +900,9 @@ if __name__ == "__main__":
 
     '''
 
-    # dump all account and org information into CSV for processing, JSON for collection
+    # move the account and org information into place, CSV for processing, JSON for collection
     finalize_lists()
+    journal.close(remove=True)
 
     time_end = datetime.datetime.now()
     print(f'{get_timestamp()} completed org collector script. duration: {time_end-time_start}')
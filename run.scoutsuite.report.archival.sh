@@ -8,13 +8,14 @@ LIMIT_ARCHIVE=10
 LIMIT_DELETE=14
 REPORT_BASE=20*-*
 PREFIX_ARCHIVE=archive.scoutsuite
+STAGING_DIR=$REPORT_DIR/.archive.staging # gzipped copies of the uncompressed files of the folder being archived
 LOGFILE=$LOGDIR/collector.scoutsuite_runner.log
 TIMESTAMP=`date +"%Y-%m-%d %H:%M:%S.%3N%z"`
 PROC_NAME="report_archival"
 
 # get date from folder based on latest file
 function get_latest_date() {
-    DATE_FOLDER=`find $1 -type f -name 'report.scoutsuite.*.txt' -exec stat \{} --printf="%y\n" \; | sort -n -r | head -n 1`
+    DATE_FOLDER=`find $1 -type f -name 'report.scoutsuite.*.txt*' -exec stat \{} --printf="%y\n" \; | sort -n -r | head -n 1`
 }
 
 echo "$TIMESTAMP $PROC_NAME: archiving: begin archiving scoutsuite reports" >> $LOGFILE
@@ -26,7 +27,7 @@ for FOLDER in `find $REPORT_DIR -ctime +$LIMIT_ARCHIVE -type d -name "$REPORT_BA
 
     get_latest_date $FOLDER
     FOLDER_NAME=`basename $FOLDER`
-    ARCHIVE_NAME="${PREFIX_ARCHIVE}.${FOLDER_NAME}.tgz"
+    ARCHIVE_NAME="${PREFIX_ARCHIVE}.${FOLDER_NAME}.tar"
     FILE_COUNT=`find $REPORT_DIR -type f | wc -l`
     ARCHIVE_FILE="${REPORT_DIR}/${ARCHIVE_NAME}"
 
@@ -34,9 +35,22 @@ for FOLDER in `find $REPORT_DIR -ctime +$LIMIT_ARCHIVE -type d -name "$REPORT_BA
 
     CHK_FLAG=0
     cd $REPORT_DIR
-    #echo "tar -czf $ARCHIVE_FILE $FOLDER_NAME"
-    tar -czf $ARCHIVE_FILE $FOLDER_NAME
-    CHK_FLAG=$? # return 0 if success
+    # the folder is left untouched until the archive is complete, so its reports keep matching their .idx offsets
+    # and .hashes sidecars. files not compressed yet (results, exceptions) are gzipped into a staging folder,
+    # converted reports written with a codec are archived as they are instead of gzipping them again.
+    # only read, so their ctime does not change and the runner's -cnewer selection does not pick them up
+    rm -rf $STAGING_DIR
+    mkdir -p $STAGING_DIR/$FOLDER_NAME
+    find $FOLDER_NAME -type f ! -name '*.gz' ! -name '*.zst' | while read FILE; do
+        mkdir -p "$STAGING_DIR/`dirname "$FILE"`" && gzip -c -6 "$FILE" > "$STAGING_DIR/$FILE.gz" || exit 1
+    done
+    CHK_FLAG=$?
+    if [ $CHK_FLAG == 0 ]; then
+        # written under a temporary name so an interrupted run never leaves a partial archive behind
+        find $FOLDER_NAME -type f \( -name '*.gz' -o -name '*.zst' \) -print0 | tar -cf $ARCHIVE_FILE.tmp -C $STAGING_DIR $FOLDER_NAME -C $REPORT_DIR --null -T - && mv $ARCHIVE_FILE.tmp $ARCHIVE_FILE
+        CHK_FLAG=$? # return 0 if success
+    fi
+    rm -rf $STAGING_DIR $ARCHIVE_FILE.tmp
 
     if [ $CHK_FLAG == 0 ]; then
         touch -d "$DATE_FOLDER" $ARCHIVE_FILE
@@ -55,7 +69,7 @@ duration=$((te1 - ts1))
 echo "$TIMESTAMP $PROC_NAME: archiving: completed archiving scoutsuite reports. elapsed: $(($duration / 60)) min and $(($duration % 60)) sec" >> $LOGFILE
 
 # delete
-DELETE_LIST=`find $REPORT_DIR -ctime +$LIMIT_DELETE -type f -name "*$REPORT_BASE*tgz" | tr '\n' ' '`
+DELETE_LIST=`find $REPORT_DIR -ctime +$LIMIT_DELETE -type f \( -name "*$REPORT_BASE*tgz" -o -name "*$REPORT_BASE*tar" \) | tr '\n' ' '`
 
 # nothing found, no action, exit
 if [ -z "$DELETE_LIST" ]; then
@@ -63,8 +77,8 @@ if [ -z "$DELETE_LIST" ]; then
 fi
 
 echo "$TIMESTAMP $PROC_NAME: archiving: begin deleting scoutsuite archived reports: $DELETE_LIST" >> $LOGFILE
-echo "find $REPORT_DIR -ctime +$LIMIT_DELETE -type f -name "*$REPORT_BASE*tgz" -delete"
-find $REPORT_DIR -ctime +$LIMIT_DELETE -type f -name "*$REPORT_BASE*tgz" -delete
+echo "find $REPORT_DIR -ctime +$LIMIT_DELETE -type f \( -name "*$REPORT_BASE*tgz" -o -name "*$REPORT_BASE*tar" \) -delete"
+find $REPORT_DIR -ctime +$LIMIT_DELETE -type f \( -name "*$REPORT_BASE*tgz" -o -name "*$REPORT_BASE*tar" \) -delete
 CHK_FLAG=$? # return 0 if success
 
 if [ $CHK_FLAG != 0 ]; then
@@ -7,6 +7,13 @@ LOGDIR=$RUNNER_DIR/log
 SCOUTSUITE_SCRIPT=$SCOUTSUITE/ScoutSuite/scout.py
 GET_ORG_SCRIPT=$RUNNER_DIR/get_org_list.py
 SS_CONVERTER_SCRIPT=$RUNNER_DIR/ss_converter_aws.py
+SS_CONVERTER_BATCH_SCRIPT=$RUNNER_DIR/ss_converter_batch.py
+SS_METRICS_SCRIPT=$RUNNER_DIR/ss_metrics.py
+SS_EXPORT_SCRIPT=$RUNNER_DIR/ss_export.py
+SS_HEC_SCRIPT=$RUNNER_DIR/ss_hec.py
+SS_SUPERVISOR_SCRIPT=$RUNNER_DIR/ss_supervisor.py
+ACCOUNT_DETAIL=$RUNNER_DIR/aws_account_detail.txt # written by get_org_list.py
+ORGS_DETAIL=$RUNNER_DIR/aws_orgs_detail.txt
 PROFILE=$RUNNER_DIR/aws_profile_list.txt
 PROFILE_BUILDER_SCRIPT=$RUNNER_DIR/aws_configurate.sh
 LOGFILE=$LOGDIR/collector.scoutsuite_runner.log
@@ -19,41 +26,25 @@ TIMESTAMP_TAG=`date +"%Y-%m-%d.%H_%M_%S.%3N%z"`
 DATESTAMP_TAG=`date +"%Y-%m-%d"`
 
 MAX_NPROC=10
-NUM=0
-TOTAL=0
+SCAN_TIMEOUT=21600 # seconds a scan may run before it is terminated, 0: no limit
+SCAN_RETRIES=1 # attempts per failed or timed out scan after the first
+SCAN_RETRY_DELAY=300 # seconds before a failed scan is queued again
+SCAN_RESULTS=$LOGDIR/$DATESTAMP_TAG/scoutsuite_supervisor.$TIMESTAMP_TAG.tsv # status, profile, attempt, exit code, seconds, cpu seconds, peak MB and log per scan
+MAX_CONVERT_WORKERS=4 # report conversion worker processes
+DELTA_CONVERT=0 # 1: only convert events changed since the previous scan of each profile
+OUTPUT_CODEC=none # none, gzip or zstd: compress converted reports while writing
+CONVERT_METRICS=1 # 1: write a *.metrics.json sidecar per converted report and log the run's hot spots
+CONVERT_CACHE_DIR=$REPORT_DIR/.cache.converter # converted reports by results content hash, reused for identical re-runs
+CONVERT_CACHE_MAX_AGE=14 # days an unused cache entry is kept
+HEC_URL= # post events straight to this Splunk HTTP Event Collector while converting, e.g. https://splunk:8088. forwarders then only monitor report.scoutsuite.*.spill*. empty: forwarders pick up the converted reports
+HEC_TOKEN_FILE=$RUNNER_DIR/.hec_token # HEC token, passed in the environment to keep it off the command line
+EXPORT_DB=$REPORT_DIR/scoutsuite.db # 1 row per event of the latest report of every account, joined with accounts/OUs. empty: no export
 CNUM=0
 
 # Throttling params
 MAX_WORKERS=2
 MAX_RATE=5 # describe/list API calls per second
 
-function queue {
-    QUEUE="$QUEUE $1"
-    NUM=$(($NUM+1))
-}
-function regeneratequeue {
-    OLDREQUEUE=$QUEUE
-    QUEUE=""
-    NUM=0
-    for PID in $OLDREQUEUE
-    do
-        if [ -d /proc/$PID  ] ; then
-            QUEUE="$QUEUE $PID"
-            NUM=$(($NUM+1))
-        fi
-    done
-}
-function checkqueue {
-    OLDCHQUEUE=$QUEUE
-    for PID in $OLDCHQUEUE
-    do
-        if [ ! -d /proc/$PID ] ; then
-            regeneratequeue # at least one PID has finished
-            break
-        fi
-    done
-}
-
 if [ ! -d $LOGDIR ] || [ ! -d $LOGDIR/$DATESTAMP_TAG ]; then
     mkdir -p $LOGDIR
     mkdir -p $LOGDIR/$DATESTAMP_TAG
@@ -70,7 +61,11 @@ source $SCOUTSUITE/venv/bin/activate
 echo "$TIMESTAMP $PROC_NAME: creating aws account list from org..." >> $LOGFILE
 ts1=`date +%s`
 echo "executing: python3 $GET_ORG_SCRIPT -p $ORIG_AWS_PROFILE" >> $LOGFILE
-python3 $GET_ORG_SCRIPT -p $ORIG_AWS_PROFILE >> $LOGFILE
+if ! python3 $GET_ORG_SCRIPT -p $ORIG_AWS_PROFILE >> $LOGFILE; then
+    # pick the crawl up from its checkpoint journal rather than listing the whole org again
+    echo "$TIMESTAMP $PROC_NAME: org collector failed, resuming it once" >> $LOGFILE
+    python3 $GET_ORG_SCRIPT -p $ORIG_AWS_PROFILE --resume >> $LOGFILE
+fi
 te1=`date +%s`
 duration=$((te1 - ts1))
 
@@ -86,30 +81,30 @@ echo "$TIMESTAMP $PROC_NAME: aws config, proceeding to run botorator scoutsuite
 ts2=`date +%s`
 #PROFILE=$RUNNER_DIR/test_it.aws.profile.txt
 echo "profile path: $PROFILE"
-for AWS_PROFILE in `cat $PROFILE`; do
-    echo "$TIMESTAMP $PROC_NAME: processing AWS_PROFILE=$AWS_PROFILE" >> $LOGFILE
-
-    TOTAL=$((TOTAL+1))
-# print executed scoutsuite run into debug log
-    echo "python3 $SCOUTSUITE_SCRIPT aws --profile $AWS_PROFILE --max-workers $MAX_WORKERS --max-rate $MAX_RATE --report-dir $REPORT_DIR/$DATESTAMP_TAG/$AWS_PROFILE.$TIMESTAMP_TAG --report-name $AWS_PROFILE -f"  >> $LOGDIR/$DATESTAMP_TAG/scoutsuite.$AWS_PROFILE.$TIMESTAMP_TAG.log 2>&1
-
-    python3 $SCOUTSUITE_SCRIPT aws --profile "$AWS_PROFILE" --max-workers $MAX_WORKERS --max-rate $MAX_RATE --report-dir "$REPORT_DIR/$DATESTAMP_TAG/$AWS_PROFILE.$TIMESTAMP_TAG" --report-name "$AWS_PROFILE" -f >> "$LOGDIR/$DATESTAMP_TAG/scoutsuite.$AWS_PROFILE.$TIMESTAMP_TAG.log" 2>&1 &
-# no rate limiting
-    #python3 $SCOUTSUITE_SCRIPT aws --profile $AWS_PROFILE --report-dir $REPORT_DIR/$DATESTAMP_TAG/$AWS_PROFILE.$TIMESTAMP_TAG --report-name $AWS_PROFILE >> $LOGDIR/$DATESTAMP_TAG/scoutsuite.$AWS_PROFILE.$TIMESTAMP_TAG.log 2>&1
-    PID=$!
-    if [[ ! -z "$PID" ]]; then
-        echo "$TIMESTAMP $PROC_NAME: outputting to filename=$LOGDIR/$DATESTAMP_TAG/scoutsuite.$AWS_PROFILE.$TIMESTAMP_TAG.log aws profile: $AWS_PROFILE count: $TOTAL pid: $PID" >> $LOGFILE
-        queue $PID
-
-        while [ $NUM -ge $MAX_NPROC ]; do
-            checkqueue
-            sleep 0.01
-        done
-    fi
-
-    echo "$TIMESTAMP $PROC_NAME: processing scanning AWS_PROFILE=$AWS_PROFILE" >> $LOGFILE
-
+# one scout.py per profile, at most MAX_NPROC at once, logged to $LOGDIR/$DATESTAMP_TAG/scoutsuite.<profile>.$TIMESTAMP_TAG.log
+# run in the background so a SIGTERM to the runner reaches it: it stops starting scans and waits for the running ones
+python3 $SS_SUPERVISOR_SCRIPT --profile-list $PROFILE --scoutsuite-script $SCOUTSUITE_SCRIPT --report-dir $REPORT_DIR --log-dir $LOGDIR \
+    --timestamp-tag "$TIMESTAMP_TAG" --datestamp-tag "$DATESTAMP_TAG" --max-nproc $MAX_NPROC --max-workers $MAX_WORKERS --max-rate $MAX_RATE \
+    --timeout $SCAN_TIMEOUT --retries $SCAN_RETRIES --retry-delay $SCAN_RETRY_DELAY --results $SCAN_RESULTS >> $LOGFILE 2>&1 &
+SUPERVISOR_PID=$!
+TERMINATED=0
+trap 'TERMINATED=1; kill -TERM $SUPERVISOR_PID 2>/dev/null' TERM INT
+wait $SUPERVISOR_PID
+SCAN_FLAG=$?
+while kill -0 $SUPERVISOR_PID 2>/dev/null; do
+    # wait returned for the trap, the supervisor is still draining
+    wait $SUPERVISOR_PID
+    SCAN_FLAG=$?
 done
+trap - TERM INT
+
+if [ $TERMINATED == 1 ]; then
+    echo "$TIMESTAMP $PROC_NAME: terminated while scanning, scans of this run: $SCAN_RESULTS" >> $LOGFILE
+    exit 143
+fi
+if [ $SCAN_FLAG != 0 ]; then
+    echo "$TIMESTAMP $PROC_NAME: not every aws profile was scanned, see $SCAN_RESULTS" >> $LOGFILE
+fi
 
 te2=`date +%s`
 duration=$((te2 - ts2))
@@ -117,16 +112,51 @@ duration2=$((te2 - ts1))
 echo -e "$TIMESTAMP $PROC_NAME: ScoutSuite runner job complete. total time elapsed: $(($duration / 60))  min and $(($duration % 60)) sec\t$(($duration2 / 60))  min and $(($duration2 % 60)) sec" >> $LOGFILE
 
 # convert all newly generated ScoutSuite report files into Splunk-friendly data events
-for REPORT in `find $REPORT_DIR -cnewer $RABBITFILE -type f -name 'scoutsuite_results_*.js'`; do
-    ORIG_REPORT_FOLDER=`dirname $REPORT`
-    # extract the aws profile name from the original results file
-    [[ "$REPORT" =~ scoutsuite_results_(.*)\.js ]]
-    EXTRACTED_PROFILE="${BASH_REMATCH[1]}"
-
-    echo "$TIMESTAMP $PROC_NAME: converting $REPORT >> $ORIG_REPORT_FOLDER/report.scoutsuite.$EXTRACTED_PROFILE.txt" >> $LOGFILE
-    python3 $SS_CONVERTER_SCRIPT -s "$REPORT" -d "$ORIG_REPORT_FOLDER/report.scoutsuite.$EXTRACTED_PROFILE.txt"
-    CNUM=$((CNUM+1))
-done
+# each report.scoutsuite.<profile>.txt is written next to its scoutsuite_results_<profile>.js
+CONVERT_ARGS="--workers $MAX_CONVERT_WORKERS --stream --codec $OUTPUT_CODEC --cache-dir $CONVERT_CACHE_DIR --cache-max-age $CONVERT_CACHE_MAX_AGE"
+if [ "$OUTPUT_CODEC" == "none" ]; then
+    CONVERT_ARGS="$CONVERT_ARGS --index" # index for ss_index.py queries, uncompressed reports only
+fi
+if [ "$DELTA_CONVERT" == "1" ]; then
+    CONVERT_ARGS="$CONVERT_ARGS --delta-root $REPORT_DIR"
+fi
+if [ "$CONVERT_METRICS" == "1" ]; then
+    CONVERT_ARGS="$CONVERT_ARGS --metrics"
+fi
+if [ -n "$HEC_URL" ]; then
+    export SS_HEC_TOKEN=`cat $HEC_TOKEN_FILE`
+    CONVERT_ARGS="$CONVERT_ARGS --hec-url $HEC_URL"
+    # events earlier runs could not post
+    find $REPORT_DIR -type f -name 'report.scoutsuite.*.spill*' ! -name '*.tmp' | xargs -r python3 $SS_HEC_SCRIPT send --remove --hec-url $HEC_URL 2>> $LOGFILE | sed "s/^/$TIMESTAMP $PROC_NAME: resending spilled events: /" >> $LOGFILE
+fi
+echo "$TIMESTAMP $PROC_NAME: converting ScoutSuite reports newer than $RABBITFILE. workers: $MAX_CONVERT_WORKERS delta: $DELTA_CONVERT codec: $OUTPUT_CODEC" >> $LOGFILE
+ts3=`date +%s`
+CONVERT_SUMMARY=`find $REPORT_DIR -cnewer $RABBITFILE -type f -name 'scoutsuite_results_*.js' | python3 $SS_CONVERTER_BATCH_SCRIPT $CONVERT_ARGS - 2>> $LOGFILE`
+CHK_FLAG=$? # return 0 if every report converted
+te3=`date +%s`
+duration=$((te3 - ts3))
+
+# status, results file, converted file, event count, seconds
+echo "$CONVERT_SUMMARY" | sed "s/^/$TIMESTAMP $PROC_NAME: converting: /" >> $LOGFILE
+CNUM=`echo "$CONVERT_SUMMARY" | grep -c '^OK'`
+
+if [ $CHK_FLAG != 0 ]; then
+    echo "$TIMESTAMP $PROC_NAME: failed to convert $(echo "$CONVERT_SUMMARY" | grep -c '^FAILED') ScoutSuite reports" >> $LOGFILE
+fi
+
+echo "$TIMESTAMP $PROC_NAME: successfully converted $CNUM ScoutSuite reports. elapsed: $(($duration / 60)) min and $(($duration % 60)) sec" >> $LOGFILE
 
-echo "$TIMESTAMP $PROC_NAME: successfully converted $CNUM ScoutSuite reports" >> $LOGFILE
+if [ -n "$EXPORT_DB" ]; then
+    # load this run's converted reports into the cross-account database, queried with sqlite3 or ss_export.py --query
+    ts4=`date +%s`
+    EXPORT_SUMMARY=`echo "$CONVERT_SUMMARY" | grep '^OK' | cut -f3 | python3 $SS_EXPORT_SCRIPT --db $EXPORT_DB --accounts $ACCOUNT_DETAIL --orgs $ORGS_DETAIL - 2>> $LOGFILE`
+    te4=`date +%s`
+    duration=$((te4 - ts4))
+    echo "$EXPORT_SUMMARY" | grep -v '^OK' | sed "s/^/$TIMESTAMP $PROC_NAME: export: /" >> $LOGFILE
+    echo "$TIMESTAMP $PROC_NAME: exported $(echo "$EXPORT_SUMMARY" | grep -c '^OK') converted reports to $EXPORT_DB. elapsed: $(($duration / 60)) min and $(($duration % 60)) sec" >> $LOGFILE
+fi
 
+if [ "$CONVERT_METRICS" == "1" ]; then
+    # slowest stages, services and types across every report converted in this run
+    find $REPORT_DIR -cnewer $RABBITFILE -type f -name 'report.scoutsuite.*.metrics.json' | xargs -r python3 $SS_METRICS_SCRIPT --top 10 2>> $LOGFILE | sed "s/^/$TIMESTAMP $PROC_NAME: conversion metrics: /" >> $LOGFILE
+fi
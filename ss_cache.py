@@ -0,0 +1,204 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+
+META_SUFFIX = '.json'
+# cached files of a conversion by suffix: converted report, byte offset index, hash sidecar
+ARTIFACTS = ('data', 'idx', 'hashes')
+HASH_CHUNK = 2 ** 20
+# entries without meta are leftovers of an interrupted store once they are this old
+ORPHAN_SECONDS = 3600
+
+
+def file_digest(path):
+    '''
+    :param path:    file to hash, read in 1 MB chunks
+    :type path:     str
+
+    :returns: hex blake2b digest of the file content
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link(src, dest):
+    '''
+    hard link src to dest, copying across filesystems, and move it into place atomically
+    '''
+    tmp = f'{dest}.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+class ConversionCache(object):
+    '''
+    converted reports keyed by the content hash of their results file, the converter version and the
+    output codec, so converting the same results again links the earlier output instead of parsing it
+
+    entries are hard linked in and out of the cache, so converted reports must be replaced, never
+    rewritten in place. an entry is complete once its meta file exists; the meta mtime is its last use
+    '''
+
+    def __init__(self, cache_dir, version, max_age_days=None, max_mb=None):
+        '''
+        :param cache_dir:   cache folder, best on the filesystem of the reports so entries are linked, not copied
+        :type cache_dir:    str
+        :param version:     converter version, part of every key. no dots, keys are file names
+        :type version:      str
+        :param max_age_days:    prune entries unused for this many days
+        :type max_age_days:     float
+        :param max_mb:  prune the least recently used entries beyond this size
+        :type max_mb:   float
+        '''
+        self.cache_dir = cache_dir
+        self.version = version
+        self.max_age_days = max_age_days
+        self.max_mb = max_mb
+
+    def key(self, results_file, codec='none', level=None, variant=None):
+        '''
+        :param results_file:    path of scoutsuite_results_*.js
+        :type results_file:     str
+        :param codec:   output codec, compressed output differs per codec and level
+        :type codec:    str
+        :param level:   compression level
+        :type level:    int
+        :param variant:     anything else the output depends on, e.g. the JSON encoder or a projection. no dots
+        :type variant:      str
+        '''
+        key = f'{file_digest(results_file)}-v{self.version}-{codec}{level if level is not None else ""}'
+        return f'{key}-{variant}' if variant else key
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def fetch(self, key, json_out, index_out=None, hashes_out=None):
+        '''
+        link a cached conversion to its destinations
+
+        :param key:     cache key, see key()
+        :type key:      str
+        :param json_out:    destination of the converted report
+        :type json_out:     str
+        :param index_out:   destination of the byte offset index, the entry must have one
+        :type index_out:    str
+        :param hashes_out:  destination of the hash sidecar, the entry must have one
+        :type hashes_out:   str
+
+        :returns: meta of the entry (events, bytes, results_file, created), None on a miss
+        '''
+        entry = self._entry(key)
+        try:
+            with open(entry + META_SUFFIX) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        wanted = dict(zip(ARTIFACTS, (json_out, index_out, hashes_out)))
+        if any(dest and artifact not in meta['artifacts'] for artifact, dest in wanted.items()):
+            return None
+
+        for artifact, dest in wanted.items():
+            if dest:
+                try:
+                    _link(f'{entry}.{artifact}', dest)
+                except FileNotFoundError:
+                    # pruned while being fetched
+                    return None
+        os.utime(entry + META_SUFFIX)
+        return meta
+
+    def store(self, key, results_file, events, json_out, index_out=None, hashes_out=None):
+        '''
+        link a finished conversion into the cache
+
+        :param key:     cache key, see key()
+        :type key:      str
+        :param results_file:    converted results file, recorded in the meta
+        :type results_file:     str
+        :param events:  number of events converted
+        :type events:   int
+        :param json_out:    converted report
+        :type json_out:     str
+        :param index_out:   byte offset index of the report
+        :type index_out:    str
+        :param hashes_out:  hash sidecar of the report
+        :type hashes_out:   str
+        '''
+        entry = self._entry(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        artifacts = []
+        for artifact, src in zip(ARTIFACTS, (json_out, index_out, hashes_out)):
+            if src:
+                _link(src, f'{entry}.{artifact}')
+                artifacts.append(artifact)
+
+        meta = {'results_file': results_file, 'events': events, 'bytes': os.path.getsize(json_out),
+                'artifacts': artifacts, 'created': time.strftime('%F %T%z')}
+        with open(f'{entry}{META_SUFFIX}.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(f'{entry}{META_SUFFIX}.tmp', entry + META_SUFFIX)
+
+    def _remove(self, key):
+        entry = self._entry(key)
+        # meta first, so the entry is a miss before its artifacts go
+        for path in [entry + META_SUFFIX] + glob.glob(glob.escape(entry) + '.*'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def prune(self):
+        '''
+        evict entries unused for max_age_days, then the least recently used ones until the cache fits max_mb
+
+        :returns: tuple of (entries kept, entries removed, MB kept)
+        '''
+        now = time.time()
+        entries = {}
+        for path in glob.glob(os.path.join(self.cache_dir, '*', '*')):
+            key, suffix = os.path.splitext(os.path.basename(path))
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entry = entries.setdefault(key, {'used': None, 'size': 0, 'mtime': 0})
+            entry['size'] += stat.st_size
+            entry['mtime'] = max(entry['mtime'], stat.st_mtime)
+            if suffix == META_SUFFIX:
+                entry['used'] = stat.st_mtime
+
+        removed = 0
+        for key, entry in list(entries.items()):
+            if entry['used'] is None:
+                if now - entry['mtime'] > ORPHAN_SECONDS:
+                    self._remove(key)
+                del entries[key]
+            elif self.max_age_days is not None and now - entry['used'] > self.max_age_days * 86400:
+                self._remove(key)
+                removed += 1
+                del entries[key]
+
+        total = sum(entry['size'] for entry in entries.values())
+        if self.max_mb is not None:
+            for key, entry in sorted(entries.items(), key=lambda item: item[1]['used']):
+                if total <= self.max_mb * 2 ** 20:
+                    break
+                self._remove(key)
+                removed += 1
+                total -= entry['size']
+                del entries[key]
+
+        return len(entries), removed, round(total / 2 ** 20, 1)
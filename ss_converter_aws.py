@@ -1,4 +1,3 @@
-import copy
 import datetime
 import json
 import sys
@@ -7,15 +6,33 @@ import argparse
 import logging
 import logging.handlers as handlers
 import configparser
+import collections
+import concurrent.futures
+import cProfile
+import functools
+import hashlib
+import itertools
 import traceback
 import time
 import pytz
 
+import ss_cache
+import ss_delta
+import ss_hec
+import ss_index
+import ss_metrics
+import ss_output
+import ss_stream_parser
+
 BASEFOLDER = None
 LOGFOLDER = None
 LOGFILE = 'converter.scoutsuite.aws.log'
 LOGFILE_PATH = None
 
+# bump whenever the converted events change for the same results, it invalidates the conversion cache
+CONVERTER_VERSION = '1'
+DEFAULT_CACHE_MAX_AGE_DAYS = 14
+
 SERVICE_EV_FIELDS = {
 'acm': ['certificates'],
 'awslambda': ['functions'],
@@ -42,6 +59,11 @@ SERVICE_EV_FIELDS = {
 'sqs': ['queues'],
 'vpc': ['flow_logs', 'peering_connections', 'vpcs']
 }
+# resource types keyed one level further down, (service, field) -> key holding the resources
+NESTED_FIELDS = {('iam', 'permissions'): 'Action'}
+# extra services and resource types loaded by load_plans_config, passed on to service workers
+plans_config = None
+plans_digest = None
 
 logger = None
 orig_timestamp=None
@@ -49,7 +71,22 @@ orig_timestamp=None
 base_details = {}
 account_details = {}
 ev_template = {}
-events = {}
+# ss_metrics.ConversionMetrics of the conversion in progress, None unless metrics were requested
+metrics = None
+# Projection of the conversion in progress, None converts everything
+projection = None
+
+# event types of the services collection, by the ExtractionPlan key classes they come from
+SERVICE_TYPES = ('summary', 'filters', 'findings', 'inventory')
+# event type of top level collections not named after their key
+COLLECTION_TYPES = {'service_groups': 'external_attack_surface'}
+
+# process pool converting services concurrently, window bounds the services in flight.
+# keyed workers return (EventMeta, line) pairs instead of a chunk, for delta conversion and the index.
+# measured workers also return the metrics of their service
+ServicePool = collections.namedtuple('ServicePool', ['executor', 'window', 'keyed', 'measured'])
+# fields identifying an event in the delta hashes and the byte offset index
+EventMeta = collections.namedtuple('EventMeta', ss_index.INDEX_FIELDS)
 
 def GetLogger(logFilename, loggerName, logLevel=logging.DEBUG, 
               backupCount=5, utc=True, interval=8):
@@ -99,6 +136,139 @@ def prepare_logging():
     logger = GetLogger(LOGFILE_PATH, __file__)    
 
 
+class Envelope(object):
+    '''
+    fields shared by every event of a collection (environment, aws_account_id, service, type, _time).
+    built once per collection and encoded once; each event is (head, envelope, body) where head holds
+    the per event fields and body is the resource straight from the results, combined only when written
+    '''
+    __slots__ = ('fields', 'encoded', 'keys', 'reserved')
+
+    def __init__(self, fields, head_keys=()):
+        '''
+        :param fields:  shared fields, in output order
+        :type fields:   dict
+        :param head_keys:   per event field names written ahead of the envelope
+        :type head_keys:    tuple
+        '''
+        self.fields = fields
+        self.encoded = ss_output.dumps(fields)[1:-1]
+        self.keys = frozenset(fields)
+        self.reserved = self.keys.union(head_keys)
+
+
+def merge_event(event):
+    '''
+    :param event:   (head, envelope, body) event
+    :type event:    tuple
+
+    :returns: event as a single dict, later parts overriding earlier ones
+    '''
+    head, envelope, body = event
+    ev = dict(head) if head else {}
+    if envelope is not None:
+        ev.update(envelope.fields)
+    if body:
+        ev.update(body)
+    return ev
+
+
+def event_field(event, key, default=None):
+    '''
+    look up a field of an event without merging it
+
+    :param event:   (head, envelope, body) event
+    :type event:    tuple
+    :param key:     field name
+    :type key:      str
+    '''
+    head, envelope, body = event
+    if body and key in body:
+        return body[key]
+    if envelope is not None and key in envelope.fields:
+        return envelope.fields[key]
+    if head and key in head:
+        return head[key]
+    return default
+
+
+def event_meta(event):
+    '''
+    :param event:   (head, envelope, body) event
+    :type event:    tuple
+
+    :returns: EventMeta of the event, None for missing fields
+    '''
+    return EventMeta(*(event_field(event, field) for field in ss_index.INDEX_FIELDS))
+
+
+def event_type(event):
+    '''
+    :returns: (type, sub_type) of an event, sub_type None for events without one
+    '''
+    return event_field(event, 'type'), event_field(event, 'sub_type')
+
+
+def _delta_key(meta):
+    return ss_delta.event_key(meta.service or '', meta.type or '', meta.id or '')
+
+
+def encode_event(event):
+    '''
+    serialize an event to JSON, splicing the pre-encoded envelope between head and body.
+    output is identical to encoding the merged event
+
+    :param event:   (head, envelope, body) event
+    :type event:    tuple
+    '''
+    head, envelope, body = event
+
+    if body and envelope is not None and not envelope.reserved.isdisjoint(body):
+        # resource overrides an envelope field, merge so the override keeps its position
+        if head is None or not envelope.keys.isdisjoint(body):
+            return ss_output.dumps(merge_event(event))
+
+        # resource overrides per event fields (usually its own id), keep them at the head position
+        head = dict(head)
+        body = dict(body)
+        for key in head:
+            if key in body:
+                head[key] = body.pop(key)
+
+    parts = []
+    if head:
+        parts.append(ss_output.dumps(head)[1:-1])
+    if envelope is not None and envelope.encoded:
+        parts.append(envelope.encoded)
+    if body:
+        parts.append(ss_output.dumps(body)[1:-1])
+    return b'{' + b','.join(parts) + b'}'
+
+
+def _drop_duplicates(events, scope):
+    '''
+    pass events through once per id, later events with an already seen id are dropped.
+    only the ids are kept, not the events themselves
+
+    :param events:  events to check
+    :type events:   iterator
+    :param scope:   name of the collection the ids must be unique within, e.g. service name
+    :type scope:    str
+    '''
+    seen_ids = set()
+
+    for ev in events:
+        ev_id = event_field(ev, 'id')
+        if ev_id in seen_ids:
+            if metrics is not None:
+                metrics.duplicates += 1
+            logger.warning(f"event already exists: env: {event_field(ev, 'environment')} key={scope} id={ev_id} new.type={event_field(ev, 'type')} new.sub_type={event_field(ev, 'sub_type')}")
+            continue
+
+        seen_ids.add(ev_id)
+        yield ev
+
+
 def _process_ext_attack_surface(service_group, ev_temp, results_service_group):
     ''' 
             need to process the results for the aws service into 4 different types:
@@ -113,28 +283,233 @@ def _process_ext_attack_surface(service_group, ev_temp, results_service_group):
             :type results_service_group:  dict
     '''
 
-    global events
-    ev_temp['_time'] = datetime.datetime.now().strftime('%F %T%z')
-    ev_temp['service'] = service_group
-    ev_ext = copy.deepcopy(ev_temp)
-    ext_type = ev_ext['type'] = 'external_attack_surface'
+    ext_type = 'external_attack_surface'
+    ev_ext = dict(ev_temp)
+    ev_ext['_time'] = datetime.datetime.now().strftime('%F %T%z')
+    ev_ext['service'] = service_group
+    ev_ext['type'] = ext_type
+    ev_ext = Envelope(ev_ext, ('id',))
+
+    results_ext = results_service_group['summaries'][ext_type]
+    for vv in results_ext:
+        yield {'id': f"{service_group}:{ext_type}:{vv}"}, ev_ext, results_ext[vv]
+
+
+def _extract_findings(plan, key, results_findings, envelopes):
+    for vv, finding in results_findings.items():
+        yield {'id': f'{key}:{vv}'}, envelopes.findings, finding
 
-    my_ext = {}
 
-    for vv in results_service_group['summaries'][ext_type]:
-        my_ext[vv] = {}
-        my_ext[vv]['id'] = f"{service_group}:{ext_type}:{vv}"
-        my_ext[vv].update(ev_ext)
-        my_ext[vv].update(results_service_group['summaries'][ext_type][vv])
+def _extract_setting_finding(plan, key, setting, envelopes):
+    yield {'id': key}, envelopes.findings, setting
 
-    if ext_type not in events:
-        events[ext_type] = {}
 
-    for ev in my_ext:
-        ev_id = my_ext[ev].get('id')
-        if events[ext_type] and ev_id in events[ext_type]:
-            logger.warning(f"event already exists: env: {ev_temp['environment']} key={service_group} id={ev_id} orig.type={events[service_group][ev_id]['type']}")
-        events[ext_type][ev_id] = my_ext[ev]
+def _inventory_events(heads, ev_inventory, items, log_prefix):
+    '''
+    pair per event heads with the resources of one resource type. when every resource is a dict,
+    as usual, the events are zipped together without a python level loop per resource
+
+    :param heads:   head of each event, in the order of items
+    :type heads:    list
+    :param ev_inventory:    inventory envelope of the service
+    :type ev_inventory:     Envelope
+    :param items:   resources by key
+    :type items:    dict
+    :param log_prefix:  context of resources that are not a dict, for the debug log
+    :type log_prefix:   str
+    '''
+    resources = items.values()
+    if all(map(isinstance, resources, itertools.repeat(dict))):
+        return zip(heads, itertools.repeat(ev_inventory), resources)
+
+    events = []
+    for head, (vv, resource) in zip(heads, items.items()):
+        if not isinstance(resource, dict):
+            logger.debug(f'{log_prefix} service key: {vv} type: {type(resource)}')
+            resource = None
+        events.append((head, ev_inventory, resource))
+    return events
+
+
+def _extract_inventory(plan, key, results_key, envelopes, nested=None):
+    items = results_key[nested] if nested else results_key
+    heads = [{'id': f'{key}:{vv}', 'sub_type': key} for vv in items]
+    return _inventory_events(heads, envelopes.inventory, items, f'env: {envelopes.environment}')
+
+
+def _extract_regions(plan, key, results_regions, envelopes):
+    service_name = plan.service
+    fields = plan.fields
+    ev_inventory = envelopes.inventory
+
+    for region, results_region in results_regions.items():
+        # region based summary, then each region's items
+        region_summary = {rkey: value for rkey, value in results_region.items() if rkey not in fields}
+        yield {'sub_type': 'summary', 'id': f'summary:{service_name}:{region}', 'region': region}, ev_inventory, region_summary
+
+        for rkey, items in results_region.items():
+            if rkey not in fields:
+                continue
+
+            id_prefix = f'{service_name}:{region}:{rkey}:'
+            heads = [{'id': id_prefix + vv, 'region': region, 'sub_type': rkey} for vv in items]
+            yield from _inventory_events(heads, ev_inventory, items, f'env: {envelopes.environment} region: {region}')
+
+
+class ExtractionPlan(object):
+    '''
+    dispatch tables of one service, built once from SERVICE_EV_FIELDS. every dict valued key of the
+    service results maps straight to the extractor of its events: findings ahead of inventory,
+    keys in neither are unknown
+    '''
+    __slots__ = ('service', 'fields', 'findings', 'inventory')
+
+    def __init__(self, service, fields, nested=None):
+        '''
+        :param service:     aws service name
+        :type service:      str
+        :param fields:  resource types extracted as inventory
+        :type fields:   list
+        :param nested:  resource types keyed one level further down, to the key holding their resources
+        :type nested:   dict
+        '''
+        nested = nested or {}
+        self.service = service
+        self.fields = frozenset(fields)
+
+        # process attack surface and public access block config as findings
+        self.findings = {'findings': _extract_findings, 'external_attack_surface': _extract_findings,
+                         'public_access_block_configuration': _extract_setting_finding}
+        self.inventory = {'regions': _extract_regions}
+        for field in fields:
+            if field in nested:
+                self.inventory[field] = functools.partial(_extract_inventory, nested=nested[field])
+            else:
+                self.inventory[field] = _extract_inventory
+
+    def key_type(self, key):
+        '''
+        :param key:     dict valued key of the service results
+        :type key:      str
+
+        :returns: event type extracted from the key, None for unknown keys
+        '''
+        if key in self.findings:
+            return 'findings'
+        if key in self.inventory:
+            return 'inventory'
+        if key == 'filters':
+            return 'filters'
+        return None
+
+
+class Projection(object):
+    '''
+    event types and services to convert. the rest of the results is skipped while parsing
+    when streaming, and is never extracted otherwise
+
+    types are event types: summary, filters, findings and inventory of services, last_run,
+    external_attack_surface (service_groups) or any other top level collection by its key.
+    services only narrows the services collection
+    '''
+    __slots__ = ('types', 'services')
+
+    def __init__(self, types=None, services=None):
+        '''
+        :param types:   event types to convert, all when empty
+        :type types:    list
+        :param services:    services to convert, all when empty
+        :type services:     list
+        '''
+        self.types = frozenset(types) if types else None
+        self.services = frozenset(services) if services else None
+
+    def wants_type(self, ev_type):
+        return self.types is None or ev_type in self.types
+
+    def wants_service(self, service_name):
+        return self.services is None or service_name in self.services
+
+    def wants_collection(self, key):
+        '''
+        :param key:     top level key of the results holding a collection
+        :type key:      str
+        '''
+        if self.types is None:
+            return True
+        if key == 'services':
+            return not self.types.isdisjoint(SERVICE_TYPES)
+        return COLLECTION_TYPES.get(key, key) in self.types
+
+    def wants_key(self, plan, key):
+        '''
+        :param plan:    extraction plan of the service, None for unsupported services
+        :type plan:     ExtractionPlan
+        :param key:     dict valued key of the service results
+        :type key:      str
+        '''
+        if plan is None:
+            return False
+        key_type = plan.key_type(key)
+        return key_type is not None and self.wants_type(key_type)
+
+    def variant(self):
+        '''
+        :returns: short, file name safe digest of the projection, part of its conversion cache keys
+        '''
+        spec = json.dumps([sorted(self.types or ()), sorted(self.services or ())])
+        return hashlib.blake2b(spec.encode(), digest_size=4).hexdigest()
+
+
+def build_plans():
+    '''
+    :returns: dict of service name to ExtractionPlan, from SERVICE_EV_FIELDS and NESTED_FIELDS
+    '''
+    return {service: ExtractionPlan(service, fields, {field: nested for (nested_service, field), nested in NESTED_FIELDS.items()
+                                                      if nested_service == service})
+            for service, fields in SERVICE_EV_FIELDS.items()}
+
+
+def load_plans_config(path):
+    '''
+    add services and resource types from a JSON file and rebuild the extraction plans.
+    each service maps to a list of resource types, or to an object of resource type to the key
+    its resources are nested under (null when not nested), e.g.
+
+        {"guardduty": ["detectors"], "iam": {"permissions": "Action", "access_keys": null}}
+
+    :param path:    plans configuration file
+    :type path:     str
+    '''
+    global service_plans, plans_config, plans_digest
+
+    with open(path) as f:
+        config = json.load(f)
+    plans_digest = hashlib.blake2b(json.dumps(config, sort_keys=True).encode(), digest_size=4).hexdigest()
+
+    for service, fields in config.items():
+        if not isinstance(fields, dict):
+            fields = dict.fromkeys(fields)
+        service_fields = SERVICE_EV_FIELDS.setdefault(service, [])
+        for field, nested in fields.items():
+            if field not in service_fields:
+                service_fields.append(field)
+            if nested:
+                NESTED_FIELDS[(service, field)] = nested
+
+    service_plans = build_plans()
+    plans_config = path
+
+
+def converter_version():
+    '''
+    :returns: CONVERTER_VERSION, suffixed with the digest of the loaded plans configuration since it changes the output
+    '''
+    return f'{CONVERTER_VERSION}p{plans_digest}' if plans_digest else CONVERTER_VERSION
+
+
+ServiceEnvelopes = collections.namedtuple('ServiceEnvelopes', ['findings', 'inventory', 'environment'])
+service_plans = build_plans()
 
 
 def _process_service_events(service_name, ev_temp, results_service):
@@ -145,284 +520,897 @@ def _process_service_events(service_name, ev_temp, results_service):
             * findings - any identified vulnerable configurations
             * inventory - based on service, capture per service artifact + summary
 
+            keys are dispatched through the service's ExtractionPlan up front; the returned
+            iterator chains the extractors, so events are built in that order as they are consumed
+
             :param service_name:    name of aws service
             :type service_name:             str
             :param ev_temp:     template to copy event info from
             :type ev_temp:      dict
             :param results_service: collection of service results to extract
             :type results_service:  dict
+
+            :returns: iterator of (head, envelope, body) events
     '''
 
-    global events
+    plan = service_plans.get(service_name)
+    if plan is None:
+        logger.warning(f"service not currently supported or results parsing: env: {ev_temp['environment']} service={service_name}")
+        return iter(())
+    types = projection.types if projection is not None else None
 
-    # template for service events
+    # envelopes for service events, shared by every event of the type
+    ev_temp = dict(ev_temp)
     ev_temp['_time'] = datetime.datetime.now().strftime('%F %T%z')
     ev_temp['service'] = service_name
 
-    ev_summary = copy.deepcopy(ev_temp)
+    ev_summary = dict(ev_temp)
     ev_summary['type'] = 'summary'
     ev_summary['id'] = f'summary:{service_name}'
-    ev_filters = copy.deepcopy(ev_temp)
-    ev_filters['type'] = 'filters'
-    ev_findings = copy.deepcopy(ev_temp)
-    ev_findings['type'] = 'findings'
-    ev_inventory = copy.deepcopy(ev_temp)
-    ev_inventory['type'] = 'inventory'
-
-    my_filters = {}
-    my_findings = {}
-    my_inventory = {}
-
-    if service_name not in SERVICE_EV_FIELDS:
-        logger.warning(f"service not currently supported or results parsing: env: {ev_temp['environment']} service={service_name}")
-        return
-
-    # iterate through service data
-    for key in results_service.keys():
-        #logger.debug(f'key list dump: env: {ev_temp["environment"]} service={service_name} keys: <{",".join(results_service.keys())}>') # missing account info
-        # everything not iterable will added to summary event
-        if not isinstance(results_service[key], dict):
-            ev_summary[key] = results_service[key]
-
-        elif key == 'filters':
-            for vv in results_service[key]:
-                my_filters[vv] = {}
-                my_filters[vv]['id'] = f'{key}:{vv}'
-                my_filters[vv].update(ev_filters)
-                my_filters[vv].update(results_service[key][vv])
-
-        elif key == 'findings':
-            for vv in results_service[key]:
-                my_findings[vv] = {}
-                my_findings[vv]['id'] = f'{key}:{vv}'
-                my_findings[vv].update(ev_findings)
-                my_findings[vv].update(results_service[key][vv])
-
-        # process attack service as a finding
-        elif key == 'external_attack_surface':
-            for vv in results_service[key]:
-                my_findings[vv] = {}
-                my_findings[vv]['id'] = f'{key}:{vv}'
-                my_findings[vv].update(ev_findings)
-                my_findings[vv].update(results_service[key][vv])
-
-        # process public access block config as a finding
-        elif key == 'public_access_block_configuration':
-            my_findings[key] = {}
-            my_findings[key]['id'] = f'{key}'
-            my_findings[key].update(ev_findings)
-            my_findings[key].update(results_service[key])
-
-        # need to iterate if among specified service events
-        elif key in SERVICE_EV_FIELDS[service_name]:
-            # special use cases for service subtypes are nested an extra level
-            service_key_iterator = results_service[key]
-            if key == 'permissions':
-                service_key_iterator = results_service[key]['Action']
-
-            for vv in service_key_iterator:
-                my_inventory[vv] = {}
-                my_inventory[vv]['id'] = f'{key}:{vv}'
-                my_inventory[vv]['sub_type'] = key
-                my_inventory[vv].update(ev_inventory)
-
-                if isinstance(service_key_iterator[vv], dict):
-                    my_inventory[vv].update(service_key_iterator[vv])
-                else:
-                    logger.debug(f'env: {ev_temp["environment"]} service key: {vv} type: {type(service_key_iterator[vv])}')
-
-        # if regions, then need to breakdown even further
-        # region based summary, then iterate through each region's items
-        elif key == 'regions':
-            # iterate through the regions
-            for region in results_service[key]:
-                # prepare region-based summary
-                id_region = f'summary:{service_name}:{region}'
-                my_inventory[id_region] = {}
-                my_inventory[id_region]['sub_type'] = 'summary'
-                my_inventory[id_region]['id'] = id_region
-                my_inventory[id_region]['region'] = region
-                my_inventory[id_region].update(ev_inventory)
-
-                for rkey in results_service[key][region].keys():
-                    if rkey in SERVICE_EV_FIELDS[service_name]:
-                        service_key_iterator = results_service[key][region][rkey]
-
-                        for vv in service_key_iterator:
-                            my_id = f'{service_name}:{region}:{rkey}:{vv}'
-                            my_inventory[my_id] = {}
-                            my_inventory[my_id]['id'] = my_id
-                            my_inventory[my_id]['region'] = region
-                            my_inventory[my_id]['sub_type'] = rkey
-                            my_inventory[my_id].update(ev_inventory)
-                            my_inventory[my_id].update(service_key_iterator[vv])
-
-                    # add summary key
-                    else:
-                        my_inventory[id_region][rkey] = results_service[key][region][rkey]
-
-                    
-        # any other special type of asset for the service
-        else: # add inventory summary page for the region + per asset
-            logger.debug(f'UNKNOWN ASSET TYPE env: {ev_temp["environment"]} key: {key} type: {type(results_service[key])}')
-            '''
-            my_inventory[vv] = {}
-            my_inventory[vv]['sub_type'] = key
-            my_inventory[vv].update(ev_temp)
-            my_inventory[vv].update(results_service[key][vv])
-            '''
-
-    # all info back to global
-    events[service_name] = {}
-    events[service_name]['summary'] = ev_summary
-    for ev in my_filters:
-        ev_id = my_filters[ev].get('id')
-        if ev_id in events[service_name]:
-            logger.warning(f"event already exists: env: {ev_temp['environment']} service={service_name} id={ev_id} orig.type={events[service_name][ev_id]['type']}")
-        events[service_name][ev_id] = my_filters[ev]
-
-    for ev in my_findings:
-        ev_id = my_findings[ev].get('id')
-        if ev_id in events[service_name]:
-            logger.warning(f"event already exists: env: {ev_temp['environment']} service={service_name} id={ev_id} orig.type={events[service_name][ev_id]['type']}")
-        events[service_name][ev_id] = my_findings[ev]
+    ev_summary = Envelope(ev_summary)
+    ev_filters = Envelope(dict(ev_temp, type='filters'), ('id',))
+    envelopes = ServiceEnvelopes(Envelope(dict(ev_temp, type='findings'), ('id',)),
+                                 Envelope(dict(ev_temp, type='inventory'), ('id', 'sub_type', 'region')),
+                                 ev_temp['environment'])
+
+    # everything not iterable will added to summary event, the rest is dispatched in one pass
+    summary = {}
+    findings = []
+    inventory = []
+    unknown = []
+    for key, value in results_service.items():
+        if not isinstance(value, dict):
+            summary[key] = value
+        elif key in plan.findings:
+            findings.append((plan.findings[key], key, value))
+        elif key in plan.inventory:
+            inventory.append((plan.inventory[key], key, value))
+        elif key != 'filters':
+            unknown.append(key)
+
+    # any other special type of asset for the service, counted once per service
+    if unknown:
+        logger.debug(f'UNKNOWN ASSET TYPES env: {ev_temp["environment"]} service: {service_name} keys: {",".join(unknown)}')
+        if metrics is not None:
+            metrics.unknown_keys.update(f'{service_name}.{key}' for key in unknown)
+
+    if types is not None:
+        findings = findings if 'findings' in types else []
+        inventory = inventory if 'inventory' in types else []
+
+    parts = [((None, ev_summary, summary),)] if types is None or 'summary' in types else []
+    if isinstance(results_service.get('filters'), dict) and (types is None or 'filters' in types):
+        results_filters = results_service['filters']
+        parts.append(({'id': f'filters:{vv}'}, ev_filters, results_filters[vv]) for vv in results_filters)
+    # chained rather than delegated to with yield from, which costs a generator hop per event
+    parts.extend(extract(plan, key, value, envelopes) for extract, key, value in findings + inventory)
+    return itertools.chain.from_iterable(parts)
+
+
+def _add_base_detail(key, value):
+    '''
+    track static account information and prune particular names for the base event template
 
-        '''
-        for region in account_details[key][service][s].keys():
-            for id in account_details[key][service][s][region]['certificates']:
-                ev_ss = {}
-                ev_ss['_time'] = datetime.datetime.now().strftime('%F %T%z')
-                ev_ss['type'] = service
-                ev_ss['region'] = region
-                ev_ss['sub_type'] = 'certificates'
-                #ev_ss['id'] = id
-                ev_ss.update(ev_template)
-                ev_ss.update(account_details[key][service][s][region]['certificates'][id])
-        '''
+    :param key:     top level key of the results
+    :type key:      str
+    :param value:   static value of the results
+    :type value:    str
+    '''
+    base_details[key] = value
 
-    for ev in my_inventory:
-        ev_id = my_inventory[ev].get('id')
-        if ev_id in events[service_name]:
-            logger.warning(f"event already exists: env: {ev_temp['environment']} service={service_name} id={ev_id} orig.type={events[service_name][ev_id]['type']} orig.sub_type={events[service_name][ev_id].get('sub_type')} new.type={my_inventory[ev]['type']} new.sub_type={my_inventory[ev].get('sub_type')}")
-        events[service_name][ev_id] = my_inventory[ev]
+    if key == 'account_id':
+        ev_template['aws_account_id'] = value
+    elif key == 'result_format':
+        pass
+    else:
+        ev_template[key] = value
 
 
-if __name__ == "__main__":
+def _init_service_worker(json_encoder, plans_config_path=None, report_projection=None):
+    global projection
 
-    prepare_logging()
+    if logger is None:
+        prepare_logging()
+    ss_output.use_encoder(json_encoder)
+    if plans_config_path and plans_config != plans_config_path:
+        load_plans_config(plans_config_path)
+    projection = report_projection
 
-    parser = argparse.ArgumentParser(description=("Convert ScoutSuite AWS report.\n\n"
-                                                  "  Configuration:\n"
-                                                  "    - Logs collected in: %s\n"
-                                                  "    - Work folder: %s\n\n") % (repr(LOGFOLDER),
-                                                                              repr(BASEFOLDER)),
-                                     formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('-s', dest='results_file', required=True, help='ScoutSuite scan report input')
-    parser.add_argument('-d', dest='json_out', required=True, help='Destination file to convert ScoutSuite scan report')
 
-    args = parser.parse_args()    
+def _worker_metrics(measured):
+    global metrics
+    metrics = ss_metrics.ConversionMetrics(event_type) if measured else None
+    return metrics
 
+
+def _convert_service(task):
+    '''
+    convert one service inside a worker process
+
+    :param task:    (service_name, ev_temp, results_service, keyed, measured), results_service may be undecoded JSON text
+    :type task:     tuple
+
+    :returns: tuple of (serialized events of the service, newline delimited, metrics state or None).
+              keyed: list of (EventMeta, line) instead of the serialized events
+    '''
+    service_name, ev_temp, results_service, keyed, measured = task
+    service_metrics = _worker_metrics(measured)
+    if isinstance(results_service, str):
+        time_start = time.perf_counter()
+        results_service = json.loads(results_service)
+        if measured:
+            service_metrics.stages['decode'] += time.perf_counter() - time_start
+
+    lines = []
     try:
-        with open(args.results_file) as f:
-            json_payload = f.readlines()
-            json_payload.pop(0)
-            json_payload = ''.join(json_payload)
-            json_file = json.loads(json_payload)
+        events = _drop_duplicates(_process_service_events(service_name, ev_temp, results_service), service_name)
+        if measured:
+            events = service_metrics.measure(service_name, events)
+        lines.extend(encode_keyed_events(events) if keyed else encode_events(events))
     except Exception as e:
-        logger.error(f'Failed to read ScoutSuite results: {args.results_file}. Reason: {traceback.format_exc()}')
+        logger.error(f'Failed to process account detail type=services env="{ev_temp["environment"]}" service={service_name} Reason: {traceback.format_exc()}')
+    return lines if keyed else b''.join(lines), service_metrics.state() if measured else None
+
+
+def _convert_service_groups(task):
+    '''
+    convert the external attack surface of all service groups inside a worker process
+
+    :param task:    (ev_temp, service_groups, keyed, measured)
+    :type task:     tuple
+
+    :returns: tuple of (serialized events, newline delimited, metrics state or None).
+              keyed: list of (EventMeta, line) instead of the serialized events
+    '''
+    ev_temp, service_groups, keyed, measured = task
+    group_metrics = _worker_metrics(measured)
+
+    lines = []
+    try:
+        events = _drop_duplicates(_iter_ext_attack_surface(ev_temp, service_groups), 'external_attack_surface')
+        if measured:
+            events = group_metrics.measure('service_groups', events, service=False)
+        lines.extend(encode_keyed_events(events) if keyed else encode_events(events))
+    except Exception as e:
+        logger.error(f'Failed to process account detail type=service_groups env="{ev_temp["environment"]}" Reason: {traceback.format_exc()}')
+    return lines if keyed else b''.join(lines), group_metrics.state() if measured else None
 
-    # set original timesetamp against results file
-    tz = pytz.timezone("US/Pacific")
-    #orig_timestamp = datetime.datetime.fromtimestamp(os.stat(args.results_file).st_mtime).localize(tz)
+
+def _iter_ext_attack_surface(ev_temp, service_groups):
+    for service_group in service_groups.keys():
+        yield from _process_ext_attack_surface(service_group, ev_temp, service_groups[service_group])
+
+
+def _iter_ordered(pool, func, tasks, window):
+    '''
+    run tasks on the pool and yield their results in submission order,
+    keeping at most window tasks in flight
+
+    :param pool:    worker pool
+    :type pool:     concurrent.futures.Executor
+    :param func:    function to run per task
+    :type func:     function
+    :param tasks:   task arguments, consumed lazily
+    :type tasks:    iterator
+    :param window:  maximum tasks submitted ahead of the result being written
+    :type window:   int
+    '''
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(pool.submit(func, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def process_account_detail(key, value, pool=None):
+    '''
+    convert one top level collection of the results into events
+
+    :param key:     top level key of the results, e.g. services, service_groups, sg_map
+    :type key:      str
+    :param value:   collection to convert. services may also be an iterator of (service_name, service) pairs
+    :type value:    dict
+    :param pool:    worker pool to convert services on. its results are serialized chunks of events
+    :type pool:     ServicePool
+    '''
+    if metrics is not None and key not in ('services', 'service_groups'):
+        yield from metrics.measure(key, _process_account_detail(key, value, pool), service=False)
+    else:
+        yield from _process_account_detail(key, value, pool)
+
+
+def _process_account_detail(key, value, pool=None):
+    if key == 'last_run':
+        try:
+            ev = {}
+            ev.update(value)
+            ev['_time'] = datetime.datetime.now().strftime('%F %T%z')
+            ev['type'] = key
+            ev['id'] = f'{key}:summary'
+        except Exception as e:
+            logger.error(f'Failed to process account detail type={key} env="{ev_template["environment"]}"  Reason: {traceback.format_exc()}')
+            return
+        yield None, None, ev
+
+    elif key == 'services':
+        ''' each service is broken down into 4 subtype categories:
+            * summary for the service
+            * filters for anything specified
+            * findings for any triggers
+            * inventory configuration per service 
+        '''
+        services = value.items() if isinstance(value, dict) else value
+        if metrics is not None and not isinstance(value, dict):
+            services = metrics.parse_services(services)
+        if projection is not None and projection.services is not None:
+            services = ((service_name, results_service) for service_name, results_service in services
+                        if projection.wants_service(service_name))
+
+        if pool is not None:
+            tasks = ((service_name, ev_template, results_service, pool.keyed, pool.measured)
+                     for service_name, results_service in services)
+            for chunk, state in _iter_ordered(pool.executor, _convert_service, tasks, pool.window):
+                if state is not None:
+                    metrics.merge(state)
+                yield chunk
+            return
+
+        for service_name, results_service in services:
+            try:
+                events = _drop_duplicates(_process_service_events(service_name, ev_template, results_service), service_name)
+                if metrics is not None:
+                    events = metrics.measure(service_name, events)
+                yield from events
+            except Exception as e:
+                logger.error(f'Failed to process account detail type={key} env="{ev_template["environment"]}" service={service_name} Reason: {traceback.format_exc()}')
+
+    # external_attack_surface
+    # account_details['service_groups']['compute']['summaries']['external_attack_surface']
+    # account_details['service_groups']['database']['summaries']['external_attack_surface']
+    elif key == 'service_groups':
+        if pool is not None:
+            chunk, state = pool.executor.submit(_convert_service_groups, (ev_template, value, pool.keyed, pool.measured)).result()
+            if state is not None:
+                metrics.merge(state)
+            yield chunk
+            return
+
+        try:
+            events = _drop_duplicates(_iter_ext_attack_surface(ev_template, value), 'external_attack_surface')
+            if metrics is not None:
+                events = metrics.measure(key, events, service=False)
+            yield from events
+        except Exception as e:
+            logger.error(f'Failed to process account detail type={key} env="{ev_template["environment"]}" Reason: {traceback.format_exc()}')
+
+    else:
+        ev_time = datetime.datetime.now().strftime('%F %T%z')
+        ev_base = Envelope(dict(ev_template), ('_time', 'type', 'id'))
+        try:
+            for ev_key in value.keys():
+                yield {'_time': ev_time, 'type': key, 'id': f'{key}:{ev_key}'}, ev_base, value[ev_key]
+        except Exception as e:
+            logger.error(f'Failed to process account detail type={key} env="{ev_template["environment"]}" target={ev_key} Reason: {traceback.format_exc()}')
+
+
+def iter_events(items, results_file, pool=None):
+    '''
+    extract events from parsed results, in the order of the results file
+
+    small collections (last_run, metadata) sort ahead of some static account keys, so they
+    are held until services is reached; services and everything after it is converted as parsed
+
+    :param items:   (key, value) pairs of the top level of the results
+    :type items:    iterator
+    :param results_file:    path of scoutsuite_results_*.js, for logging
+    :type results_file:     str
+    :param pool:    worker pool to convert services on
+    :type pool:     ServicePool
+    '''
+    pending = []
+    services_started = False
+
+    for key, value in items:
+        # service list is general and has no detail from aws account
+        if key == 'service_list':
+            continue
+
+        elif key == 'services' or isinstance(value, dict) or isinstance(value, list):
+            if projection is not None and not projection.wants_collection(key):
+                continue
+
+            if key == 'services':
+                services_started = True
+                for pending_key, pending_value in pending:
+                    yield from process_account_detail(pending_key, pending_value, pool)
+                pending = []
+
+            if services_started:
+                yield from process_account_detail(key, value, pool)
+            else:
+                pending.append((key, value))
+
+        else:
+            if services_started:
+                logger.warning(f'static key after services, not in service events: key: {key} file: {results_file}')
+            if not isinstance(value, str):
+                logger.debug(f'unknown type: key: {key} type: {type(value)}')
+            _add_base_detail(key, value)
+
+    for pending_key, pending_value in pending:
+        yield from process_account_detail(pending_key, pending_value, pool)
+
+
+def encode_events(events):
+    '''
+    serialize events to JSON lines, events that fail to serialize are logged and skipped
+
+    :param events:  events to serialize
+    :type events:   iterator
+    '''
+    for ev in events:
+        try:
+            yield encode_event(ev) + b'\n'    # force newline
+        except Exception as e:
+            logger.error(f'Failed to write results: {event_field(ev, "type")}. env="{event_field(ev, "environment")}" id={event_field(ev, "id")} Reason: {traceback.format_exc()}')
+
+
+def encode_keyed_events(events):
+    '''
+    serialize events to JSON lines along with their EventMeta, for delta conversion and the index
+
+    :param events:  events to serialize
+    :type events:   iterator
+
+    :returns: generator of (EventMeta, line)
+    '''
+    for ev in events:
+        for line in encode_events((ev,)):
+            yield event_meta(ev), line
+
+
+def _removed_events(delta):
+    '''
+    :param delta:   tracker every converted event was marked on
+    :type delta:    ss_delta.DeltaTracker
+
+    :returns: generator of events for resources of the previous run that are gone
+    '''
+    ev_time = datetime.datetime.now().strftime('%F %T%z')
+    for service, ev_type, ev_id in delta.removed():
+        ev = dict(ev_template)
+        ev['_time'] = ev_time
+        if service:
+            ev['service'] = service
+        ev['type'] = ev_type
+        ev['id'] = ev_id
+        ev[ss_delta.CHANGE_FIELD] = ss_delta.CHANGE_REMOVED
+        yield None, None, ev
+
+
+def write_events(events, json_out, delta=None, index=None, codec='none', level=None, hec=None):
+    '''
+    write each event to the destination as soon as it is built, batched into large writes
+
+    :param events:  events to write, or chunks of already serialized events from service workers
+    :type events:   iterator
+    :param json_out:    destination file
+    :type json_out:     str
+    :param delta:   only write events that changed since the previous run, followed by removed events
+    :type delta:    ss_delta.DeltaTracker
+    :param index:   record the byte offset of every written event
+    :type index:    ss_index.IndexWriter
+    :param codec:   compress while writing: none, gzip or zstd
+    :type codec:    str
+    :param level:   compression level, default per codec
+    :type level:    int
+    :param hec:     also post every written event to the HTTP Event Collector
+    :type hec:      ss_hec.HECSink
+
+    with delta or index, service worker chunks must be keyed
+
+    :returns: writer stats: events, bytes (uncompressed), seconds, mb_per_sec
+    '''
+    keyed = delta is not None or index is not None
+
+    with ss_output.NDJSONWriter(ss_output.open_sink(json_out, codec, level), tee=hec) as writer:
+        def write_keyed(keyed_lines):
+            for meta, line in keyed_lines:
+                if delta is not None:
+                    line = delta.mark(_delta_key(meta), line)
+                    if line is None:
+                        continue
+                if index is not None:
+                    index.add(writer.tell(), len(line), meta)
+                writer.write(line)
+
+        for ev in events:
+            if keyed:
+                write_keyed(ev if isinstance(ev, list) else encode_keyed_events((ev,)))
+
+            elif isinstance(ev, bytes):
+                writer.write(ev, ev.count(b'\n'))
+
+            else:
+                for line in encode_events((ev,)):
+                    writer.write(line)
+
+        if delta is not None:
+            # removed events are not part of this run, they are only indexed
+            for meta, line in encode_keyed_events(_removed_events(delta)):
+                if index is not None:
+                    index.add(writer.tell(), len(line), meta)
+                writer.write(line)
+
+    return writer.stats()
+
+
+def load_results(results_file):
+    '''
+    read the whole ScoutSuite results file into memory
+
+    :param results_file:    path of scoutsuite_results_*.js
+    :type results_file:     str
+    '''
+    with open(results_file) as f:
+        json_payload = f.readlines()
+        json_payload.pop(0)
+        json_payload = ''.join(json_payload)
+        return json.loads(json_payload)
+
+
+def iter_loaded_results(json_file):
+    '''
+    top level (key, value) pairs of fully loaded results, static account keys first
+
+    :param json_file:   results loaded by load_results
+    :type json_file:    dict
+    '''
+    for key in json_file.keys():
+        if not isinstance(json_file[key], dict) and not isinstance(json_file[key], list):
+            yield key, json_file[key]
 
     for key in json_file.keys():
         if isinstance(json_file[key], dict) or isinstance(json_file[key], list):
             account_details[key] = json_file[key]
-        elif isinstance(json_file[key], str):
-            base_details[key] = json_file[key]
-        else:
-            logger.debug(f'unknown type: key: {key} type: {type(json_file[key])}')
-            base_details[key] = json_file[key]
-
-    # prune particular names for base event template
-    for bkey in base_details:
-        if bkey == 'account_id':
-            ev_template['aws_account_id'] = base_details[bkey]
-        elif bkey == 'result_format':
-            pass
-        else:
-            ev_template[bkey] = base_details[bkey]
+            yield key, json_file[key]
 
-    # service list is general and has no detail from aws account
-    if account_details.get('service_list'):
-        del(account_details['service_list'])
 
-    # ['last_run', 'metadata', 'service_groups', 'services', 'sg_map', 'subnet_map']
-    for key in account_details.keys():
+def _iter_stream_services(reader, raw=False, projection=None):
+    '''
+    stream services one at a time. regions are walked down to each resource type
+    so only one resource type is held as text while the service is built
+
+    :param reader:  stream reader positioned at the services object
+    :type reader:   ss_stream_parser.ResultsStreamReader
+    :param raw:     yield each service as undecoded JSON text, to be decoded by a service worker
+    :type raw:      bool
+    :param projection:  skip services and keys it does not want without decoding them
+    :type projection:   Projection
+    '''
+    for service_name in reader.iter_items():
+        if projection is not None and not projection.wants_service(service_name):
+            continue
 
-        if key == 'last_run':
-            events[key] = {}
-            try:
-                events[key].update(account_details[key])
-                events[key]['_time'] = datetime.datetime.now().strftime('%F %T%z')
-                events[key]['type'] = key
-                events[key]['id'] = f'{key}:summary'
+        if projection is not None and projection.types is not None and reader.peek() == '{':
+            yield service_name, _read_projected_service(reader, service_name, raw, projection)
+            continue
+
+        if raw:
+            yield service_name, reader.read_raw()
+            continue
+
+        if reader.peek() != '{':
+            yield service_name, reader.read_value()
+            continue
+
+        results_service = {}
+        for key in reader.iter_items():
+            # regions -> region -> resource type
+            results_service[key] = reader.read_nested(2 if key == 'regions' else 0)
+
+        yield service_name, results_service
+
+
+def _read_projected_service(reader, service_name, raw, projection):
+    '''
+    read the keys of one service the projection wants. skipped dict valued keys are kept as empty
+    objects, so they are still classified (and counted when unknown) without their content
+
+    :returns: the service, as JSON text when raw
+    '''
+    plan = service_plans.get(service_name)
+    wants_summary = projection.wants_type('summary')
+    results_service = {}
+    for key in reader.iter_items():
+        c = reader.peek()
+        if c == '{':
+            if not projection.wants_key(plan, key):
+                results_service[key] = '{}' if raw else {}
                 continue
-            except Exception as e:
-                logger.error(f'Failed to process account detail type={key} env="{ev_template["environment"]}"  Reason: {traceback.format_exc()}')
+        elif not wants_summary:
+            continue
+
+        if raw:
+            results_service[key] = reader.read_raw()
+        else:
+            # regions -> region -> resource type
+            results_service[key] = reader.read_nested(2 if key == 'regions' else 0)
 
-        elif key == 'services':
-            ''' each service is broken down into 4 subtype categories:
-                * summary for the service
-                * filters for anything specified
-                * findings for any triggers
-                * inventory configuration per service 
-            '''
+    if raw:
+        return '{' + ','.join(f'{json.dumps(key)}:{value}' for key, value in results_service.items()) + '}'
+    return results_service
 
-            try:
-                for service_name in account_details['services'].keys():
-                    _process_service_events(service_name, ev_template, account_details['services'][service_name])
 
+def iter_results(results_file, raw_services=False, projection=None):
+    '''
+    incrementally parse the ScoutSuite results file, one top level key at a time.
+    services are yielded as an iterator of (service_name, service) pairs that
+    must be exhausted before the next key is requested
+
+    :param results_file:    path of scoutsuite_results_*.js
+    :type results_file:     str
+    :param raw_services:    yield services as undecoded JSON text
+    :type raw_services:     bool
+    :param projection:  skip the collections, services and service keys it does not want without decoding them
+    :type projection:   Projection
+    '''
+    with open(results_file) as f:
+        reader = ss_stream_parser.ResultsStreamReader(f)
+        reader.skip_prefix()
+
+        for key in reader.iter_items():
+            c = reader.peek()
+            if projection is not None and c in ('{', '[') and not projection.wants_collection(key):
+                # left unread, iter_items skips it
                 continue
-            except Exception as e:
-                logger.error(f'Failed to process account detail type={key} env="{ev_template["environment"]}" Reason: {traceback.format_exc()}')
+            if key == 'services' and c == '{':
+                yield key, _iter_stream_services(reader, raw_services, projection)
+            else:
+                yield key, reader.read_value()
 
-        # external_attack_surface
-        # account_details['service_groups']['compute']['summaries']['external_attack_surface']
-        # account_details['service_groups']['database']['summaries']['external_attack_surface']
-        elif key == 'service_groups':
-            for service_group in account_details[key].keys():
-                 _process_ext_attack_surface(service_group, ev_template, account_details[key][service_group])
 
-        else:
-            events[key] = {}
+def convert_report(results_file, json_out, stream=False, service_workers=0, json_encoder='auto',
+                   previous=None, hashes_out=None, index_out=None, codec='none', level=None,
+                   metrics_out=None, profile_out=None, cache=None, hec=None, report_projection=None):
+    '''
+    convert a ScoutSuite results file into newline delimited events.
+    parse -> extract -> serialize, each event is written as soon as it is built
+
+    :param results_file:    path of scoutsuite_results_*.js
+    :type results_file:     str
+    :param json_out:    destination file
+    :type json_out:     str
+    :param stream:  incrementally parse the results one service at a time
+    :type stream:   bool
+    :param service_workers:     convert services concurrently on this many worker processes.
+                                output is the same as the serial conversion apart from _time
+    :type service_workers:      int
+    :param json_encoder:    auto (orjson when installed), orjson or json
+    :type json_encoder:     str
+    :param previous:    hash sidecar or full converted report of the previous run of the same profile.
+                        only new, modified and removed events are written, tagged with a change field
+    :type previous:     str
+    :param hashes_out:  write the content hash of every event here for the next run's previous.
+                        default <json_out>.hashes when converting against a previous run
+    :type hashes_out:   str
+    :param index_out:   write a byte offset index of the events here, see ss_index.py. uncompressed output only
+    :type index_out:    str
+    :param codec:   compress the converted report while writing: none, gzip or zstd.
+                    json_out is used as given, no suffix is added
+    :type codec:    str
+    :param level:   compression level, default per codec
+    :type level:    int
+    :param metrics_out:     write parse, per service and per type timings and counts, bytes written,
+                            peak RSS and duplicate ids of the conversion here as JSON, see ss_metrics.py
+    :type metrics_out:      str
+    :param profile_out:     write a cProfile dump of the conversion here. covers this process only,
+                            not service workers
+    :type profile_out:      str
+    :param cache:   link the output of an earlier conversion of the same results content instead of
+                    converting, and keep this conversion for the next one. not used with previous
+    :type cache:    ss_cache.ConversionCache
+    :param hec:     also post the events to an HTTP Event Collector while writing them. events it
+                    does not accept are spilled next to json_out, see ss_hec.spill_path()
+    :type hec:      ss_hec.HECClient
+    :param report_projection:   only convert the event types and services it wants, skipping the rest of
+                                the results while parsing when streaming. not used with previous or hashes_out,
+                                every event left out would count as removed
+    :type report_projection:    Projection
+
+    :returns: number of events written
+    '''
+    global metrics, projection
+
+    if report_projection is not None and (previous or hashes_out):
+        logger.error(f'Failed to convert ScoutSuite results: {results_file}. a projection cannot be combined with delta conversion')
+        raise ValueError('a projection cannot be combined with delta conversion')
+
+    # state is kept per report so one process can convert many reports
+    base_details.clear()
+    account_details.clear()
+    ev_template.clear()
+    ss_output.use_encoder(json_encoder)
+    metrics = ss_metrics.ConversionMetrics(event_type) if metrics_out else None
+    projection = report_projection
+    profiler = None
+
+    try:
+        cache_key = None
+        if cache is not None and not previous:
+            # orjson and json format events differently, the encoder picked above is part of the key
+            variant = ss_output.encoder_name
+            if projection is not None:
+                variant = f'{variant}-{projection.variant()}'
+            cache_key, cached = _fetch_cached(cache, results_file, json_out, index_out, hashes_out, codec, level, variant)
+            if cached is not None:
+                hec_stats = _send_cached(hec, json_out, codec) if hec is not None else None
+                if metrics is not None:
+                    metrics.write(f'{metrics_out}.tmp', results_file=results_file, json_out=json_out, cache_hit=True,
+                                  codec=codec, events=cached['events'], bytes_written=cached['bytes'], hec=hec_stats)
+                    os.replace(f'{metrics_out}.tmp', metrics_out)
+                return cached['events']
+
+        if profile_out:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        count = _convert_report(results_file, json_out, stream, service_workers, json_encoder, previous, hashes_out,
+                                index_out, codec, level, metrics_out, hec)
+
+        if cache_key is not None:
+            try:
+                cache.store(cache_key, results_file, count, json_out, index_out, hashes_out)
+            except Exception as e:
+                logger.error(f'Failed to store conversion in cache: {cache.cache_dir} key={cache_key} Reason: {traceback.format_exc()}')
+        return count
+    finally:
+        metrics = None
+        projection = None
+        if profiler is not None:
+            profiler.disable()
             try:
-                for ev_key in account_details[key].keys():
-                    events[key][ev_key] = {}
-                    events[key][ev_key]['_time'] = datetime.datetime.now().strftime('%F %T%z')
-                    events[key][ev_key]['type'] = key
-                    events[key][ev_key]['id'] = f'{key}:{ev_key}'
-                    # copy 
-                    events[key][ev_key].update(ev_template)
-                    events[key][ev_key].update(account_details[key][ev_key])
+                profiler.dump_stats(profile_out)
             except Exception as e:
-                logger.error(f'Failed to process account detail type={key} env="{ev_template["environment"]}" target={ev_key} Reason: {traceback.format_exc()}')
+                logger.error(f'Failed to write profile: {profile_out}. Reason: {traceback.format_exc()}')
 
+
+def _fetch_cached(cache, results_file, json_out, index_out, hashes_out, codec, level, variant=None):
+    '''
+    :returns: tuple of (cache key, meta of the cached conversion or None on a miss).
+              the key is None if the cache could not be read
+    '''
     try:
-        # write to new file
-        with open(args.json_out, 'w') as wf:
-            for ev_type in events.keys():
-                try:
-                    if ev_type == 'last_run':
-                        json.dump(events[ev_type], wf)
-                        wf.write('\n')    # force newline
-                        continue
+        cache_key = cache.key(results_file, codec, level, variant)
+        cached = cache.fetch(cache_key, json_out, index_out, hashes_out)
+    except Exception as e:
+        logger.error(f'Failed to read conversion cache: {cache.cache_dir} results={results_file} Reason: {traceback.format_exc()}')
+        return None, None
+
+    if cached is not None:
+        logger.info(f'converted {results_file} from cache: events={cached["events"]} bytes_written={cached["bytes"]} '
+                    f'key={cache_key} cached_from={cached["results_file"]} created={cached["created"]}')
+    return cache_key, cached
+
+
+def _send_cached(hec, json_out, codec):
+    '''
+    post a converted report linked from the cache, it was never written through the HEC sink
+
+    :returns: sink stats, see ss_hec.HECSink.stats()
+    '''
+    hec_stats = hec.send_file(json_out, ss_hec.spill_path(json_out, codec), codec, source=os.path.abspath(json_out))
+    _log_hec(hec, json_out, codec, hec_stats)
+    return hec_stats
+
+
+def _log_hec(hec, json_out, codec, hec_stats):
+    message = (f'posted {json_out} to {hec.url}: events={hec_stats["events"]} delivered={hec_stats["delivered"]} '
+               f'spilled={hec_stats["spilled"]} batches={hec_stats["batches"]} retries={hec_stats["retries"]} '
+               f'sent_bytes={hec_stats["sent_bytes"]} seconds={hec_stats["seconds"]} wait_seconds={hec_stats["wait_seconds"]}')
+    if hec_stats['spilled']:
+        logger.warning(f'{message} spill={ss_hec.spill_path(json_out, codec)} Reason: {hec_stats["error"]}')
+    else:
+        logger.info(message)
+
 
-                    for ev in events[ev_type]:
-                        json.dump(events[ev_type][ev], wf)
-                        wf.write('\n')    # force newline
-                except Exception as e:
-                    logger.error(f'Failed to write results: {ev_type}. env="{ev_template["environment"]}" Reason: {traceback.format_exc()}')
+def _convert_report(results_file, json_out, stream, service_workers, json_encoder, previous, hashes_out,
+                    index_out, codec, level, metrics_out, hec=None):
+
+    if index_out and codec != 'none':
+        logger.error(f'Failed to convert ScoutSuite results: {results_file}. byte offset index requires uncompressed output, codec={codec}')
+        raise ValueError('byte offset index requires uncompressed output')
+    if previous and hashes_out is None:
+        hashes_out = json_out + ss_delta.HASHES_SUFFIX
+
+    delta = None
+    try:
+        if previous:
+            delta = ss_delta.DeltaTracker(ss_delta.load_previous(previous))
+        elif hashes_out:
+            delta = ss_delta.DeltaTracker()
+    except Exception as e:
+        logger.error(f'Failed to read previous run: {previous}. Reason: {traceback.format_exc()}')
+        raise
+
+    try:
+        if stream:
+            items = iter_results(results_file, raw_services=service_workers > 1, projection=projection)
+            if metrics is not None:
+                items = metrics.timed('parse', items)
+        elif metrics is not None:
+            with metrics.stage('parse'):
+                items = iter_loaded_results(load_results(results_file))
+        else:
+            items = iter_loaded_results(load_results(results_file))
+    except Exception as e:
+        logger.error(f'Failed to read ScoutSuite results: {results_file}. Reason: {traceback.format_exc()}')
+        raise
+
+    # written aside and moved into place so a failed conversion never leaves a partial report
+    json_tmp = f'{json_out}.tmp'
+    hashes_tmp = f'{hashes_out}.tmp' if hashes_out else None
+    index_tmp = f'{index_out}.tmp' if index_out else None
+    metrics_tmp = f'{metrics_out}.tmp' if metrics_out else None
+    pool = None
+    index = None
+    hec_sink = None
+    hec_stats = None
+    try:
+        if index_out:
+            index = ss_index.IndexWriter(index_tmp)
+        if hec is not None:
+            hec_sink = hec.sink(ss_hec.spill_path(json_out, codec), codec, level, source=os.path.abspath(json_out))
+        if service_workers > 1:
+            pool = ServicePool(concurrent.futures.ProcessPoolExecutor(service_workers, initializer=_init_service_worker,
+                                                                      initargs=(json_encoder, plans_config, projection)),
+                               service_workers * 2, delta is not None or index is not None, metrics is not None)
+
+        stats = write_events(iter_events(items, results_file, pool), json_tmp, delta, index, codec, level, hec_sink)
+        if hec_sink is not None:
+            hec_stats = hec_sink.close()
+            hec_sink = None
+        if hashes_out:
+            delta.write_hashes(hashes_tmp)
+        if index is not None:
+            index.close(stats['bytes'])
+        os.replace(json_tmp, json_out)
+        for tmp, path in ((hashes_tmp, hashes_out), (index_tmp, index_out)):
+            if path:
+                os.replace(tmp, path)
+
+        bytes_written = os.path.getsize(json_out)
+
+        logger.info(f'converted {results_file}: events={stats["events"]} bytes={stats["bytes"]} seconds={stats["seconds"]} '
+                    f'mb_per_sec={stats["mb_per_sec"]} encoder={ss_output.encoder_name} '
+                    f'codec={codec} bytes_written={bytes_written}')
+        if previous:
+            counts = delta.counts
+            logger.info(f'delta against {previous}: new={counts["new"]} modified={counts["modified"]} '
+                        f'removed={counts["removed"]} unchanged={counts["unchanged"]}')
+        if hec_stats is not None:
+            _log_hec(hec, json_out, codec, hec_stats)
+
+        if metrics is not None:
+            if pool is not None:
+                # reap the workers so their peak RSS is counted
+                pool.executor.shutdown()
+            metrics.stages['write'] += stats['write_seconds']
+            metrics.write(metrics_tmp, results_file=results_file, json_out=json_out, environment=ev_template.get('environment'),
+                          stream=stream, service_workers=service_workers, encoder=ss_output.encoder_name, codec=codec,
+                          events=stats['events'], bytes=stats['bytes'], bytes_written=bytes_written,
+                          delta=dict(delta.counts) if previous else None, hec=hec_stats)
+            os.replace(metrics_tmp, metrics_out)
+        return stats['events']
     except Exception as e:
-        logger.error(f'Failed to read ScoutSuite results: {args.json_out}. env="{ev_template["environment"]}" Reason: {traceback.format_exc()}')
+        logger.error(f'Failed to convert ScoutSuite results: {results_file} to {json_out}. env="{ev_template.get("environment")}" Reason: {traceback.format_exc()}')
+        if index is not None:
+            index.close(-1)
+        if hec_sink is not None:
+            hec_sink.close(abort=True)
+        for tmp in (json_tmp, hashes_tmp, index_tmp, metrics_tmp):
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+    finally:
+        if pool is not None:
+            pool.executor.shutdown()
+
+
+if __name__ == "__main__":
+
+    prepare_logging()
+
+    parser = argparse.ArgumentParser(description=("Convert ScoutSuite AWS report.\n\n"
+                                                  "  Configuration:\n"
+                                                  "    - Logs collected in: %s\n"
+                                                  "    - Work folder: %s\n\n") % (repr(LOGFOLDER),
+                                                                              repr(BASEFOLDER)),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-s', dest='results_file', required=True, help='ScoutSuite scan report input')
+    parser.add_argument('-d', dest='json_out', required=True, help='Destination file to convert ScoutSuite scan report')
+    parser.add_argument('--stream', dest='stream', action='store_true',
+                        help='Incrementally parse the report one service at a time to bound memory on large reports')
+    parser.add_argument('--service-workers', dest='service_workers', type=int, default=0,
+                        help='Convert services concurrently on this many worker processes')
+    parser.add_argument('--json-encoder', dest='json_encoder', choices=ss_output.ENCODERS, default='auto',
+                        help='JSON encoder for the converted events, auto uses orjson when installed')
+    parser.add_argument('--previous', dest='previous', default=None,
+                        help=('Hash sidecar (or full converted report) of the previous run of the same profile.\n'
+                              'Only new, modified and removed events are written, tagged with a "change" field'))
+    parser.add_argument('--hashes', dest='hashes_out', default=None,
+                        help='Write event content hashes for the next --previous. default with --previous: <destination>.hashes')
+    parser.add_argument('--index', dest='index', action='store_true',
+                        help='Write a byte offset index of the events to <destination>.idx, queried with ss_index.py')
+    parser.add_argument('--codec', dest='codec', choices=ss_output.CODECS, default='none',
+                        help='Compress the destination while writing. the destination name is used as given')
+    parser.add_argument('--level', dest='level', type=int, default=None,
+                        help='Compression level, default: gzip 6, zstd 3')
+    parser.add_argument('--metrics', dest='metrics', action='store_true',
+                        help=(f'Write parse, per service and per type timings and counts, bytes written, peak RSS and\n'
+                              f'duplicate ids to <destination>{ss_metrics.METRICS_SUFFIX}, aggregated with ss_metrics.py'))
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                        help=f'Write a cProfile dump of the conversion to <destination>{ss_metrics.PROFILE_SUFFIX}')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=None,
+                        help=('Reuse the output of an earlier conversion of identical results from this folder, keyed by\n'
+                              'content hash and converter version. best on the filesystem of the reports (hard links)'))
+    parser.add_argument('--cache-max-age', dest='cache_max_age', type=float, default=DEFAULT_CACHE_MAX_AGE_DAYS,
+                        help=f'Evict cache entries unused for this many days (default: {DEFAULT_CACHE_MAX_AGE_DAYS})')
+    parser.add_argument('--cache-max-mb', dest='cache_max_mb', type=float, default=None,
+                        help='Evict the least recently used cache entries beyond this size')
+    ss_hec.add_arguments(parser)
+    parser.add_argument('--types', dest='types', default=None,
+                        help=('Only convert these comma separated event types, e.g. findings,summary,last_run,external_attack_surface.\n'
+                              'With --stream the rest of the report is skipped while parsing. Not with --previous/--hashes'))
+    parser.add_argument('--services', dest='services', default=None,
+                        help='Only convert these comma separated services, e.g. iam,s3')
+    parser.add_argument('--plans-config', dest='plans_config', default=None,
+                        help=('JSON file of extra services and resource types to extract, e.g.\n'
+                              '{"guardduty": ["detectors"], "iam": {"permissions": "Action"}}'))
+
+    args = parser.parse_args()    
 
+    if args.plans_config:
+        load_plans_config(args.plans_config)
+    try:
+        hec = ss_hec.client_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    report_projection = None
+    if args.types or args.services:
+        if args.previous or args.hashes_out:
+            parser.error('--types and --services cannot be combined with --previous or --hashes')
+        report_projection = Projection(args.types.split(',') if args.types else None,
+                                       args.services.split(',') if args.services else None)
+
+    # set original timesetamp against results file
+    tz = pytz.timezone("US/Pacific")
+    #orig_timestamp = datetime.datetime.fromtimestamp(os.stat(args.results_file).st_mtime).localize(tz)
+
+    cache = None
+    if args.cache_dir:
+        cache = ss_cache.ConversionCache(args.cache_dir, converter_version(), args.cache_max_age, args.cache_max_mb)
+
+    try:
+        convert_report(args.results_file, args.json_out, stream=args.stream, service_workers=args.service_workers,
+                       json_encoder=args.json_encoder, previous=args.previous, hashes_out=args.hashes_out,
+                       index_out=args.json_out + ss_index.INDEX_SUFFIX if args.index else None,
+                       codec=args.codec, level=args.level,
+                       metrics_out=args.json_out + ss_metrics.METRICS_SUFFIX if args.metrics else None,
+                       profile_out=args.json_out + ss_metrics.PROFILE_SUFFIX if args.profile else None, cache=cache,
+                       hec=hec, report_projection=report_projection)
+    except Exception as e:
+        sys.exit(1)
+    finally:
+        if hec is not None:
+            hec.close()
+
+    if cache is not None:
+        try:
+            kept, removed, size = cache.prune()
+            logger.info(f'conversion cache {args.cache_dir}: entries={kept} evicted={removed} mb={size}')
+        except Exception as e:
+            logger.error(f'Failed to prune conversion cache: {args.cache_dir} Reason: {traceback.format_exc()}')
@@ -0,0 +1,319 @@
+import argparse
+import glob
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+
+import ss_cache
+import ss_converter_aws
+import ss_delta
+import ss_hec
+import ss_index
+import ss_metrics
+import ss_output
+
+RESULTS_PATTERN = 'scoutsuite_results_*.js'
+RE_RESULTS_PROFILE = re.compile(r'scoutsuite_results_(.*)\.js$')
+HASHES_PATTERN = f'report.scoutsuite.*.txt{ss_delta.HASHES_SUFFIX}'
+RE_HASHES_PROFILE = re.compile(r'report\.scoutsuite\.(.*)\.txt' + re.escape(ss_delta.HASHES_SUFFIX) + '$')
+
+
+def results_profile(results_file):
+    '''
+    :param results_file:    path of scoutsuite_results_<profile>.js
+    :type results_file:     str
+    '''
+    m = RE_RESULTS_PROFILE.search(os.path.basename(results_file))
+    return m.group(1) if m else os.path.splitext(os.path.basename(results_file))[0]
+
+
+def default_json_out(results_file, codec='none'):
+    '''
+    converted report lives next to its source: <folder>/report.scoutsuite.<profile>.txt[.gz|.zst]
+
+    :param results_file:    path of scoutsuite_results_<profile>.js
+    :type results_file:     str
+    :param codec:   output codec, adds its suffix
+    :type codec:    str
+    '''
+    return os.path.join(os.path.dirname(results_file),
+                        f'report.scoutsuite.{results_profile(results_file)}.txt{ss_output.CODEC_SUFFIXES[codec]}')
+
+
+def find_previous_hashes(root, reports):
+    '''
+    pick the previous run of each report: the newest hash sidecar of the same profile under root
+    that is older than the report
+
+    :param root:    report folder holding the earlier runs
+    :type root:     str
+    :param reports:     results files to convert
+    :type reports:      list
+
+    :returns: dict of results file to hash sidecar, reports without an earlier run are left out
+    '''
+    sidecars = {}
+    for path in glob.glob(os.path.join(root, '**', HASHES_PATTERN), recursive=True):
+        m = RE_HASHES_PROFILE.search(os.path.basename(path))
+        if m:
+            try:
+                sidecars.setdefault(m.group(1), []).append((os.stat(path).st_mtime, path))
+            except OSError:
+                continue # removed since the glob
+
+    previous = {}
+    for results_file in reports:
+        try:
+            results_mtime = os.stat(results_file).st_mtime
+        except OSError:
+            continue # converted without a previous run, the conversion reports the missing file
+        own_folder = os.path.dirname(os.path.abspath(results_file))
+        candidates = [(mtime, path) for mtime, path in sidecars.get(results_profile(results_file), [])
+                      if mtime < results_mtime and os.path.dirname(os.path.abspath(path)) != own_folder]
+        if candidates:
+            previous[results_file] = max(candidates)[1]
+    return previous
+
+
+def find_reports(sources, newer=None):
+    '''
+    expand directories (searched recursively), globs and plain paths into results files
+
+    :param sources:     directories, globs or results file paths
+    :type sources:      list
+    :param newer:   only keep results files with a status change newer than this file, like find -cnewer.
+                    raises OSError if it is missing
+    :type newer:    str
+
+    :returns: tuple of (results files, list of (path, error) for paths that cannot be read)
+    '''
+    newer_ctime = os.stat(newer).st_ctime if newer else None
+    seen = set()
+    reports = []
+    missing = []
+
+    for source in sources:
+        if os.path.isdir(source):
+            paths = sorted(glob.glob(os.path.join(source, '**', RESULTS_PATTERN), recursive=True))
+        elif glob.has_magic(source):
+            paths = sorted(glob.glob(source, recursive=True))
+        else:
+            paths = [source]
+
+        for path in paths:
+            if path in seen:
+                continue
+            seen.add(path)
+            try:
+                ctime = os.stat(path).st_ctime
+            except OSError as e:
+                missing.append((path, f'{type(e).__name__}: {e}'))
+                continue
+            if newer_ctime is not None and ctime <= newer_ctime:
+                continue
+            reports.append(path)
+
+    return reports, missing
+
+
+def _init_worker(plans_config=None):
+    if ss_converter_aws.logger is None:
+        ss_converter_aws.prepare_logging()
+    if plans_config and ss_converter_aws.plans_config != plans_config:
+        ss_converter_aws.load_plans_config(plans_config)
+
+
+def _convert_one(task):
+    '''
+    convert one report inside a pool worker, never raises
+
+    :param task:    (results_file, json_out, stream, previous, hashes_out, index_out, codec, level, metrics_out,
+                     profile_out, cache, hec, projection)
+    :type task:     tuple
+
+    :returns: tuple of (results_file, json_out, ok, events, seconds, error)
+    '''
+    (results_file, json_out, stream, previous, hashes_out, index_out, codec, level, metrics_out, profile_out, cache, hec,
+     projection) = task
+    time_start = time.time()
+    try:
+        count = ss_converter_aws.convert_report(results_file, json_out, stream=stream, previous=previous,
+                                                hashes_out=hashes_out, index_out=index_out, codec=codec, level=level,
+                                                metrics_out=metrics_out, profile_out=profile_out, cache=cache, hec=hec,
+                                                report_projection=projection)
+        return results_file, json_out, True, count, time.time() - time_start, None
+    except Exception as e:
+        return results_file, json_out, False, 0, time.time() - time_start, f'{type(e).__name__}: {e}'
+
+
+def convert_batch(reports, workers=None, stream=False, max_tasks_per_child=None, delta_root=None, index=False,
+                  codec='none', level=None, metrics=False, profile=False, cache=None, hec=None, projection=None):
+    '''
+    convert reports across a pool of worker processes
+
+    :param reports:     results files to convert
+    :type reports:      list
+    :param workers:     number of worker processes, default is the number of cpus
+    :type workers:      int
+    :param stream:  incrementally parse each report
+    :type stream:   bool
+    :param max_tasks_per_child:     replace a worker after this many reports to release its memory
+    :type max_tasks_per_child:      int
+    :param delta_root:  only write events changed since the previous run of the same profile found under
+                        this folder. every report also gets a hash sidecar for the next run
+    :type delta_root:   str
+    :param index:   write a byte offset index next to each converted report, uncompressed output only
+    :type index:    bool
+    :param codec:   compress converted reports while writing: none, gzip or zstd
+    :type codec:    str
+    :param level:   compression level, default per codec
+    :type level:    int
+    :param metrics:     write a metrics sidecar next to each converted report, see ss_metrics.py.
+                        peak RSS is the peak of the pool worker, across the reports it converted so far
+    :type metrics:      bool
+    :param profile:     write a cProfile dump next to each converted report
+    :type profile:      bool
+    :param cache:   link the output of earlier conversions of identical results instead of converting them again
+    :type cache:    ss_cache.ConversionCache
+    :param hec:     also post the events of every report to an HTTP Event Collector. each worker keeps its own
+                    connections; events it does not accept are spilled next to the converted report
+    :type hec:      ss_hec.HECClient
+    :param projection:  only convert the event types and services it wants, not with delta_root
+    :type projection:   ss_converter_aws.Projection
+
+    :returns: generator of per report results, in completion order
+    '''
+    previous = find_previous_hashes(delta_root, reports) if delta_root else {}
+    tasks = []
+    for results_file in reports:
+        json_out = default_json_out(results_file, codec)
+        # sidecar name does not depend on the codec so the next run finds it either way
+        hashes_out = default_json_out(results_file) + ss_delta.HASHES_SUFFIX if delta_root else None
+        index_out = json_out + ss_index.INDEX_SUFFIX if index else None
+        metrics_out = json_out + ss_metrics.METRICS_SUFFIX if metrics else None
+        profile_out = json_out + ss_metrics.PROFILE_SUFFIX if profile else None
+        tasks.append((results_file, json_out, stream, previous.get(results_file), hashes_out, index_out, codec, level,
+                      metrics_out, profile_out, cache, hec, projection))
+    if not tasks:
+        return
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(ss_converter_aws.plans_config,),
+                              maxtasksperchild=max_tasks_per_child) as pool:
+        for result in pool.imap_unordered(_convert_one, tasks):
+            yield result
+
+
+if __name__ == "__main__":
+
+    ss_converter_aws.prepare_logging()
+    logger = ss_converter_aws.logger
+
+    parser = argparse.ArgumentParser(description=("Convert many ScoutSuite AWS reports in one process pool.\n"
+                                                  "Each report.scoutsuite.<profile>.txt is written next to its source.\n\n"
+                                                  "Prints one tab separated line per report:\n"
+                                                  "    OK|FAILED  results_file  json_out  events  seconds\n"
+                                                  "Exits 1 if any report failed to convert."),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('sources', nargs='*',
+                        help=f'report directories (searched for {RESULTS_PATTERN}), globs or results files. '
+                             'use - or nothing to read paths from stdin')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes, default: cpu count')
+    parser.add_argument('--newer', default=None, help='only convert results changed after this file, like find -cnewer')
+    parser.add_argument('--stream', action='store_true', help='incrementally parse each report to bound memory')
+    parser.add_argument('--max-tasks-per-child', type=int, default=None,
+                        help='replace a worker after this many reports to release its memory')
+    parser.add_argument('--delta-root', default=None,
+                        help='only write events changed since the previous run of each profile under this folder. '
+                             'reports without a previous run are converted in full')
+    parser.add_argument('--index', action='store_true',
+                        help='write a byte offset index next to each converted report, queried with ss_index.py')
+    parser.add_argument('--codec', choices=ss_output.CODECS, default='none',
+                        help='compress converted reports while writing, adds .gz or .zst to their names')
+    parser.add_argument('--level', type=int, default=None, help='compression level, default: gzip 6, zstd 3')
+    parser.add_argument('--metrics', action='store_true',
+                        help=f'write timings and counters next to each converted report as *{ss_metrics.METRICS_SUFFIX}, '
+                             'aggregated with ss_metrics.py')
+    parser.add_argument('--profile', action='store_true',
+                        help=f'write a cProfile dump next to each converted report as *{ss_metrics.PROFILE_SUFFIX}')
+    parser.add_argument('--cache-dir', default=None,
+                        help='reuse the output of earlier conversions of identical results from this folder, keyed by '
+                             'content hash and converter version. best on the filesystem of the reports (hard links)')
+    parser.add_argument('--cache-max-age', type=float, default=ss_converter_aws.DEFAULT_CACHE_MAX_AGE_DAYS,
+                        help=f'evict cache entries unused for this many days (default: {ss_converter_aws.DEFAULT_CACHE_MAX_AGE_DAYS})')
+    parser.add_argument('--cache-max-mb', type=float, default=None,
+                        help='evict the least recently used cache entries beyond this size')
+    parser.add_argument('--types', default=None,
+                        help='only convert these comma separated event types, e.g. findings,summary. not with --delta-root')
+    parser.add_argument('--services', default=None, help='only convert these comma separated services, e.g. iam,s3')
+    parser.add_argument('--plans-config', default=None,
+                        help='JSON file of extra services and resource types to extract, see ss_converter_aws.py --help')
+    ss_hec.add_arguments(parser)
+
+    args = parser.parse_args()
+    if args.index and args.codec != 'none':
+        parser.error('--index requires --codec none')
+    if args.plans_config:
+        ss_converter_aws.load_plans_config(args.plans_config)
+    try:
+        hec = ss_hec.client_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    projection = None
+    if args.types or args.services:
+        if args.delta_root:
+            parser.error('--types and --services cannot be combined with --delta-root')
+        projection = ss_converter_aws.Projection(args.types.split(',') if args.types else None,
+                                                 args.services.split(',') if args.services else None)
+
+    sources = [source for source in args.sources if source != '-']
+    if not args.sources or '-' in args.sources:
+        sources.extend(line.strip() for line in sys.stdin if line.strip())
+
+    cache = None
+    if args.cache_dir:
+        cache = ss_cache.ConversionCache(args.cache_dir, ss_converter_aws.converter_version(), args.cache_max_age,
+                                         args.cache_max_mb)
+
+    time_start = time.time()
+    try:
+        reports, missing = find_reports(sources, args.newer)
+    except OSError as e:
+        parser.error(f'cannot read --newer {args.newer}: {e.strerror}')
+    logger.info(f'batch conversion: reports={len(reports)} missing={len(missing)} workers={args.workers}')
+
+    # inputs gone before they could be converted fail like any other report
+    failed = len(missing)
+    for results_file, error in missing:
+        print(f'FAILED\t{results_file}\t{default_json_out(results_file, args.codec)}\t0\t0.00', flush=True)
+        logger.error(f'batch conversion failed: {results_file} Reason: {error}')
+
+    try:
+        for results_file, json_out, ok, count, elapsed, error in convert_batch(reports, args.workers, args.stream,
+                                                                               args.max_tasks_per_child, args.delta_root,
+                                                                               args.index, args.codec, args.level,
+                                                                               args.metrics, args.profile, cache, hec,
+                                                                               projection):
+            print(f'{"OK" if ok else "FAILED"}\t{results_file}\t{json_out}\t{count}\t{elapsed:.2f}', flush=True)
+            if not ok:
+                failed += 1
+                logger.error(f'batch conversion failed: {results_file} Reason: {error}')
+    except Exception as e:
+        logger.error(f'batch conversion aborted. Reason: {traceback.format_exc()}')
+        sys.exit(1)
+
+    if cache is not None:
+        try:
+            kept, removed, size = cache.prune()
+            logger.info(f'conversion cache {args.cache_dir}: entries={kept} evicted={removed} mb={size}')
+        except Exception as e:
+            logger.error(f'Failed to prune conversion cache: {args.cache_dir} Reason: {traceback.format_exc()}')
+
+    converted = len(reports) + len(missing) - failed
+    logger.info(f'batch conversion complete: converted={converted} failed={failed} elapsed={time.time() - time_start:.1f}s')
+    print(f'converted={converted} failed={failed}', file=sys.stderr)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import re
+
+import ss_output
+
+HASHES_HEADER = '# ss_converter_aws hashes v1'
+HASHES_SUFFIX = '.hashes'
+CHANGE_FIELD = 'change'
+CHANGE_NEW = 'new'
+CHANGE_MODIFIED = 'modified'
+CHANGE_REMOVED = 'removed'
+
+# conversion time of an event, stamped fresh every run so it is left out of the content hash
+RE_TIME = re.compile(rb'"_time":"[^"]*",?')
+
+MARKERS = {change: f',"{CHANGE_FIELD}":"{change}"}}\n'.encode() for change in (CHANGE_NEW, CHANGE_MODIFIED)}
+
+
+def event_key(service, ev_type, ev_id):
+    '''
+    identity of an event across runs. ids are only unique within a service and event type
+
+    :param service:     aws service of the event, empty for account level collections
+    :type service:      str
+    :param ev_type:     event type, e.g. inventory, findings, sg_map
+    :type ev_type:      str
+    :param ev_id:       event id
+    :type ev_id:        str
+    '''
+    return f'{service}\t{ev_type}\t{ev_id}'
+
+
+def event_digest(encoded):
+    '''
+    :param encoded:     compact JSON of the event, without the trailing newline
+    :type encoded:      bytes
+
+    :returns: 16 byte digest of the event content, ignoring _time
+    '''
+    return hashlib.blake2b(RE_TIME.sub(b'', encoded, 1), digest_size=16).digest()
+
+
+def load_previous(path):
+    '''
+    read the content hashes of a previous run, from its hash sidecar or its full converted output
+
+    :param path:    hash sidecar or converted report of the previous run of the same profile, may be compressed
+    :type path:     str
+
+    :returns: dict of event key to digest
+    '''
+    previous = {}
+
+    with ss_output.open_input(path) as f:
+        first = f.readline()
+        if first.rstrip(b'\n').decode('utf-8', 'replace') == HASHES_HEADER:
+            for line in f:
+                digest, key = line.rstrip(b'\n').decode('utf-8').split('\t', 1)
+                previous[key] = bytes.fromhex(digest)
+            return previous
+
+    with ss_output.open_input(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            ev = json.loads(line)
+            if CHANGE_FIELD in ev:
+                raise ValueError(f'{path} is a delta conversion, use its hash sidecar as the previous run')
+            # re-encode so output of older converter versions hashes like the current output
+            key = event_key(ev.get('service', ''), ev.get('type', ''), ev.get('id', ''))
+            previous[key] = event_digest(ss_output.dumps(ev))
+
+    return previous
+
+
+class DeltaTracker(object):
+    '''
+    compare converted events against the previous run of the same profile
+
+    every event passing through mark() is hashed for the next run's sidecar. with a
+    previous run, unchanged events are dropped and new or modified ones are tagged with
+    a change field; events of the previous run not seen again are reported by removed()
+    '''
+
+    def __init__(self, previous=None):
+        '''
+        :param previous:    event key to digest of the previous run, None to keep every event
+        :type previous:     dict
+        '''
+        self.previous = previous
+        self.current = {}
+        self.counts = {CHANGE_NEW: 0, CHANGE_MODIFIED: 0, CHANGE_REMOVED: 0, 'unchanged': 0}
+
+    def mark(self, key, line):
+        '''
+        :param key:     event key, see event_key()
+        :type key:      str
+        :param line:    encoded event, newline terminated
+        :type line:     bytes
+
+        :returns: line to write, tagged with its change, or None if the event is unchanged
+        '''
+        digest = event_digest(line[:-1])
+        self.current[key] = digest
+        if self.previous is None:
+            return line
+
+        previous_digest = self.previous.pop(key, None)
+        if previous_digest is None:
+            change = CHANGE_NEW
+        elif previous_digest != digest:
+            change = CHANGE_MODIFIED
+        else:
+            self.counts['unchanged'] += 1
+            return None
+
+        self.counts[change] += 1
+        return line[:-2] + MARKERS[change]
+
+    def removed(self):
+        '''
+        events of the previous run that were not converted this run, call once every event is marked
+
+        :returns: generator of (service, type, id)
+        '''
+        if not self.previous:
+            return
+
+        # mark() pops every key it sees, what is left was not converted this run
+        for key in self.previous:
+            self.counts[CHANGE_REMOVED] += 1
+            yield tuple(key.split('\t', 2))
+
+    def write_hashes(self, path):
+        '''
+        write the content hashes of this run as the next run's previous
+
+        :param path:    destination of the hash sidecar
+        :type path:     str
+        '''
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(HASHES_HEADER + '\n')
+            f.writelines(f'{digest.hex()}\t{key}\n' for key, digest in self.current.items())
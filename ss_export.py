@@ -0,0 +1,384 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import ss_delta
+import ss_output
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+loads = ss_output.orjson.loads if ss_output.orjson is not None else json.loads
+
+REPORT_PATTERN = 'report.scoutsuite.*.txt*'
+# converted reports, not their sidecars (.hashes, .idx, .metrics.json, .prof, .tmp)
+RE_REPORT = re.compile(r'report\.scoutsuite\..*\.txt(\.gz|\.zst)?$')
+BATCH_SIZE = 10000
+# partition of events without a service (sg_map, subnet_map, last_run, metadata)
+NO_SERVICE = 'none'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    aws_account_id TEXT NOT NULL,
+    service TEXT NOT NULL,
+    type TEXT NOT NULL,
+    sub_type TEXT,
+    region TEXT,
+    id TEXT NOT NULL,
+    environment TEXT,
+    report_date TEXT,
+    event TEXT NOT NULL,
+    PRIMARY KEY (aws_account_id, service, type, id)
+);
+CREATE INDEX IF NOT EXISTS events_service_type ON events (service, type, sub_type);
+CREATE INDEX IF NOT EXISTS events_region ON events (region);
+CREATE TABLE IF NOT EXISTS accounts (
+    aws_account_id TEXT PRIMARY KEY,
+    name TEXT,
+    email TEXT,
+    status TEXT,
+    ou TEXT,
+    ou_name TEXT,
+    org_id TEXT,
+    time_joined TEXT,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS accounts_ou ON accounts (ou);
+CREATE TABLE IF NOT EXISTS org_units (
+    ou_id TEXT PRIMARY KEY,
+    type TEXT,
+    name TEXT,
+    arn TEXT,
+    parent_id TEXT,
+    detail TEXT
+);
+CREATE TABLE IF NOT EXISTS reports (
+    json_out TEXT PRIMARY KEY,
+    aws_account_id TEXT,
+    environment TEXT,
+    report_date TEXT,
+    events INTEGER,
+    delta INTEGER,
+    loaded TEXT
+);
+CREATE VIEW IF NOT EXISTS account_events AS
+    SELECT events.*, accounts.name AS account_name, accounts.ou, accounts.ou_name
+    FROM events LEFT JOIN accounts USING (aws_account_id);
+'''
+
+INSERT_EVENT = 'INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+DELETE_EVENT = 'DELETE FROM events WHERE aws_account_id = ? AND service = ? AND type = ? AND id = ?'
+PARQUET_COLUMNS = ['aws_account_id', 'account_name', 'ou', 'ou_name', 'service', 'type', 'sub_type', 'region', 'id',
+                   'environment', 'change', 'event']
+
+
+def find_reports(sources):
+    '''
+    expand directories (searched recursively), globs and plain paths into converted reports
+
+    :param sources:     directories, globs or converted report paths
+    :type sources:      list
+    '''
+    reports = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths = sorted(glob.glob(os.path.join(source, '**', REPORT_PATTERN), recursive=True))
+            reports.extend(path for path in paths if RE_REPORT.search(os.path.basename(path)))
+        elif glob.has_magic(source):
+            reports.extend(sorted(glob.glob(source, recursive=True)))
+        else:
+            reports.append(source)
+    return reports
+
+
+def connect(db_path):
+    '''
+    open the export database, creating its tables on first use
+
+    :param db_path:     SQLite database file
+    :type db_path:      str
+    '''
+    db = sqlite3.connect(db_path)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.executescript(SCHEMA)
+    return db
+
+
+def _iter_json_lines(path):
+    with ss_output.open_input(path) as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def _iter_report_events(json_out):
+    '''
+    decoded events of a converted report. events without account fields (last_run) get those of
+    the report, so they are held until the first event that has them
+
+    :returns: generator of (event, line)
+    '''
+    pending = []
+    report_fields = None
+
+    for line in _iter_json_lines(json_out):
+        ev = loads(line)
+        line = line.decode('utf-8').rstrip('\n')
+        if report_fields is None:
+            if 'aws_account_id' not in ev:
+                pending.append((ev, line))
+                continue
+            report_fields = {'aws_account_id': ev['aws_account_id'], 'environment': ev.get('environment')}
+            for pending_ev, pending_line in pending:
+                yield dict(report_fields, **pending_ev), pending_line
+            pending = []
+
+        if 'aws_account_id' not in ev:
+            ev = dict(report_fields, **ev)
+        yield ev, line
+
+    # report without any account event
+    yield from pending
+
+
+def load_accounts(db, accounts_file, orgs_file=None):
+    '''
+    replace the account and OU tables with the output of get_org_list.py
+
+    :param db:  export database
+    :type db:   sqlite3.Connection
+    :param accounts_file:   aws_account_detail.txt, may be compressed
+    :type accounts_file:    str
+    :param orgs_file:   aws_orgs_detail.txt, may be compressed
+    :type orgs_file:    str
+
+    :returns: dict of aws_account_id to (account name, ou, ou_name), to join Parquet rows with
+    '''
+    accounts = {}
+    rows = []
+    for line in _iter_json_lines(accounts_file):
+        account = loads(line)
+        ou_name = (account.get('ou_detail') or {}).get('ou_name')
+        accounts[account['Id']] = (account.get('Name'), account.get('ou'), ou_name)
+        rows.append((account['Id'], account.get('Name'), account.get('Email'), account.get('Status'), account.get('ou'),
+                     ou_name, account.get('org_id'), account.get('time_joined'), line.decode('utf-8').rstrip('\n')))
+
+    with db:
+        db.execute('DELETE FROM accounts')
+        db.executemany('INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+        if orgs_file:
+            org_rows = []
+            for line in _iter_json_lines(orgs_file):
+                ou = loads(line)
+                org_rows.append((ou['Id'], ou.get('Type'), ou.get('Name'), ou.get('Arn'), ou.get('parent_id'),
+                                 line.decode('utf-8').rstrip('\n')))
+            db.execute('DELETE FROM org_units')
+            db.executemany('INSERT OR REPLACE INTO org_units VALUES (?, ?, ?, ?, ?, ?)', org_rows)
+
+    return accounts
+
+
+class ParquetSink(object):
+    '''
+    events of each report as Parquet, partitioned as <root>/date=<report date>/service=<service>/<account id>.parquet.
+    account name and OU are written into every row since Parquet readers cannot join the accounts table.
+    every partition holds all events of its account as of that date, see add_account_events for delta reports
+    '''
+
+    def __init__(self, root, accounts=None):
+        '''
+        :param root:    partition root folder
+        :type root:     str
+        :param accounts:    aws_account_id to (account name, ou, ou_name), see load_accounts
+        :type accounts:     dict
+        '''
+        if pyarrow is None:
+            raise ValueError('pyarrow is not installed, Parquet export is not available')
+        self.root = root
+        self.accounts = accounts or {}
+        self.groups = {}
+        self.replaced = set() # (report date, account id) buffered, even without events left
+
+    def add(self, report_date, ev, line):
+        account_id = ev.get('aws_account_id')
+        service = ev.get('service') or NO_SERVICE
+        self.replaced.add((report_date, account_id))
+        columns = self.groups.get((report_date, service, account_id))
+        if columns is None:
+            columns = self.groups[(report_date, service, account_id)] = {name: [] for name in PARQUET_COLUMNS}
+
+        account_name, ou, ou_name = self.accounts.get(account_id, (None, None, None))
+        for name, value in (('aws_account_id', account_id), ('account_name', account_name), ('ou', ou),
+                            ('ou_name', ou_name), ('service', ev.get('service')), ('type', ev.get('type')),
+                            ('sub_type', ev.get('sub_type')), ('region', ev.get('region')), ('id', ev.get('id')),
+                            ('environment', ev.get('environment')), ('change', ev.get(ss_delta.CHANGE_FIELD)),
+                            ('event', line)):
+            columns[name].append(None if value is None else str(value))
+
+    def add_account_events(self, db, report_date, account_id):
+        '''
+        buffer every event the export database holds for the account, once a delta report is committed.
+        a delta only carries new, modified and removed events, the partitions are rebuilt from the merged state
+
+        :param db:  export database
+        :type db:   sqlite3.Connection
+        '''
+        self.replaced.add((report_date, account_id))
+        rows = db.execute('SELECT service, type, sub_type, region, id, environment, event FROM events '
+                          'WHERE aws_account_id = ? ORDER BY service, type, id', (account_id,))
+        for service, ev_type, sub_type, region, ev_id, environment, line in rows:
+            self.add(report_date, {'aws_account_id': account_id, 'service': service or None, 'type': ev_type or None,
+                                   'sub_type': sub_type, 'region': region, 'id': ev_id, 'environment': environment}, line)
+
+    def clear(self):
+        self.groups = {}
+        self.replaced = set()
+
+    def flush(self):
+        '''
+        write the buffered report, replacing earlier exports of the same account and date. services the
+        account no longer has events in are removed from the date
+        '''
+        written = set()
+        for (report_date, service, account_id), columns in self.groups.items():
+            folder = os.path.join(self.root, f'date={report_date}', f'service={service}')
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f'{account_id}.parquet')
+            pyarrow.parquet.write_table(pyarrow.table(columns), f'{path}.tmp')
+            os.replace(f'{path}.tmp', path)
+            written.add(path)
+
+        for report_date, account_id in self.replaced:
+            for path in glob.glob(os.path.join(glob.escape(self.root), f'date={report_date}', 'service=*', f'{account_id}.parquet')):
+                if path not in written:
+                    os.remove(path)
+        self.clear()
+
+
+def export_report(db, json_out, parquet=None):
+    '''
+    load one converted report into the export database in batches, in a single transaction.
+    a full report replaces every event of its account; a delta report (events tagged with a change field)
+    upserts new and modified events and deletes removed ones. Parquet is written once the transaction
+    commits, from the report for a full report and from the merged events of the account for a delta
+
+    :param db:  export database
+    :type db:   sqlite3.Connection
+    :param json_out:    converted report, may be compressed
+    :type json_out:     str
+    :param parquet:     also write the events as Parquet
+    :type parquet:      ParquetSink
+
+    :returns: tuple of (aws_account_id, events)
+    '''
+    account_id = environment = report_date = None
+    delta = None
+    count = 0
+    batch = []
+    if parquet is not None:
+        parquet.clear()
+
+    with db:
+        for ev, line in _iter_report_events(json_out):
+            change = ev.get(ss_delta.CHANGE_FIELD)
+
+            if delta is None:
+                account_id = ev.get('aws_account_id')
+                environment = ev.get('environment')
+                report_date = str(ev.get('_time', ''))[:10] or time.strftime('%F')
+                delta = change is not None
+                if not delta:
+                    db.execute('DELETE FROM events WHERE aws_account_id = ?', (account_id,))
+
+            key = (ev.get('aws_account_id'), ev.get('service') or '', ev.get('type') or '', str(ev.get('id', '')))
+            if change == ss_delta.CHANGE_REMOVED:
+                if batch:
+                    db.executemany(INSERT_EVENT, batch)
+                    batch = []
+                db.execute(DELETE_EVENT, key)
+            else:
+                batch.append(key[:3] + (ev.get('sub_type'), ev.get('region'), key[3], ev.get('environment'),
+                                        report_date, line))
+                if len(batch) >= BATCH_SIZE:
+                    db.executemany(INSERT_EVENT, batch)
+                    batch = []
+
+            if parquet is not None and not delta:
+                parquet.add(report_date, ev, line)
+            count += 1
+
+        if batch:
+            db.executemany(INSERT_EVENT, batch)
+        db.execute('INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   (os.path.abspath(json_out), account_id, environment, report_date, count, int(bool(delta)),
+                    time.strftime('%F %T%z')))
+
+    if parquet is not None:
+        if delta:
+            parquet.add_account_events(db, report_date, account_id)
+        parquet.flush()
+    return account_id, count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=('Export converted ScoutSuite reports into a SQLite database (and optionally Parquet)\n'
+                                                  'for cross-account queries, joined with the accounts and OUs of get_org_list.py.\n\n'
+                                                  'tables: events, accounts, org_units, reports. view: account_events (events + account name and OU)\n'
+                                                  'e.g. finding counts by OU:\n'
+                                                  '  SELECT ou_name, service, count(*) FROM account_events WHERE type = \'findings\' GROUP BY 1, 2'),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('sources', nargs='*',
+                        help=f'converted report directories (searched for {REPORT_PATTERN}), globs or files. '
+                             'use - to read paths from stdin')
+    parser.add_argument('--db', required=True, help='SQLite database to export into, created if missing')
+    parser.add_argument('--accounts', default=None, help='aws_account_detail.txt of get_org_list.py, replaces the accounts table')
+    parser.add_argument('--orgs', default=None, help='aws_orgs_detail.txt of get_org_list.py, replaces the org_units table')
+    parser.add_argument('--parquet', default=None,
+                        help='also write events as Parquet under this folder, partitioned by date and service. every date holds all '
+                             'events of each account exported that day: delta reports are merged into the database first and '
+                             'their accounts rewritten from it, without the removed events and with an empty change column')
+    parser.add_argument('--query', default=None, help='run this SQL after exporting and print the rows tab separated')
+
+    args = parser.parse_args()
+
+    sources = [source for source in args.sources if source != '-']
+    if '-' in args.sources:
+        sources.extend(line.strip() for line in sys.stdin if line.strip())
+
+    failed = 0
+    db = connect(args.db)
+    try:
+        accounts = load_accounts(db, args.accounts, args.orgs) if args.accounts else None
+        if args.parquet and accounts is None:
+            accounts = {row[0]: row[1:] for row in db.execute('SELECT aws_account_id, name, ou, ou_name FROM accounts')}
+        parquet = ParquetSink(args.parquet, accounts) if args.parquet else None
+
+        for json_out in find_reports(sources):
+            time_start = time.time()
+            try:
+                account_id, count = export_report(db, json_out, parquet)
+                print(f'OK\t{json_out}\t{account_id}\t{count}\t{time.time() - time_start:.2f}', flush=True)
+            except Exception as e:
+                failed += 1
+                print(f'FAILED\t{json_out}\t{type(e).__name__}: {e}', flush=True)
+
+        if args.query:
+            for row in db.execute(args.query):
+                print('\t'.join('' if value is None else str(value) for value in row))
+    except (ValueError, sqlite3.Error, OSError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        db.close()
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,625 @@
+import argparse
+import gzip
+import http.client
+import http.server
+import os
+import queue
+import random
+import signal
+import ssl
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+import ss_output
+
+DEFAULT_PATH = '/services/collector/raw'
+TOKEN_ENV = 'SS_HEC_TOKEN'
+SPILL_SUFFIX = '.spill'
+BATCH_BYTES = 1 << 20 # uncompressed request body
+BATCH_EVENTS = 5000
+SENDERS = 4
+RETRIES = 5
+BACKOFF = 0.5 # seconds before the first retry, doubled per retry
+MAX_BACKOFF = 30.0
+# busy or unavailable, worth retrying. anything else (bad token, bad request) is not
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class HECError(Exception):
+    '''
+    a batch was not accepted by the HTTP Event Collector
+    '''
+
+
+def spill_path(json_out, codec='none'):
+    '''
+    events HEC did not accept go next to the converted report: report.scoutsuite.<profile>.txt.spill[.gz|.zst]
+
+    :param json_out:    destination of the converted report
+    :type json_out:     str
+    :param codec:   codec of the converted report, the spill file uses the same one
+    :type codec:    str
+    '''
+    suffix = ss_output.CODEC_SUFFIXES[codec]
+    if suffix and json_out.endswith(suffix):
+        json_out = json_out[:-len(suffix)]
+    return f'{json_out}{SPILL_SUFFIX}{suffix}'
+
+
+class HECClient(object):
+    '''
+    posts newline delimited events to a Splunk HTTP Event Collector raw endpoint over pooled keep-alive
+    connections, gzipping request bodies and retrying busy or failed requests with exponential backoff
+
+    connections are opened on demand and kept for the life of the process; the client pickles without
+    them, so it can be handed to pool workers like ss_cache.ConversionCache
+    '''
+
+    def __init__(self, url, token, sourcetype=None, index=None, host=None, channel=None, senders=SENDERS,
+                 batch_bytes=BATCH_BYTES, batch_events=BATCH_EVENTS, retries=RETRIES, backoff=BACKOFF,
+                 timeout=30.0, compresslevel=1, verify=True):
+        '''
+        :param url:     collector url, e.g. https://splunk:8088. default path /services/collector/raw
+        :type url:      str
+        :param token:   HEC token
+        :type token:    str
+        :param sourcetype:  sourcetype of the events, default of the token when None
+        :type sourcetype:   str
+        :param index:   index of the events, default of the token when None
+        :type index:    str
+        :param host:    host field of the events
+        :type host:     str
+        :param channel:     request channel, a random one when None
+        :type channel:      str
+        :param senders:     concurrent requests per sink
+        :type senders:      int
+        :param batch_bytes:     post a batch once its uncompressed body reaches this size
+        :type batch_bytes:      int
+        :param batch_events:    post a batch once it holds this many events
+        :type batch_events:     int
+        :param retries:     retries of a batch before it is spilled
+        :type retries:      int
+        :param backoff:     seconds before the first retry, doubled per retry with jitter
+        :type backoff:      float
+        :param timeout:     socket timeout in seconds
+        :type timeout:      float
+        :param compresslevel:   gzip level of request bodies, 0 to send them uncompressed
+        :type compresslevel:    int
+        :param verify:  verify the TLS certificate of the collector
+        :type verify:   bool
+        '''
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise ValueError(f'invalid HEC url: {url}')
+
+        self.url = url
+        self.token = token
+        self.sourcetype = sourcetype
+        self.index = index
+        self.host = host
+        self.channel = channel or str(uuid.uuid4())
+        self.senders = max(senders, 1)
+        self.batch_bytes = batch_bytes
+        self.batch_events = batch_events
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.compresslevel = compresslevel
+        self.verify = verify
+
+        self._https = parsed.scheme == 'https'
+        self._address = (parsed.hostname, parsed.port)
+        self._path = parsed.path if parsed.path not in ('', '/') else DEFAULT_PATH
+        self._pool = queue.LifoQueue()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_pool']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool = queue.LifoQueue()
+
+    def _connection(self):
+        '''
+        :returns: tuple of (connection, whether it was reused from the pool)
+        '''
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            pass
+
+        host, port = self._address
+        if not self._https:
+            return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+        context = ssl.create_default_context()
+        if not self.verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=context), False
+
+    def _delay(self, retry, retry_after=None):
+        '''
+        :returns: seconds to wait before the retry, Retry-After of the collector when it sent one
+        '''
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+        delay = min(self.backoff * 2 ** retry, MAX_BACKOFF)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def target(self, source=None):
+        '''
+        :param source:  source field of the events, usually the converted report they belong to
+        :type source:   str
+
+        :returns: request path with the event metadata as query parameters
+        '''
+        params = {name: value for name, value in (('sourcetype', self.sourcetype), ('index', self.index),
+                                                   ('host', self.host), ('source', source)) if value}
+        return f'{self._path}?{urllib.parse.urlencode(params)}' if params else self._path
+
+    def post(self, body, target=None):
+        '''
+        post one batch, retrying busy responses and connection errors
+
+        :param body:    newline delimited events
+        :type body:     bytes
+        :param target:  request path, see target()
+        :type target:   str
+
+        :returns: tuple of (retries needed, bytes sent)
+        '''
+        headers = {'Authorization': f'Splunk {self.token}', 'X-Splunk-Request-Channel': self.channel,
+                   'Content-Type': 'text/plain; charset=utf-8'}
+        if self.compresslevel:
+            body = gzip.compress(body, compresslevel=self.compresslevel, mtime=0)
+            headers['Content-Encoding'] = 'gzip'
+
+        retry = 0
+        while True:
+            retry_after = None
+            conn, reused = self._connection()
+            try:
+                conn.request('POST', target or self._path, body, headers)
+                response = conn.getresponse()
+                payload = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if reused:
+                    # the collector closed the idle keep-alive connection, not a failed attempt
+                    continue
+                error = f'{type(e).__name__}: {e}'
+            else:
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._pool.put(conn)
+                if response.status == 200:
+                    return retry, len(body)
+
+                error = f'HTTP {response.status}: {payload[:200].decode("utf-8", "replace")}'
+                if response.status not in RETRY_STATUS:
+                    raise HECError(error)
+                retry_after = response.getheader('Retry-After')
+
+            if retry == self.retries:
+                raise HECError(f'{error} after {self.retries} retries')
+            time.sleep(self._delay(retry, retry_after))
+            retry += 1
+
+    def sink(self, spill=None, codec='none', level=None, source=None):
+        '''
+        :param spill:   write batches that were not accepted here, see spill_path()
+        :type spill:    str
+        :param codec:   codec of the spill file
+        :type codec:    str
+        :param level:   compression level of the spill file
+        :type level:    int
+        :param source:  source field of the events
+        :type source:   str
+
+        :returns: HECSink posting events through this client
+        '''
+        return HECSink(self, spill, codec, level, source)
+
+    def send_file(self, path, spill=None, codec='none', source=None):
+        '''
+        post a converted report or spill file, in any codec
+
+        :param path:    newline delimited events
+        :type path:     str
+        :param spill:   write batches that were not accepted here
+        :type spill:    str
+        :param codec:   codec of the spill file
+        :type codec:    str
+        :param source:  source field of the events, default the file itself
+        :type source:   str
+
+        :returns: sink stats, see HECSink.stats()
+        '''
+        with ss_output.open_input(path) as f:
+            with self.sink(spill, codec, source=source or os.path.abspath(path)) as sink:
+                # whole lines only, the partial line at the end of a read is carried into the next one
+                # so no event is split across batches
+                tail = b''
+                for chunk in iter(lambda: f.read(ss_output.BUFFER_SIZE), b''):
+                    block = tail + chunk if tail else chunk
+                    end = block.rfind(b'\n') + 1
+                    tail = block[end:]
+                    if end:
+                        sink.write(block[:end], block.count(b'\n', 0, end))
+                if tail:
+                    sink.write(tail + b'\n', 1)
+        return sink.stats()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class HECSink(object):
+    '''
+    batch newline delimited events by size and count and post them from a few sender threads.
+    at most 2 batches per sender wait in the queue, so the writer blocks instead of buffering
+    a whole report when the collector falls behind
+
+    batches the collector does not accept, after retries, are spilled to a file in the same format
+    as the converted report, for a forwarder or `ss_hec.py send` to pick up later. once a batch
+    fails for good the collector is considered down and the remaining batches are spilled directly
+    '''
+
+    def __init__(self, client, spill=None, codec='none', level=None, source=None):
+        '''
+        :param client:  collector to post to
+        :type client:   HECClient
+        :param spill:   write batches that were not accepted here. without it they are dropped
+        :type spill:    str
+        :param codec:   codec of the spill file
+        :type codec:    str
+        :param level:   compression level of the spill file
+        :type level:    int
+        :param source:  source field of the events
+        :type source:   str
+        '''
+        self.client = client
+        self.spill = spill
+        self._spill_codec = codec
+        self._spill_level = level
+        self._spill_fp = None
+        self._target = client.target(source)
+
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_events = 0
+        self._queue = queue.Queue(client.senders * 2)
+        self._lock = threading.Lock()
+        self._down = threading.Event()
+        self.error = None
+
+        self.events = 0
+        self.bytes = 0
+        self.batches = 0
+        self.delivered = 0
+        self.spilled = 0
+        self.retries = 0
+        self.sent_bytes = 0
+        self.wait_seconds = 0.0
+        self._time_start = time.perf_counter()
+
+        self._senders = [threading.Thread(target=self._send_batches, name=f'hec-sender-{idx}', daemon=True)
+                         for idx in range(client.senders)]
+        for sender in self._senders:
+            sender.start()
+
+    def write(self, data, events=1):
+        '''
+        :param data:    one or more newline terminated encoded events
+        :type data:     bytes
+        :param events:  number of events in data
+        :type events:   int
+        '''
+        batch_events = self.client.batch_events
+        if self._pending_events + events > batch_events:
+            self.flush()
+            if events > batch_events:
+                # more events than fit in a batch, e.g. a whole writer buffer. split on newlines only,
+                # data is whole lines
+                lines = [line + b'\n' for line in data[:-1].split(b'\n')]
+                for start in range(0, len(lines), batch_events):
+                    self._pending = lines[start:start + batch_events]
+                    self._pending_bytes = sum(map(len, self._pending))
+                    self._pending_events = len(self._pending)
+                    self.flush()
+                return
+
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+        self._pending_events += events
+        if self._pending_bytes >= self.client.batch_bytes or self._pending_events >= self.client.batch_events:
+            self.flush()
+
+    def flush(self):
+        '''
+        queue the pending events as one batch, waits while the queue is full
+        '''
+        if not self._pending:
+            return
+        batch = (b''.join(self._pending), self._pending_events)
+        self.events += self._pending_events
+        self.bytes += self._pending_bytes
+        self.batches += 1
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_events = 0
+
+        time_start = time.perf_counter()
+        self._queue.put(batch)
+        self.wait_seconds += time.perf_counter() - time_start
+
+    def _send_batches(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            body, events = batch
+            if not self._down.is_set():
+                try:
+                    retries, sent = self.client.post(body, self._target)
+                    with self._lock:
+                        self.delivered += events
+                        self.retries += retries
+                        self.sent_bytes += sent
+                    continue
+                except Exception as e:
+                    self.error = f'{type(e).__name__}: {e}'
+                    self._down.set()
+            self._spill(body, events)
+
+    def _spill(self, body, events):
+        with self._lock:
+            if self.spill:
+                if self._spill_fp is None:
+                    self._spill_fp = ss_output.open_sink(f'{self.spill}.tmp', self._spill_codec, self._spill_level)
+                self._spill_fp.write(body)
+            self.spilled += events
+
+    def close(self, abort=False):
+        '''
+        post the pending events and wait for the senders. the spill file is moved into place
+        when anything was spilled, a stale one from an earlier run is removed otherwise
+
+        :param abort:   the conversion failed, drop pending and queued batches
+        :type abort:    bool
+
+        :returns: stats, see stats()
+        '''
+        if abort:
+            self._pending = []
+            self._down.set()
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+        else:
+            self.flush()
+
+        for _ in self._senders:
+            self._queue.put(None)
+        for sender in self._senders:
+            sender.join()
+
+        if self._spill_fp is not None:
+            self._spill_fp.close()
+            if abort:
+                os.remove(f'{self.spill}.tmp')
+            else:
+                os.replace(f'{self.spill}.tmp', self.spill)
+        elif self.spill and not abort and os.path.exists(self.spill):
+            os.remove(self.spill)
+        return self.stats()
+
+    def stats(self):
+        '''
+        :returns: dict of events, bytes (uncompressed), batches, delivered and spilled events, retries,
+                  sent_bytes (compressed), seconds, wait_seconds the writer was blocked on a full queue
+                  and the error that took the collector down
+        '''
+        return {
+            'events': self.events,
+            'bytes': self.bytes,
+            'batches': self.batches,
+            'delivered': self.delivered,
+            'spilled': self.spilled,
+            'retries': self.retries,
+            'sent_bytes': self.sent_bytes,
+            'seconds': round(time.perf_counter() - self._time_start, 3),
+            'wait_seconds': round(self.wait_seconds, 3),
+            'error': self.error,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(abort=exc_type is not None)
+
+
+def client_from_args(args):
+    '''
+    :param args:    parsed --hec-* arguments, see add_arguments()
+    :type args:     argparse.Namespace
+
+    :returns: HECClient, None without --hec-url
+    '''
+    if not args.hec_url:
+        return None
+    token = args.hec_token or os.environ.get(TOKEN_ENV)
+    if not token:
+        raise ValueError(f'--hec-url requires --hec-token or {TOKEN_ENV}')
+    return HECClient(args.hec_url, token, sourcetype=args.hec_sourcetype, index=args.hec_index,
+                     senders=args.hec_senders, batch_bytes=args.hec_batch_kb * 1024, batch_events=args.hec_batch_events,
+                     retries=args.hec_retries, verify=not args.hec_insecure)
+
+
+def add_arguments(parser):
+    '''
+    --hec-* arguments shared by the converter, the batch converter and `ss_hec.py send`
+
+    :param parser:  parser to add them to
+    :type parser:   argparse.ArgumentParser
+    '''
+    parser.add_argument('--hec-url', default=None,
+                        help=f'post events to this Splunk HTTP Event Collector, e.g. https://splunk:8088 (path default: {DEFAULT_PATH})')
+    parser.add_argument('--hec-token', default=None, help=f'HEC token, default: ${TOKEN_ENV}')
+    parser.add_argument('--hec-sourcetype', default=None, help='sourcetype of the events, default: the token\'s')
+    parser.add_argument('--hec-index', default=None, help='index of the events, default: the token\'s')
+    parser.add_argument('--hec-senders', type=int, default=SENDERS, help=f'concurrent requests (default: {SENDERS})')
+    parser.add_argument('--hec-batch-kb', type=int, default=BATCH_BYTES // 1024,
+                        help=f'uncompressed KB per request (default: {BATCH_BYTES // 1024})')
+    parser.add_argument('--hec-batch-events', type=int, default=BATCH_EVENTS,
+                        help=f'events per request (default: {BATCH_EVENTS})')
+    parser.add_argument('--hec-retries', type=int, default=RETRIES,
+                        help=f'retries of a busy or failed request before its events are spilled (default: {RETRIES})')
+    parser.add_argument('--hec-insecure', action='store_true', help='do not verify the TLS certificate of the collector')
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    minimal HEC raw endpoint for testing: checks the token, decompresses gzip bodies and appends them to a file.
+    bodies not ending on a newline, an event cut across requests, are counted as partial
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.counts['connections'] += 1
+
+    def _reply(self, status, text, code):
+        payload = f'{{"text":"{text}","code":{code}}}'.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Authorization') != f'Splunk {self.server.token}':
+            return self._reply(403, 'Invalid token', 4)
+        if random.random() < self.server.fail_rate:
+            with self.server.lock:
+                self.server.counts['busy'] += 1
+            return self._reply(503, 'Server is busy', 9)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        with self.server.lock:
+            self.server.counts['requests'] += 1
+            self.server.counts['events'] += body.count(b'\n')
+            if not body.endswith(b'\n'):
+                self.server.counts['partial'] += 1
+            if self.server.out is not None:
+                self.server.out.write(body)
+        self._reply(200, 'Success', 0)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port, token, out=None, fail_rate=0.0):
+    '''
+    stand-in HEC bound on localhost, not serving yet. counts holds the connections, requests, busy
+    replies, events and partial requests received
+
+    :param port:    port to listen on, 0 for any free port, see server_address
+    :type port:     int
+    :param token:   token requests must carry
+    :type token:    str
+    :param out:     append received events to this file
+    :type out:      str
+    :param fail_rate:   answer this share of requests with 503 busy, to exercise retries
+    :type fail_rate:    float
+
+    :returns: http.server.ThreadingHTTPServer
+    '''
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), _StandInHandler)
+    server.token = token
+    server.fail_rate = fail_rate
+    server.lock = threading.Lock()
+    server.counts = {'connections': 0, 'requests': 0, 'busy': 0, 'events': 0, 'partial': 0}
+    server.out = open(out, 'ab') if out else None
+    return server
+
+
+def serve(port, token, out=None, fail_rate=0.0):
+    '''
+    run a stand-in HEC on localhost until interrupted or terminated, see make_server
+
+    :returns: dict of connections, requests, busy replies, events and partial requests received
+    '''
+    server = make_server(port, token, out, fail_rate)
+    # background jobs ignore SIGINT, stop on either
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if server.out is not None:
+            server.out.close()
+    return server.counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=('Post converted reports or spill files to a Splunk HTTP Event Collector,\n'
+                                                  'or run a stand-in collector on localhost to test against.'),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    send_parser = commands.add_parser('send', help='post files, e.g. *.spill left by an earlier run')
+    send_parser.add_argument('files', nargs='+', help='converted reports or spill files, in any codec')
+    send_parser.add_argument('--remove', action='store_true', help='remove each file once all its events were delivered')
+    add_arguments(send_parser)
+
+    serve_parser = commands.add_parser('serve', help='stand-in collector, prints what it received when interrupted')
+    serve_parser.add_argument('--port', type=int, default=8088)
+    serve_parser.add_argument('--token', default=os.environ.get(TOKEN_ENV, 'test'))
+    serve_parser.add_argument('--out', default=None, help='append received events to this file')
+    serve_parser.add_argument('--fail-rate', type=float, default=0.0, help='answer this share of requests with 503 busy')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        counts = serve(args.port, args.token, args.out, args.fail_rate)
+        print(' '.join(f'{name}={count}' for name, count in counts.items()))
+        sys.exit(0)
+
+    if not args.hec_url:
+        parser.error('send requires --hec-url')
+    client = client_from_args(args)
+    failed = 0
+    for path in args.files:
+        # a file is spilled to itself, so a partial delivery keeps exactly the undelivered events
+        codec = next((codec for codec, suffix in ss_output.CODEC_SUFFIXES.items() if suffix and path.endswith(suffix)), 'none')
+        stats = client.send_file(path, spill=f'{path}.resend', codec=codec)
+        if stats['spilled']:
+            failed += 1
+            os.replace(f'{path}.resend', path)
+        elif args.remove:
+            os.remove(path)
+        # status, file, delivered events, spilled events, seconds, error
+        fields = ['FAILED' if stats['spilled'] else 'OK', path, stats['delivered'], stats['spilled'], f'{stats["seconds"]:.2f}']
+        print('\t'.join(str(field) for field in fields + ([stats['error']] if stats['error'] else [])), flush=True)
+    client.close()
+    sys.exit(1 if failed else 0)
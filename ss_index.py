@@ -0,0 +1,186 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import sys
+
+INDEX_TRAILER = '# ss_converter_aws index v1'
+INDEX_SUFFIX = '.idx'
+# event fields the index is keyed on, in column order after offset and length. id is last so it may hold tabs
+INDEX_FIELDS = ['type', 'service', 'sub_type', 'region', 'id']
+
+
+class ReportIndexError(ValueError):
+    '''
+    index is missing, malformed or does not belong to the converted report
+    '''
+
+
+class IndexWriter(object):
+    '''
+    byte offset index of a converted report, one tab separated line per event:
+        offset  length  type  service  sub_type  region  id
+    followed by a trailer line holding the size of the report it was written for
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path:    destination of the index, usually <report>.idx
+        :type path:     str
+        '''
+        self._fp = open(path, 'w', encoding='utf-8')
+        self._lines = []
+
+    def add(self, offset, length, meta):
+        '''
+        :param offset:  byte offset of the event line in the report
+        :type offset:   int
+        :param length:  byte length of the event line, newline included
+        :type length:   int
+        :param meta:    (type, service, sub_type, region, id) of the event, None for missing fields
+        :type meta:     tuple
+        '''
+        fields = '\t'.join('' if value is None else str(value) for value in meta)
+        self._lines.append(f'{offset}\t{length}\t{fields}\n')
+        if len(self._lines) >= 10000:
+            self._fp.writelines(self._lines)
+            self._lines = []
+
+    def close(self, report_size):
+        '''
+        :param report_size:     size of the finished report, recorded to detect a stale index
+        :type report_size:      int
+        '''
+        if self._fp.closed:
+            return
+        self._fp.writelines(self._lines)
+        self._fp.write(f'{INDEX_TRAILER}\tsize={report_size}\n')
+        self._fp.close()
+
+
+def _index_pattern(filters):
+    '''
+    regex matching the index lines of events with the given field values
+
+    :param filters:     field name to exact value, id_prefix matches the start of the id
+    :type filters:      dict
+    '''
+    columns = []
+    for field in INDEX_FIELDS:
+        value = filters.get(field)
+        if field == 'id' and value is None and filters.get('id_prefix') is not None:
+            columns.append(re.escape(filters['id_prefix'].encode()) + rb'[^\n]*')
+        elif value is None:
+            columns.append(rb'[^\n]*' if field == 'id' else rb'[^\t\n]*')
+        else:
+            columns.append(re.escape(str(value).encode()))
+    return re.compile(rb'^(\d+)\t(\d+)\t' + rb'\t'.join(columns) + rb'$', re.M)
+
+
+class IndexedReport(object):
+    '''
+    random access to a converted report through its index. both files are memory mapped,
+    a query scans the index only and reads just the matching event lines of the report
+    '''
+
+    def __init__(self, report, index=None):
+        '''
+        :param report:  converted report, report.scoutsuite.<profile>.txt
+        :type report:   str
+        :param index:   index of the report, default <report>.idx
+        :type index:    str
+        '''
+        index = index or report + INDEX_SUFFIX
+        if not os.path.exists(index):
+            raise ReportIndexError(f'no index for {report}: {index}')
+
+        self._files = []
+        self._report = self._map(report)
+        self._index = self._map(index)
+
+        # the trailer is written last, so its size check also catches an interrupted index
+        trailer_start = self._index.rfind(b'\n', 0, max(len(self._index) - 1, 0)) + 1
+        trailer = self._index[trailer_start:].decode('utf-8').rstrip('\n')
+        if trailer != f'{INDEX_TRAILER}\tsize={len(self._report)}':
+            self.close()
+            raise ReportIndexError(f'index {index} does not match {report}, convert the report again')
+
+    def _map(self, path):
+        f = open(path, 'rb')
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def find(self, **filters):
+        '''
+        :param filters:     exact values of type, service, sub_type, region or id, or id_prefix
+
+        :returns: generator of (offset, length) of the matching events, in report order
+        '''
+        unknown = set(filters) - set(INDEX_FIELDS) - {'id_prefix'}
+        if unknown:
+            raise ValueError(f'unknown index fields: {", ".join(sorted(unknown))}')
+
+        for m in _index_pattern(filters).finditer(self._index):
+            yield int(m.group(1)), int(m.group(2))
+
+    def raw(self, **filters):
+        '''
+        :returns: generator of matching event lines as bytes, newline included
+        '''
+        for offset, length in self.find(**filters):
+            yield self._report[offset:offset + length]
+
+    def events(self, **filters):
+        '''
+        :returns: generator of matching events, decoded
+        '''
+        for line in self.raw(**filters):
+            yield json.loads(line)
+
+    def close(self):
+        for mapped in (getattr(self, '_report', None), getattr(self, '_index', None)):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        for f in self._files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=("Query a converted ScoutSuite report through its index.\n\n"
+                                                  "  examples:\n"
+                                                  "    %(prog)s report.scoutsuite.prod.txt --type findings --service iam\n"
+                                                  "    %(prog)s report.scoutsuite.prod.txt --service ec2 --type inventory --sub-type instances\n"
+                                                  "    %(prog)s report.scoutsuite.prod.txt --id-prefix findings:\n"),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('report', help='converted report, report.scoutsuite.<profile>.txt')
+    parser.add_argument('--index', default=None, help=f'index of the report, default: <report>{INDEX_SUFFIX}')
+    for field in INDEX_FIELDS:
+        parser.add_argument(f'--{field.replace("_", "-")}', dest=field, default=None, help=f'exact event {field}')
+    parser.add_argument('--id-prefix', dest='id_prefix', default=None, help='event id starts with this, e.g. findings:. inventory events carry the id of '
+                                                                          'the resource body (e.g. i-0abc for an instance), select them with --sub-type')
+    parser.add_argument('--count', action='store_true', help='print the number of matching events only')
+
+    args = parser.parse_args()
+    filters = {field: getattr(args, field) for field in INDEX_FIELDS + ['id_prefix'] if getattr(args, field) is not None}
+
+    try:
+        with IndexedReport(args.report, args.index) as report:
+            if args.count:
+                print(sum(1 for _ in report.find(**filters)))
+            else:
+                out = sys.stdout.buffer
+                for line in report.raw(**filters):
+                    out.write(line)
+    except ReportIndexError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
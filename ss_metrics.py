@@ -0,0 +1,284 @@
+import argparse
+import collections
+import contextlib
+import glob
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+
+METRICS_SUFFIX = '.metrics.json'
+PROFILE_SUFFIX = '.prof'
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    '''
+    peak resident set size over the life of the process, not just the current conversion
+
+    :param who:     resource.RUSAGE_SELF, or resource.RUSAGE_CHILDREN for the largest reaped child process
+    :type who:      int
+    '''
+    # ru_maxrss is in KB on linux and bytes on macOS
+    return round(resource.getrusage(who).ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 1024), 1)
+
+
+class ConversionMetrics(object):
+    '''
+    timings and counters of one report conversion, written as a JSON sidecar
+
+    service and collection timings run from the first to the last event of the service, so they
+    include serializing and writing its events. time spent parsing is kept apart, per stage and,
+    when streaming, per service. service workers measure their services themselves, see state()
+    '''
+
+    def __init__(self, event_type=None):
+        '''
+        :param event_type:  function returning (type, sub_type) of an event, to count events per type
+        :type event_type:   function
+        '''
+        self.time_start = time.perf_counter()
+        self.event_type = event_type
+        self.stages = collections.defaultdict(float)
+        self.services = {}
+        self.collections = {}
+        self.types = collections.Counter()
+        self.duplicates = 0
+        # service.key of results keys no extraction plan handles
+        self.unknown_keys = collections.Counter()
+
+    @staticmethod
+    def _section(sections, name):
+        if name not in sections:
+            sections[name] = {'seconds': 0.0, 'parse_seconds': 0.0, 'events': 0}
+        return sections[name]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''
+        add the time spent in the block to a stage, e.g. parse
+        '''
+        time_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - time_start
+
+    def timed(self, name, iterator):
+        '''
+        pass items through, adding the time spent producing each one to a stage
+
+        :param name:    stage name, e.g. parse
+        :type name:     str
+        :param iterator:    items to time
+        :type iterator:     iterator
+        '''
+        iterator = iter(iterator)
+        while True:
+            with self.stage(name):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def parse_services(self, services):
+        '''
+        pass streamed (service_name, service) pairs through, adding the time to parse each service
+        to the parse stage and to the service
+
+        :param services:    (service_name, service) pairs
+        :type services:     iterator
+        '''
+        services = iter(services)
+        while True:
+            time_start = time.perf_counter()
+            item = next(services, StopIteration)
+            elapsed = time.perf_counter() - time_start
+            self.stages['parse'] += elapsed
+            if item is StopIteration:
+                return
+            self._section(self.services, item[0])['parse_seconds'] += elapsed
+            yield item
+
+    def measure(self, name, events, service=True):
+        '''
+        pass the events of one service or top level collection through, timing and counting them
+
+        :param name:    service name, or top level key such as sg_map
+        :type name:     str
+        :param events:  (head, envelope, body) events
+        :type events:   iterator
+        :param service:     name is a service, else a top level collection
+        :type service:      bool
+        '''
+        section = self._section(self.services if service else self.collections, name)
+        time_start = time.perf_counter()
+        try:
+            for ev in events:
+                section['events'] += 1
+                if self.event_type is not None:
+                    self.types[self.event_type(ev)] += 1
+                yield ev
+        finally:
+            section['seconds'] += time.perf_counter() - time_start
+
+    def state(self):
+        '''
+        :returns: counters of a service worker, to be merged into the conversion with merge()
+        '''
+        return {'stages': dict(self.stages), 'services': self.services, 'collections': self.collections,
+                'types': dict(self.types), 'duplicates': self.duplicates, 'unknown_keys': dict(self.unknown_keys)}
+
+    def merge(self, state):
+        '''
+        :param state:   counters of a service worker, see state(). worker stages add up across workers
+        :type state:    dict
+        '''
+        for name, seconds in state['stages'].items():
+            self.stages[name] += seconds
+        for name in ('services', 'collections'):
+            sections = getattr(self, name)
+            for section_name, worker_section in state[name].items():
+                section = self._section(sections, section_name)
+                for key, value in worker_section.items():
+                    section[key] += value
+        self.types.update(state['types'])
+        self.duplicates += state['duplicates']
+        self.unknown_keys.update(state['unknown_keys'])
+
+    def to_dict(self, **extra):
+        '''
+        :param extra:   report level fields, e.g. results_file, events, bytes
+
+        :returns: all metrics, JSON serializable
+        '''
+        def rounded(sections):
+            return {name: {key: round(value, 4) for key, value in section.items()}
+                    for name, section in sorted(sections.items())}
+
+        metrics = dict(extra)
+        metrics.update({
+            'seconds': round(time.perf_counter() - self.time_start, 4),
+            'stages': {name: round(seconds, 4) for name, seconds in sorted(self.stages.items())},
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_children_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+            'duplicates': self.duplicates,
+            'services': rounded(self.services),
+            'collections': rounded(self.collections),
+            'types': {'/'.join(str(part) for part in ev_type if part is not None): count
+                      for ev_type, count in sorted(self.types.items(), key=lambda item: str(item[0]))},
+            'unknown_keys': dict(sorted(self.unknown_keys.items())),
+        })
+        return metrics
+
+    def write(self, path, **extra):
+        '''
+        :param path:    destination of the metrics sidecar
+        :type path:     str
+        :param extra:   report level fields, e.g. results_file, events, bytes
+        '''
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(**extra), f, indent=2)
+            f.write('\n')
+
+
+def find_sidecars(sources, suffix):
+    '''
+    expand directories (searched recursively), globs and plain paths into sidecar files
+
+    :param sources:     directories, globs or sidecar paths
+    :type sources:      list
+    :param suffix:  sidecar suffix searched for in directories, e.g. .metrics.json
+    :type suffix:   str
+    '''
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(sorted(glob.glob(os.path.join(source, '**', f'*{suffix}'), recursive=True)))
+        elif glob.has_magic(source):
+            paths.extend(sorted(glob.glob(source, recursive=True)))
+        else:
+            paths.append(source)
+    return paths
+
+
+def aggregate(paths):
+    '''
+    sum the metrics sidecars of many conversions, e.g. every account of a nightly run
+
+    :param paths:   metrics sidecars
+    :type paths:    list
+
+    :returns: dict of reports, seconds, events, bytes, duplicates, max peak_rss_mb,
+              and stages, services, types, unknown_keys summed across reports
+    '''
+    total = {'reports': 0, 'seconds': 0.0, 'events': 0, 'bytes': 0, 'duplicates': 0, 'peak_rss_mb': 0.0,
+             'stages': collections.Counter(), 'services': {}, 'types': collections.Counter(),
+             'unknown_keys': collections.Counter()}
+
+    for path in paths:
+        with open(path) as f:
+            metrics = json.load(f)
+        total['reports'] += 1
+        for key in ('seconds', 'events', 'bytes', 'duplicates'):
+            total[key] += metrics.get(key, 0)
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], metrics.get('peak_rss_mb', 0.0))
+        total['stages'].update(metrics.get('stages', {}))
+        total['types'].update(metrics.get('types', {}))
+        total['unknown_keys'].update(metrics.get('unknown_keys', {}))
+        for name, section in list(metrics.get('services', {}).items()) + list(metrics.get('collections', {}).items()):
+            summed = total['services'].setdefault(name, collections.Counter())
+            summed.update(section)
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=('Aggregate converter metrics sidecars (--metrics) and cProfile dumps (--profile)\n'
+                                                  'across many conversions to find where the time goes.'),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('sources', nargs='+',
+                        help=f'report directories (searched for *{METRICS_SUFFIX} and *{PROFILE_SUFFIX}), globs or sidecar files')
+    parser.add_argument('--top', type=int, default=15, help='rows per table')
+    parser.add_argument('--profiles', action='store_true', help=f'also merge *{PROFILE_SUFFIX} dumps and print the hottest functions')
+    parser.add_argument('--sort', default='cumulative', help='pstats sort key for --profiles (default: cumulative)')
+    parser.add_argument('--json', dest='as_json', action='store_true', help='print the aggregate as JSON instead of tables')
+
+    args = parser.parse_args()
+
+    paths = [path for path in find_sidecars(args.sources, METRICS_SUFFIX) if path.endswith(METRICS_SUFFIX)]
+    total = aggregate(paths)
+
+    if args.as_json:
+        json.dump(total, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print(f'reports={total["reports"]} events={total["events"]} seconds={total["seconds"]:.1f} '
+              f'MB={total["bytes"] / 2 ** 20:.1f} duplicates={total["duplicates"]} max_peak_rss_mb={total["peak_rss_mb"]}')
+
+        print(f'\n{"stage":<24} {"seconds":>10}')
+        for name, seconds in total['stages'].most_common(args.top):
+            print(f'{name:<24} {seconds:>10.2f}')
+
+        print(f'\n{"service":<24} {"seconds":>10} {"parse":>10} {"events":>10} {"events/s":>10}')
+        services = sorted(total['services'].items(), key=lambda item: item[1]['seconds'] + item[1]['parse_seconds'], reverse=True)
+        for name, section in services[:args.top]:
+            rate = section['events'] / section['seconds'] if section['seconds'] else 0
+            print(f'{name:<24} {section["seconds"]:>10.2f} {section["parse_seconds"]:>10.2f} {section["events"]:>10} {rate:>10.0f}')
+
+        print(f'\n{"type":<40} {"events":>10}')
+        for name, count in total['types'].most_common(args.top):
+            print(f'{name:<40} {count:>10}')
+
+        if total['unknown_keys']:
+            print(f'\n{"unknown key (no extraction plan)":<40} {"reports":>10}')
+            for name, count in total['unknown_keys'].most_common(args.top):
+                print(f'{name:<40} {count:>10}')
+
+    if args.profiles:
+        profiles = [path for path in find_sidecars(args.sources, PROFILE_SUFFIX) if path.endswith(PROFILE_SUFFIX)]
+        if profiles:
+            stats = pstats.Stats(*profiles, stream=sys.stderr if args.as_json else sys.stdout)
+            stats.sort_stats(args.sort).print_stats(args.top)
+        else:
+            print(f'no *{PROFILE_SUFFIX} dumps found', file=sys.stderr)
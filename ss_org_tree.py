@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import sys
+
+TREE_VERSION = 1
+PATH_SEP = '/'
+
+
+class OrgTreeError(ValueError):
+    '''
+    org tree file is missing, malformed or of another version
+    '''
+
+
+class OrgNode(object):
+    '''
+    root or ou of the org tree. path, depth and span are filled in by OrgTree.index()
+    '''
+    __slots__ = ('id', 'name', 'type', 'parent', 'children', 'accounts', 'depth', 'path', 'names', 'span')
+
+    def __init__(self, ou_id, name=None, ou_type=None, parent=None):
+        self.id = ou_id
+        self.name = name
+        self.type = ou_type
+        self.parent = parent
+        self.children = []
+        self.accounts = []
+        self.depth = 0
+        self.path = ()
+        self.names = ()
+        self.span = (0, 0)
+
+
+class OrgTree(object):
+    '''
+    roots, ous and the accounts placed directly in them, indexed for constant time lookups:
+        every node holds its ancestor path (root first, itself last) and depth, so the ou path of
+        an account is a dict lookup. nodes are numbered in pre-order and accounts laid out in that
+        order, so the accounts of a whole subtree are one contiguous slice given by the node's span.
+
+    nodes and accounts may be added in any order, parents before children. call index() once the
+    tree is complete and again after further additions
+    '''
+
+    def __init__(self):
+        self.nodes = {}
+        self.roots = []
+        self.account_ou = {}
+        self._order = []
+        self._indexed = False
+
+    def add_ou(self, ou_id, name=None, ou_type=None, parent_id=None):
+        '''
+        :param ou_id:   root or ou id
+        :type ou_id:    str
+        :param name:    ou name, roots are named Root
+        :type name:     str
+        :param ou_type: ROOT or ORGANIZATIONAL_UNIT
+        :type ou_type:  str
+        :param parent_id:   id of the parent, None for roots
+        :type parent_id:    str
+        '''
+        node = self.nodes.get(ou_id)
+        if node is None:
+            node = self.nodes[ou_id] = OrgNode(ou_id, name, ou_type, parent_id)
+            if parent_id is None:
+                self.roots.append(node)
+            else:
+                self.nodes[parent_id].children.append(node)
+        else:
+            node.name, node.type = name, ou_type
+        self._indexed = False
+        return node
+
+    def add_account(self, account_id, ou_id):
+        '''
+        :param account_id:  aws account id
+        :type account_id:   str
+        :param ou_id:   root or ou the account is placed in directly
+        :type ou_id:    str
+        '''
+        previous = self.account_ou.get(account_id)
+        if previous == ou_id:
+            return
+        if previous is not None:
+            self.nodes[previous].accounts.remove(account_id)
+        self.nodes[ou_id].accounts.append(account_id)
+        self.account_ou[account_id] = ou_id
+        self._indexed = False
+
+    def index(self):
+        '''
+        number the nodes in pre-order, recording their path, depth and account span.
+        iterative so deep trees do not hit the recursion limit
+        '''
+        order = []
+        stack = [(root, (), ()) for root in reversed(self.roots)]
+        while stack:
+            node, path, names = stack.pop()
+            node.path = path + (node.id,)
+            node.names = names + (node.name or node.id,)
+            node.depth = len(path)
+            start = len(order)
+            order.extend(node.accounts)
+            # the span end is known once the subtree is done, a marker is popped after the children
+            stack.append((node, start, None))
+            stack.extend((child, node.path, node.names) for child in reversed(node.children))
+            while stack and stack[-1][2] is None:
+                done, done_start, _ = stack.pop()
+                done.span = (done_start, len(order))
+
+        self._order = order
+        self._indexed = True
+
+    def _check(self):
+        if not self._indexed:
+            self.index()
+
+    def ou(self, account_id):
+        '''
+        :returns: node the account is placed in directly, None for unknown accounts
+        '''
+        ou_id = self.account_ou.get(account_id)
+        return self.nodes[ou_id] if ou_id is not None else None
+
+    def path(self, account_id):
+        '''
+        :returns: tuple of node ids from the root to the account's ou, empty for unknown accounts
+        '''
+        self._check()
+        node = self.ou(account_id)
+        return node.path if node else ()
+
+    def path_names(self, account_id):
+        '''
+        :returns: names from the root to the account's ou joined by /, e.g. Root/itops/prod
+        '''
+        self._check()
+        node = self.ou(account_id)
+        return PATH_SEP.join(node.names) if node else None
+
+    def branch(self, account_id, depth=1):
+        '''
+        :param depth:   1 for the top level ou under the root, 2 for the level below and so on
+        :type depth:    int
+        :returns: ancestor node of the account at that depth, None if the account sits higher up
+        '''
+        self._check()
+        node = self.ou(account_id)
+        if node is None or node.depth < depth:
+            return None
+        return self.nodes[node.path[depth]]
+
+    def subtree_accounts(self, ou_id):
+        '''
+        :returns: list of the accounts in the ou and all ous below it
+        '''
+        self._check()
+        start, end = self.nodes[ou_id].span
+        return self._order[start:end]
+
+    def subtree_count(self, ou_id):
+        self._check()
+        start, end = self.nodes[ou_id].span
+        return end - start
+
+    def is_under(self, account_id, ou_id):
+        '''
+        :returns: True if the account is in the ou or any ou below it
+        '''
+        self._check()
+        node = self.ou(account_id)
+        if node is None or ou_id not in self.nodes:
+            return False
+        start, end = self.nodes[ou_id].span
+        return start <= node.span[0] and node.span[1] <= end
+
+    @classmethod
+    def from_master(cls, master_ou, master_account):
+        '''
+        build the tree from the master lists of get_org_list.py
+
+        :param master_ou:   ou id to ou record, parents before children
+        :type master_ou:    dict
+        :param master_account:  account id to account record, accounts of a root have no ou
+        :type master_account:   dict
+        '''
+        tree = cls()
+        roots = []
+        for ou_id, ou in master_ou.items():
+            tree.add_ou(ou_id, ou.get('Name'), ou.get('Type'), ou.get('parent_id'))
+            if ou.get('Type') == 'ROOT':
+                roots.append(ou_id)
+        for account_id, account in master_account.items():
+            ou_id = account.get('ou') or (roots[0] if len(roots) == 1 else None)
+            if ou_id is not None:
+                tree.add_account(account_id, ou_id)
+        tree.index()
+        return tree
+
+    def to_dict(self):
+        '''
+        :returns: JSON serializable tree. ous are listed in pre-order with their precomputed path and
+                  subtree account count, accounts map to the ou they are placed in directly
+        '''
+        self._check()
+        ous = {}
+        for root in self.roots:
+            stack = [root]
+            while stack:
+                node = stack.pop()
+                ous[node.id] = {'name': node.name,
+                                'type': node.type,
+                                'parent': node.parent,
+                                'depth': node.depth,
+                                'path': list(node.path),
+                                'path_names': PATH_SEP.join(node.names),
+                                'children': [child.id for child in node.children],
+                                'accounts': node.accounts,
+                                'subtree_accounts': node.span[1] - node.span[0]}
+                stack.extend(reversed(node.children))
+        return {'version': TREE_VERSION, 'ous': ous, 'accounts': self.account_ou}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != TREE_VERSION:
+            raise OrgTreeError(f'unsupported org tree version: {data.get("version")}')
+        tree = cls()
+        for ou_id, ou in data['ous'].items():
+            tree.add_ou(ou_id, ou.get('name'), ou.get('type'), ou.get('parent'))
+            for account_id in ou.get('accounts', []):
+                tree.add_account(account_id, ou_id)
+        tree.index()
+        return tree
+
+    def dump(self, path):
+        '''
+        write the tree as JSON, through a temporary file so readers never see a partial tree
+
+        :param path:    destination, usually aws_org_tree.json next to aws_account_list.csv
+        :type path:     str
+        '''
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fp:
+            json.dump(self.to_dict(), fp)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding='utf-8') as fp:
+                data = json.load(fp)
+        except (OSError, ValueError) as e:
+            raise OrgTreeError(f'cannot read org tree {path}: {e}')
+        return cls.from_dict(data)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=("Look up accounts and ous in the org tree written by get_org_list.py.\n\n"
+                                                  "  examples:\n"
+                                                  "    %(prog)s aws_org_tree.json --accounts\n"
+                                                  "    %(prog)s aws_org_tree.json --under ou-ab12-cdef3456\n"
+                                                  "    %(prog)s aws_org_tree.json --rollup 1\n"),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('tree', help='aws_org_tree.json')
+    parser.add_argument('--accounts', action='store_true',
+                        help='print one line per account: account id, ou id, top level ou name and ou path, tab separated')
+    parser.add_argument('--under', default=None, metavar='OU_ID', help='print the accounts in the ou and all ous below it')
+    parser.add_argument('--rollup', type=int, default=None, metavar='DEPTH',
+                        help='print the number of accounts under every ou at this depth, 1: top level ous')
+
+    args = parser.parse_args()
+
+    try:
+        tree = OrgTree.load(args.tree)
+    except OrgTreeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    out = sys.stdout
+    if args.accounts:
+        for account_id, ou_id in tree.account_ou.items():
+            branch = tree.branch(account_id)
+            out.write(f'{account_id}\t{ou_id}\t{branch.name if branch else ""}\t{tree.path_names(account_id)}\n')
+    elif args.under:
+        if args.under not in tree.nodes:
+            print(f'unknown ou: {args.under}', file=sys.stderr)
+            sys.exit(1)
+        for account_id in tree.subtree_accounts(args.under):
+            out.write(f'{account_id}\n')
+    elif args.rollup is not None:
+        for node in tree.nodes.values():
+            if node.depth == args.rollup:
+                out.write(f'{node.id}\t{PATH_SEP.join(node.names)}\t{tree.subtree_count(node.id)}\n')
+    else:
+        parser.print_help()
@@ -0,0 +1,226 @@
+import gzip
+import io
+import json
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODERS = ['auto', 'orjson', 'json']
+BUFFER_SIZE = 1 << 20 # 1MB writes
+
+CODECS = ['none', 'gzip', 'zstd']
+CODEC_SUFFIXES = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+CODEC_LEVELS = {'gzip': 6, 'zstd': 3} # default compression levels
+CODEC_MAGIC = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd'}
+
+
+def _make_stdlib_dumps():
+    '''
+    compact stdlib encoder matching orjson output (no whitespace, UTF-8 instead of \\u escapes).
+    the C encoder is built once instead of per json.dumps call
+    '''
+    encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+    c_make_encoder = getattr(json.encoder, 'c_make_encoder', None)
+    if c_make_encoder is None:
+        encode = encoder.encode
+    else:
+        c_encoder = c_make_encoder(None, encoder.default, json.encoder.encode_basestring,
+                                   None, ':', ',', False, False, True)
+        encode = lambda obj: ''.join(c_encoder(obj, 0))
+
+    ascii_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def stdlib_dumps(obj):
+        try:
+            return encode(obj).encode('utf-8')
+        except UnicodeEncodeError:
+            # lone surrogates cannot be written as UTF-8, keep them escaped
+            return ascii_encode(obj).encode('utf-8')
+
+    return stdlib_dumps
+
+
+stdlib_dumps = _make_stdlib_dumps()
+
+
+def orjson_dumps(obj):
+    '''
+    orjson with a stdlib fallback for what it rejects (integers over 64 bits, lone surrogates)
+    '''
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        return stdlib_dumps(obj)
+
+
+dumps = stdlib_dumps
+encoder_name = 'json'
+
+
+def use_encoder(name='auto'):
+    '''
+    select the JSON encoder used by dumps()
+
+    output of both encoders is byte identical, apart from floats in exponent
+    notation (orjson writes 1e16, json writes 1e+16)
+
+    :param name:    auto (orjson when installed), orjson or json
+    :type name:     str
+
+    :returns: name of the encoder in use
+    '''
+    global dumps, encoder_name
+
+    if name not in ENCODERS:
+        raise ValueError(f'unknown JSON encoder: {name}')
+    if name == 'orjson' and orjson is None:
+        raise ValueError('orjson is not installed')
+
+    if name == 'json' or orjson is None:
+        dumps, encoder_name = stdlib_dumps, 'json'
+    else:
+        dumps, encoder_name = orjson_dumps, 'orjson'
+    return encoder_name
+
+
+use_encoder()
+
+
+def open_sink(path, codec='none', level=None):
+    '''
+    open a file for binary writing, compressing while writing
+
+    :param path:    destination file, the codec suffix is not added
+    :type path:     str
+    :param codec:   none, gzip or zstd
+    :type codec:    str
+    :param level:   compression level, default 6 for gzip and 3 for zstd
+    :type level:    int
+    '''
+    if codec not in CODECS:
+        raise ValueError(f'unknown output codec: {codec}')
+    if codec == 'none':
+        return open(path, 'wb')
+
+    level = CODEC_LEVELS[codec] if level is None else level
+    if codec == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=level)
+    if zstandard is None:
+        raise ValueError('zstandard is not installed')
+    return zstandard.open(path, 'wb', cctx=zstandard.ZstdCompressor(level=level))
+
+
+def open_input(path):
+    '''
+    open a file for binary reading, decompressing gzip or zstd by its magic number
+
+    :param path:    file written by open_sink with any codec
+    :type path:     str
+    '''
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+
+    for prefix, codec in CODEC_MAGIC.items():
+        if not magic.startswith(prefix):
+            continue
+        if codec == 'gzip':
+            return gzip.open(path, 'rb')
+        if zstandard is None:
+            raise ValueError(f'{path} is zstd compressed and zstandard is not installed')
+        # buffered for readline and line iteration
+        return io.BufferedReader(zstandard.open(path, 'rb'))
+
+    return open(path, 'rb')
+
+
+class NDJSONWriter(object):
+    '''
+    buffer encoded lines and hand them to the file in large writes,
+    counting events and bytes for throughput reporting
+    '''
+
+    def __init__(self, fp, buffer_size=BUFFER_SIZE, tee=None):
+        '''
+        :param fp:  binary file object
+        :type fp:   file
+        :param buffer_size:     bytes collected before a write
+        :type buffer_size:      int
+        :param tee:     also hand every write to this sink, with its number of events, e.g. ss_hec.HECSink
+        :type tee:      object
+        '''
+        self._fp = fp
+        self._buffer_size = buffer_size
+        self._tee = tee
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_events = 0
+        self.events = 0
+        self.bytes = 0
+        self.write_seconds = 0.0
+        self._time_start = time.perf_counter()
+
+    def write(self, data, events=1):
+        '''
+        :param data:    one or more newline terminated encoded events
+        :type data:     bytes
+        :param events:  number of events in data
+        :type events:   int
+        '''
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+        self._pending_events += events
+        self.events += events
+        if self._pending_bytes >= self._buffer_size:
+            self.flush()
+
+    def tell(self):
+        '''
+        :returns: offset in the file the next write lands at
+        '''
+        return self.bytes + self._pending_bytes
+
+    def flush(self):
+        if self._pending:
+            time_start = time.perf_counter()
+            data = b''.join(self._pending)
+            self._fp.write(data)
+            if self._tee is not None:
+                self._tee.write(data, self._pending_events)
+            self.write_seconds += time.perf_counter() - time_start
+            self.bytes += self._pending_bytes
+            self._pending = []
+            self._pending_bytes = 0
+            self._pending_events = 0
+
+    def stats(self):
+        '''
+        :returns: dict of events, bytes, seconds and mb_per_sec written so far,
+                  write_seconds spent in the file (and its compressor) itself and waiting on the tee
+        '''
+        elapsed = time.perf_counter() - self._time_start
+        written = self.tell()
+        return {
+            'events': self.events,
+            'bytes': written,
+            'seconds': round(elapsed, 3),
+            'mb_per_sec': round(written / 2 ** 20 / elapsed, 2) if elapsed > 0 else 0.0,
+            'write_seconds': round(self.write_seconds, 3),
+        }
+
+    def close(self):
+        self.flush()
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
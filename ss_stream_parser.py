@@ -0,0 +1,308 @@
+import json
+import re
+
+CHUNK_SIZE = 1 << 20 # 1MB reads from the results file
+
+# whitespace between JSON tokens
+RE_WS = re.compile(r'[ \t\n\r]*')
+# everything up to the next bracket or unterminated string, skipping over complete strings
+RE_SKIP = re.compile(r'[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*', re.S)
+# remainder of a string whose opening quote was already consumed
+RE_STRING_TAIL = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+# numbers, true, false, null
+RE_SCALAR = re.compile(r'[^,:}\]\s]+')
+# trailing backslashes of a chunk, used to carry an escape into the next chunk
+RE_TRAILING_ESCAPE = re.compile(r'\\+$')
+
+
+class ResultsParseError(ValueError):
+    '''
+    ScoutSuite results file is truncated or not valid JSON
+    '''
+
+
+def _scan(s, i, depth, in_string, escaped):
+    '''
+    scan a JSON string or container value for its end without decoding it
+
+    :param s:   text segment to scan
+    :type s:    str
+    :param i:   index to start scanning from
+    :type i:    int
+    :param depth:   current bracket depth carried over from the previous segment
+    :type depth:    int
+    :param in_string:   previous segment ended inside a string
+    :type in_string:    bool
+    :param escaped:     previous segment ended on an unpaired backslash inside a string
+    :type escaped:      bool
+
+    :returns: tuple of (end index or None, depth, in_string, escaped)
+    '''
+    n = len(s)
+    while i < n:
+        if in_string:
+            if escaped:
+                i += 1
+                escaped = False
+                continue
+            m = RE_STRING_TAIL.match(s, i)
+            if m is None:
+                trailing = RE_TRAILING_ESCAPE.search(s, i)
+                escaped = bool(trailing) and len(trailing.group()) % 2 == 1
+                return None, depth, True, escaped
+            i = m.end()
+            in_string = False
+            if depth == 0:
+                return i, 0, False, False
+            continue
+
+        i = RE_SKIP.match(s, i).end()
+        if i == n:
+            break
+
+        c = s[i]
+        i += 1
+        if c == '"':
+            in_string = True
+        elif c == '{' or c == '[':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return i, 0, False, False
+
+    return None, depth, in_string, escaped
+
+
+class ResultsStreamReader(object):
+    '''
+    pull parser over a ScoutSuite results file
+
+    the results file is read in chunks and only the value currently being
+    consumed is held as text. objects are walked with iter_items(), and every
+    value yielded for must be consumed with read_value(), read_raw(), skip_value()
+    or a nested iter_items(). values left untouched are skipped automatically.
+    '''
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        '''
+        :param fp:  text file object of the results file
+        :type fp:   file
+        :param chunk_size:  number of characters per read
+        :type chunk_size:   int
+        '''
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._consumed = 0
+        self._decoder = json.JSONDecoder()
+
+    def _read_chunk(self):
+        if self._eof:
+            return ''
+        chunk = self._fp.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+        return chunk
+
+    def _fill(self):
+        '''
+        drop the consumed part of the buffer and append the next chunk
+
+        :returns: False once the results file is exhausted
+        '''
+        chunk = self._read_chunk()
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return bool(chunk)
+
+    def _skip_ws(self):
+        while True:
+            self._pos = RE_WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf) or not self._fill():
+                return
+
+    def _span(self):
+        '''
+        locate the next value in the buffer, reading more of the file as needed
+
+        :returns: tuple of (start, end) indexes of the value in the buffer
+        '''
+        self._skip_ws()
+        start = self._pos
+        if start >= len(self._buf):
+            raise ResultsParseError('unexpected end of ScoutSuite results')
+
+        c = self._buf[start]
+        if c not in '{["':
+            more = True
+            while True:
+                # matched again after every fill, which moves the value to the start of the buffer
+                m = RE_SCALAR.match(self._buf, self._pos)
+                if m is None:
+                    raise ResultsParseError(f'unexpected character {c!r} in ScoutSuite results')
+                if m.end() < len(self._buf) or not more:
+                    return self._pos, m.end()
+                more = self._fill()
+
+        # scan chunk by chunk and join once so large values are copied a single time
+        segments = [self._buf]
+        offset = 0
+        i = start
+        depth, in_string, escaped = 0, False, False
+        if c == '"':
+            i, in_string = start + 1, True
+        while True:
+            end, depth, in_string, escaped = _scan(segments[-1], i, depth, in_string, escaped)
+            if end is not None:
+                break
+            chunk = self._read_chunk()
+            if not chunk:
+                raise ResultsParseError('unexpected end of ScoutSuite results')
+            offset += len(segments[-1])
+            segments.append(chunk)
+            i = 0
+
+        if len(segments) > 1:
+            segments[0] = self._buf[start:]
+            offset -= start
+            self._buf = ''.join(segments)
+            self._pos = start = 0
+
+        return start, offset + end
+
+    def _advance(self, end):
+        self._pos = end
+        self._consumed += 1
+        # release consumed text held by the buffer
+        if self._pos > self._chunk_size:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+    def skip_prefix(self):
+        '''
+        skip the javascript assignment (e.g. "scoutsuite_results =") in front of the JSON document
+        '''
+        while True:
+            idx = self._buf.find('{', self._pos)
+            if idx != -1:
+                self._pos = idx
+                return
+            self._pos = len(self._buf)
+            if not self._fill():
+                raise ResultsParseError('no JSON document found in ScoutSuite results')
+
+    def peek(self):
+        '''
+        :returns: next non-whitespace character without consuming it, empty string at the end of file
+        '''
+        self._skip_ws()
+        return self._buf[self._pos:self._pos + 1]
+
+    def read_value(self):
+        '''
+        decode the next value
+        '''
+        # containers and strings held whole by the buffer decode in one pass. those running past it
+        # fail to decode and are located with _span first
+        self._skip_ws()
+        if self._buf[self._pos:self._pos + 1] in ('{', '[', '"'):
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                pass
+            else:
+                self._advance(end)
+                return value
+
+        start, end = self._span()
+        try:
+            value, _ = self._decoder.raw_decode(self._buf, start)
+        except ValueError as e:
+            raise ResultsParseError(str(e))
+        self._advance(end)
+        return value
+
+    def read_raw(self):
+        '''
+        return the next value as undecoded JSON text
+        '''
+        start, end = self._span()
+        raw = self._buf[start:end]
+        self._advance(end)
+        return raw
+
+    def skip_value(self):
+        '''
+        skip the next value. containers held whole by the buffer go through the C decoder and are
+        dropped, which is faster than scanning them here and bounded by the buffer size. objects
+        running past the buffer are skipped key by key, anything else is scanned without decoding
+        '''
+        self._skip_ws()
+        c = self._buf[self._pos:self._pos + 1]
+        if c == '{' or c == '[':
+            try:
+                _, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if c == '{':
+                    for _ in self.iter_items():
+                        pass
+                    return
+            else:
+                self._advance(end)
+                return
+
+        _, end = self._span()
+        self._advance(end)
+
+    def iter_items(self):
+        '''
+        walk the keys of the next object
+
+        the caller consumes each value before asking for the next key
+
+        :returns: generator of keys
+        '''
+        self._skip_ws()
+        if self._buf[self._pos:self._pos + 1] != '{':
+            raise ResultsParseError(f'expected an object at {self._buf[self._pos:self._pos + 20]!r}')
+        self._pos += 1
+        self._consumed += 1
+
+        first = True
+        while True:
+            self._skip_ws()
+            c = self._buf[self._pos:self._pos + 1]
+            if c == '}':
+                self._pos += 1
+                return
+            if not first:
+                if c != ',':
+                    raise ResultsParseError(f'expected "," at {self._buf[self._pos:self._pos + 20]!r}')
+                self._pos += 1
+            first = False
+
+            key = self.read_value()
+            self._skip_ws()
+            if self._buf[self._pos:self._pos + 1] != ':':
+                raise ResultsParseError(f'expected ":" after key {key!r}')
+            self._pos += 1
+
+            consumed = self._consumed
+            yield key
+            if self._consumed == consumed:
+                self.skip_value()
+
+    def read_nested(self, depth):
+        '''
+        decode the next value, walking the first levels of objects key by key
+        so only one leaf subtree is held as text at a time
+
+        :param depth:   number of object levels to walk before decoding whole values
+        :type depth:    int
+        '''
+        if depth <= 0 or self.peek() != '{':
+            return self.read_value()
+        return {key: self.read_nested(depth - 1) for key in self.iter_items()}
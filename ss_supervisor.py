@@ -0,0 +1,348 @@
+import argparse
+import collections
+import datetime
+import heapq
+import itertools
+import os
+import selectors
+import signal
+import subprocess
+import sys
+import time
+
+PROC_NAME = 'ss_supervisor'
+
+default_scoutsuite_script = '/opt/scoutsuite/ScoutSuite/scout.py'
+default_report_dir = '/opt/reports.scoutsuite'
+default_log_dir = '/opt/scoutsuite_runner/log'
+
+max_nproc = 10 # scans running at once
+max_workers = 2 # scout.py --max-workers
+max_rate = 5 # scout.py --max-rate, describe/list API calls per second
+scan_timeout = 0 # seconds a scan may run before it is terminated, 0: no limit
+kill_grace = 30 # seconds between terminating a scan and killing it
+scan_retries = 1 # attempts per failed or timed out scan after the first
+retry_delay = 60 # seconds before a failed scan is queued again
+
+# results file: one tab separated line per scan attempt
+RESULT_FIELDS = ['status', 'profile', 'attempt', 'exit', 'seconds', 'cpu_seconds', 'peak_mb', 'log']
+
+
+def get_timestamp():
+    return datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f%z')
+
+
+def date_tags(now=None):
+    '''
+    :returns: tuple of (TIMESTAMP_TAG, DATESTAMP_TAG) in the local time formats of scoutsuite_runner.sh
+    '''
+    now = now or datetime.datetime.now().astimezone()
+    return now.strftime(f'%Y-%m-%d.%H_%M_%S.{now.microsecond // 1000:03d}%z'), now.strftime('%Y-%m-%d')
+
+
+def read_profiles(filename):
+    '''
+    :param filename:    aws_profile_list.txt of aws_profile_builder.py
+    :type filename:     str
+    :returns: list of profile names, split on whitespace as the runner's for loop did
+    '''
+    with open(filename) as fp:
+        return fp.read().split()
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _ignore_signal(signum, frame):
+    '''
+    signals are handled by the supervisor loop, which reads them from the wakeup pipe
+    '''
+
+
+class Scan(object):
+    '''
+    one scout.py run of a profile, across its attempts
+    '''
+    __slots__ = ('profile', 'count', 'attempt', 'report_dir', 'log_file', 'proc', 'started', 'deadline', 'kill_at', 'timed_out')
+
+    def __init__(self, profile, count, report_dir, log_file):
+        self.profile = profile
+        self.count = count
+        self.attempt = 1
+        self.report_dir = report_dir
+        self.log_file = log_file
+        self.proc = None
+        self.started = None
+        self.deadline = None
+        self.kill_at = None
+        self.timed_out = False
+
+
+class ScanSupervisor(object):
+    '''
+    run scout.py once per profile, at most max_nproc at a time, into the report and log layout of scoutsuite_runner.sh:
+        report  <report_root>/<DATESTAMP_TAG>/<profile>.<TIMESTAMP_TAG>
+        log     <log_root>/<DATESTAMP_TAG>/scoutsuite.<profile>.<TIMESTAMP_TAG>.log
+
+    the loop blocks in a selector on the signal wakeup pipe. SIGCHLD wakes it to reap finished scans, SIGTERM and
+    SIGINT to drain, and its timeout is the nearest scan deadline or retry, so the supervisor uses no cpu while it
+    waits however many profiles are queued.
+
+    a first SIGTERM or SIGINT stops launching scans and waits for the running ones, a second one terminates them.
+    scans run in their own session, so a terminal's ctrl-c reaches the supervisor only
+    '''
+
+    def __init__(self, scoutsuite_script=default_scoutsuite_script, report_root=default_report_dir, log_root=default_log_dir,
+                 timestamp_tag=None, datestamp_tag=None, results=None):
+        '''
+        :param scoutsuite_script:   scout.py, run with this interpreter
+        :type scoutsuite_script:    str
+        :param timestamp_tag:   run tag of the report and log names, default: now
+        :type timestamp_tag:    str
+        :param datestamp_tag:   day folder of the reports and logs, default: today
+        :type datestamp_tag:    str
+        :param results:     append a line per scan attempt to this file, see RESULT_FIELDS
+        :type results:      str
+        '''
+        tags = date_tags()
+        self.scoutsuite_script = scoutsuite_script
+        self.report_root = report_root
+        self.log_root = log_root
+        self.timestamp_tag = timestamp_tag or tags[0]
+        self.datestamp_tag = datestamp_tag or tags[1]
+        self.results = results
+
+        self.pending = collections.deque()
+        self.delayed = [] # heap of (not before, seq, scan) of failed scans waiting to retry
+        self.running = {} # pid to scan
+        self.stopping = False
+        self.seq = itertools.count()
+        self.records = []
+
+    def command(self, scan):
+        return [sys.executable, self.scoutsuite_script, 'aws', '--profile', scan.profile, '--max-workers', str(max_workers),
+                '--max-rate', str(max_rate), '--report-dir', scan.report_dir, '--report-name', scan.profile, '-f']
+
+    def _launch(self, scan):
+        cmd = self.command(scan)
+        scan.started = time.monotonic()
+        scan.deadline = scan.started + scan_timeout if scan_timeout else None
+        scan.kill_at = None
+        scan.timed_out = False
+        try:
+            os.makedirs(os.path.dirname(scan.log_file), exist_ok=True)
+            # appended to, so the log of a retried scan holds every attempt
+            with open(scan.log_file, 'a') as log:
+                log.write(' '.join(cmd) + '\n')
+                log.flush()
+                scan.proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        except OSError as e:
+            print(f'{get_timestamp()} {PROC_NAME}: failed to start scan of aws profile: {scan.profile} Reason: {e}', flush=True)
+            self._finished(scan, 127, None)
+            return
+
+        self.running[scan.proc.pid] = scan
+        print(f'{get_timestamp()} {PROC_NAME}: outputting to filename={scan.log_file} aws profile: {scan.profile} '
+              f'count: {scan.count} attempt: {scan.attempt} pid: {scan.proc.pid}', flush=True)
+
+    def _launch_ready(self):
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            self.pending.append(heapq.heappop(self.delayed)[2])
+        while not self.stopping and self.pending and len(self.running) < max_nproc:
+            self._launch(self.pending.popleft())
+
+    def _signal(self, scan, signum):
+        try:
+            os.killpg(scan.proc.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _terminate(self, scan):
+        self._signal(scan, signal.SIGTERM)
+        scan.deadline = None
+        scan.kill_at = time.monotonic() + kill_grace
+
+    def _check_deadlines(self):
+        now = time.monotonic()
+        for scan in self.running.values():
+            if scan.kill_at is not None and now >= scan.kill_at:
+                print(f'{get_timestamp()} {PROC_NAME}: killing scan of aws profile: {scan.profile} pid: {scan.proc.pid}', flush=True)
+                self._signal(scan, signal.SIGKILL)
+                scan.kill_at = None
+            elif scan.deadline is not None and now >= scan.deadline:
+                print(f'{get_timestamp()} {PROC_NAME}: scan of aws profile: {scan.profile} timed out after {scan_timeout} sec, '
+                      f'terminating pid: {scan.proc.pid}', flush=True)
+                scan.timed_out = True
+                self._terminate(scan)
+
+    def _next_wakeup(self):
+        '''
+        :returns: seconds until the nearest deadline, kill or retry, None if there is nothing to wait for but signals
+        '''
+        times = [t for scan in self.running.values() for t in (scan.deadline, scan.kill_at) if t is not None]
+        if self.delayed and not self.stopping:
+            times.append(self.delayed[0][0])
+        if not times:
+            return None
+        return max(0, min(times) - time.monotonic())
+
+    def _reap(self):
+        for pid, scan in list(self.running.items()):
+            wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if wpid == 0:
+                continue
+            code = _exit_code(status)
+            # reaped here, Popen must not wait for it again
+            scan.proc.returncode = code
+            del self.running[pid]
+            self._finished(scan, code, rusage)
+
+    def _finished(self, scan, code, rusage):
+        seconds = time.monotonic() - scan.started
+        status = 'TIMEOUT' if scan.timed_out else 'OK' if code == 0 else 'FAILED'
+        cpu = rusage.ru_utime + rusage.ru_stime if rusage else 0
+        # ru_maxrss is in KB on linux and bytes on macOS
+        peak = rusage.ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 1024) if rusage else 0
+        self._record(status, scan, code, seconds, cpu, peak)
+
+        print(f'{get_timestamp()} {PROC_NAME}: scan {status} aws profile: {scan.profile} attempt: {scan.attempt} exit: {code} '
+              f'elapsed: {int(seconds) // 60} min and {int(seconds) % 60} sec cpu: {cpu:.1f} sec peak: {peak:.0f} MB', flush=True)
+
+        if status != 'OK' and scan.attempt <= scan_retries and not self.stopping:
+            scan.attempt += 1
+            heapq.heappush(self.delayed, (time.monotonic() + retry_delay, next(self.seq), scan))
+            print(f'{get_timestamp()} {PROC_NAME}: retrying aws profile: {scan.profile} in {retry_delay} sec, attempt: {scan.attempt}', flush=True)
+
+    def _record(self, status, scan, code='', seconds=0, cpu=0, peak=0):
+        record = (status, scan.profile, scan.attempt, code, round(seconds, 1), round(cpu, 1), round(peak, 1), scan.log_file)
+        self.records.append(record)
+        if self.results:
+            with open(self.results, 'a') as fp:
+                fp.write('\t'.join(str(value) for value in record) + '\n')
+
+    def _on_signal(self, signum):
+        if signum not in (signal.SIGTERM, signal.SIGINT):
+            return
+        if not self.stopping:
+            self.stopping = True
+            print(f'{get_timestamp()} {PROC_NAME}: received {signal.Signals(signum).name}, draining {len(self.running)} running scans, '
+                  f'not starting {len(self.pending) + len(self.delayed)} queued ones', flush=True)
+            return
+        print(f'{get_timestamp()} {PROC_NAME}: received {signal.Signals(signum).name} again, terminating {len(self.running)} running scans',
+              flush=True)
+        for scan in self.running.values():
+            if scan.kill_at is None:
+                self._terminate(scan)
+
+    def run(self, profiles):
+        '''
+        :param profiles:    aws profile names, scanned in this order
+        :type profiles:     list
+        :returns: list of (status, profile, attempt, exit, seconds, cpu seconds, peak MB, log) per scan attempt, status is
+                  OK, FAILED, TIMEOUT, or SKIPPED for scans never started because the supervisor was stopped
+        '''
+        for count, profile in enumerate(profiles, 1):
+            self.pending.append(Scan(profile, count,
+                                     os.path.join(self.report_root, self.datestamp_tag, f'{profile}.{self.timestamp_tag}'),
+                                     os.path.join(self.log_root, self.datestamp_tag, f'scoutsuite.{profile}.{self.timestamp_tag}.log')))
+
+        wakeup_r, wakeup_w = os.pipe()
+        os.set_blocking(wakeup_r, False)
+        os.set_blocking(wakeup_w, False)
+        selector = selectors.DefaultSelector()
+        selector.register(wakeup_r, selectors.EVENT_READ)
+        # the handlers only have the signal number written to the pipe, installed before the first scan starts
+        previous_wakeup = signal.set_wakeup_fd(wakeup_w)
+        previous_handlers = {signum: signal.signal(signum, _ignore_signal) for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT)}
+        try:
+            while True:
+                self._launch_ready()
+                if not self.running and (self.stopping or not (self.pending or self.delayed)):
+                    break
+                if selector.select(self._next_wakeup()):
+                    try:
+                        signums = os.read(wakeup_r, 512)
+                    except BlockingIOError:
+                        signums = b''
+                    for signum in signums:
+                        self._on_signal(signum)
+                self._reap()
+                self._check_deadlines()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            signal.set_wakeup_fd(previous_wakeup)
+            selector.close()
+            os.close(wakeup_r)
+            os.close(wakeup_w)
+
+        for scan in itertools.chain(self.pending, (scan for _, _, scan in sorted(self.delayed))):
+            print(f'{get_timestamp()} {PROC_NAME}: skipping aws profile: {scan.profile}, supervisor stopped', flush=True)
+            self._record('SKIPPED', scan)
+        self.pending.clear()
+        self.delayed = []
+        return self.records
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=('Run a ScoutSuite scan per profile of aws_profile_list.txt, at most --max-nproc at a time.\n'
+                                                  'Failed and timed out scans are retried --retries times. SIGTERM or SIGINT stops\n'
+                                                  'starting scans and waits for the running ones, a second one terminates them.\n\n'
+                                                  'Exits 1 unless every scan succeeded.'),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--profile-list', default='aws_profile_list.txt', help='profiles to scan, one per line, default: aws_profile_list.txt')
+    parser.add_argument('--scoutsuite-script', default=default_scoutsuite_script, help=f'default: {default_scoutsuite_script}')
+    parser.add_argument('--report-dir', default=default_report_dir, help=f'default: {default_report_dir}')
+    parser.add_argument('--log-dir', default=default_log_dir, help=f'default: {default_log_dir}')
+    parser.add_argument('--timestamp-tag', default=None, help='run tag of the report and log names, default: now as the runner formats it')
+    parser.add_argument('--datestamp-tag', default=None, help='day folder of the reports and logs, default: today')
+    parser.add_argument('--max-nproc', type=int, default=max_nproc, help=f'scans running at once, default: {max_nproc}')
+    parser.add_argument('--max-workers', type=int, default=max_workers, help=f'scout.py --max-workers, default: {max_workers}')
+    parser.add_argument('--max-rate', type=int, default=max_rate, help=f'scout.py --max-rate, default: {max_rate}')
+    parser.add_argument('--timeout', type=float, default=scan_timeout,
+                        help=f'seconds a scan may run before it is terminated, 0: no limit, default: {scan_timeout}')
+    parser.add_argument('--kill-grace', type=float, default=kill_grace,
+                        help=f'seconds between terminating a scan and killing it, default: {kill_grace}')
+    parser.add_argument('--retries', type=int, default=scan_retries, help=f'attempts per failed scan after the first, default: {scan_retries}')
+    parser.add_argument('--retry-delay', type=float, default=retry_delay,
+                        help=f'seconds before a failed scan is queued again, default: {retry_delay}')
+    parser.add_argument('--results', default=None, help=f'append a tab separated line per scan attempt: {" ".join(RESULT_FIELDS)}')
+
+    args = parser.parse_args()
+    max_nproc = max(1, args.max_nproc)
+    max_workers = args.max_workers
+    max_rate = args.max_rate
+    scan_timeout = args.timeout
+    kill_grace = args.kill_grace
+    scan_retries = args.retries
+    retry_delay = args.retry_delay
+
+    profiles = read_profiles(args.profile_list)
+    print(f'{get_timestamp()} {PROC_NAME}: scanning {len(profiles)} aws profiles of {args.profile_list} max nproc: {max_nproc} '
+          f'timeout: {scan_timeout} retries: {scan_retries}', flush=True)
+
+    time_start = time.time()
+    supervisor = ScanSupervisor(args.scoutsuite_script, args.report_dir, args.log_dir, args.timestamp_tag, args.datestamp_tag,
+                                args.results)
+    records = supervisor.run(profiles)
+
+    final = {}
+    for record in records:
+        final[record[1]] = record # last attempt of every profile
+    statuses = collections.Counter(record[0] for record in final.values())
+    retried = sum(1 for record in records if record[2] > 1 and record[0] != 'SKIPPED')
+    elapsed = int(time.time() - time_start)
+    print(f'{get_timestamp()} {PROC_NAME}: scans: {len(final)} ok: {statuses["OK"]} failed: {statuses["FAILED"]} '
+          f'timed out: {statuses["TIMEOUT"]} skipped: {statuses["SKIPPED"]} retried: {retried} '
+          f'elapsed: {elapsed // 60} min and {elapsed % 60} sec', flush=True)
+    slowest = sorted((record for record in records if record[0] != 'SKIPPED'), key=lambda record: record[4], reverse=True)[:5]
+    if slowest:
+        print(f'{get_timestamp()} {PROC_NAME}: slowest scans: ' +
+              ' '.join(f'{record[1]}={record[4]}s' for record in slowest), flush=True)
+
+    sys.exit(0 if statuses['OK'] == len(final) else 1)
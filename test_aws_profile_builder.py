@@ -0,0 +1,45 @@
+import aws_profile_builder
+
+CONFIG = '''[default]
+region = us-east-1
+
+[sso-session corp]
+sso_start_url = https://corp.awsapps.com/start
+sso_region = us-east-1
+
+[services dev]
+s3 =
+  endpoint_url = http://localhost:4566
+
+[dev]
+region = eu-west-1
+
+[profile dev]
+region = us-west-2
+'''
+
+
+def test_parse_config_names_profiles_only():
+    head, sections = aws_profile_builder.parse_config(CONFIG)
+
+    assert head == []
+    assert [name for name, _ in sections] == ['default', None, None, None, 'dev']
+    assert ''.join(''.join(lines) for _, lines in sections) == CONFIG
+
+
+def test_build_profiles_leaves_other_sections(tmp_path):
+    config = tmp_path / 'config'
+    config.write_text(CONFIG)
+
+    counts = aws_profile_builder.build_profiles([('dev', '111111111111'), ('corp', '222222222222')], str(config),
+                                                source_profile='base', role='audit', region='us-east-1')
+
+    assert counts == (1, 1, 0)
+    text = config.read_text()
+    # the bare [dev] and the [sso-session corp] sections are not profiles, they are kept as they were
+    assert text.startswith(CONFIG.split('[profile dev]')[0])
+    assert text.count('[profile corp]') == 1
+    assert 'role_arn = arn:aws:iam::111111111111:role/audit' in text.split('[profile dev]')[1]
+    assert 'role_arn = arn:aws:iam::222222222222:role/audit' in text.split('[profile corp]')[1]
+    _, sections = aws_profile_builder.parse_config(text)
+    assert [name for name, _ in sections] == ['default', None, None, None, 'dev', 'corp']
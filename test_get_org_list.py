@@ -0,0 +1,101 @@
+import boto3
+import botocore.exceptions
+import botocore.stub
+import pytest
+
+import get_org_list
+
+ROOTS = {'Roots': [{'Id': 'r-abcd', 'Arn': 'arn:aws:organizations::111111111111:root/o-example/r-abcd', 'Name': 'Root',
+                    'PolicyTypes': []}]}
+
+
+@pytest.fixture
+def stubbed(monkeypatch):
+    '''
+    stubbed Organizations client installed as the collector client, with a fast limiter and backoff
+    '''
+    client = boto3.client('organizations', region_name='us-east-1', aws_access_key_id='test',
+                          aws_secret_access_key='test')
+    monkeypatch.setattr(get_org_list, 'client', client)
+    monkeypatch.setattr(get_org_list, 'limiter', get_org_list.TokenBucket(1000))
+    monkeypatch.setattr(get_org_list, 'backoff', 0.001)
+    monkeypatch.setattr(get_org_list, 'retries', 3)
+    monkeypatch.setattr(get_org_list, 'api_calls', get_org_list.collections.Counter())
+    monkeypatch.setattr(get_org_list, 'api_throttles', get_org_list.collections.Counter())
+    monkeypatch.setattr(get_org_list, 'api_retries', get_org_list.collections.Counter())
+    with botocore.stub.Stubber(client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def test_throttle_then_success(stubbed):
+    stubbed.add_client_error('list_roots', 'TooManyRequestsException', http_status_code=400)
+    stubbed.add_client_error('list_roots', 'ServiceUnavailableException', http_status_code=503)
+    stubbed.add_client_error('list_roots', 'SomethingNew', http_status_code=500)
+    stubbed.add_response('list_roots', ROOTS)
+
+    assert get_org_list.api_call('list_roots')['Roots'] == ROOTS['Roots']
+    assert get_org_list.api_calls['list_roots'] == 4
+    assert get_org_list.api_retries['list_roots'] == 3
+    assert get_org_list.api_throttles['list_roots'] == 1
+
+
+def test_non_retryable_error_raises(stubbed):
+    stubbed.add_client_error('list_roots', 'AccessDeniedException', http_status_code=400)
+
+    with pytest.raises(botocore.exceptions.ClientError, match='AccessDeniedException'):
+        get_org_list.api_call('list_roots')
+    assert get_org_list.api_calls['list_roots'] == 1
+    assert get_org_list.api_retries['list_roots'] == 0
+
+
+def test_retries_exhausted_raise(stubbed):
+    for _ in range(get_org_list.retries + 1):
+        stubbed.add_client_error('list_roots', 'ThrottlingException', http_status_code=400)
+
+    with pytest.raises(botocore.exceptions.ClientError, match='ThrottlingException'):
+        get_org_list.api_call('list_roots')
+    assert get_org_list.api_retries['list_roots'] == get_org_list.retries
+
+
+def test_connection_error_retried(stubbed):
+    failures = [botocore.exceptions.EndpointConnectionError(endpoint_url='https://organizations.us-east-1.amazonaws.com'),
+                botocore.exceptions.ReadTimeoutError(endpoint_url='https://organizations.us-east-1.amazonaws.com')]
+
+    def fail(**kwargs):
+        # raised before the stubbed response is reached, as a broken connection would be
+        if failures:
+            raise failures.pop(0)
+
+    get_org_list.client.meta.events.register_first('before-parameter-build.organizations.ListRoots', fail)
+    stubbed.add_response('list_roots', ROOTS)
+
+    assert get_org_list.api_call('list_roots')['Roots'] == ROOTS['Roots']
+    assert get_org_list.api_retries['list_roots'] == 2
+    assert get_org_list.api_throttles['list_roots'] == 0
+
+
+def test_token_bucket_rate_drops_and_recovers(monkeypatch):
+    bucket = get_org_list.TokenBucket(4, max_rate=8)
+
+    bucket.throttled()
+    assert bucket.rate == 4 * get_org_list.rate_backoff
+    # the same burst reporting again within a second does not cut the rate further
+    bucket.throttled()
+    assert bucket.rate == 4 * get_org_list.rate_backoff
+    assert bucket.low == bucket.rate
+
+    bucket.cut -= 1
+    bucket.throttled()
+    assert bucket.rate == 4 * get_org_list.rate_backoff ** 2
+
+    for _ in range(1000):
+        bucket.succeeded()
+    assert bucket.rate == 8
+    assert bucket.low == 4 * get_org_list.rate_backoff ** 2
+
+    monkeypatch.setattr(get_org_list, 'api_min_rate', 0.5)
+    for _ in range(20):
+        bucket.cut -= 1
+        bucket.throttled()
+    assert bucket.rate == 0.5
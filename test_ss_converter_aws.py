@@ -0,0 +1,54 @@
+import logging
+import re
+
+import pytest
+
+import gen_scoutsuite_report
+import ss_cache
+import ss_converter_aws
+
+# conversion time of every event, the one field allowed to differ between runs
+RE_TIME = re.compile(r'"_time": ?"[^"]*"')
+
+
+@pytest.fixture(scope='module')
+def results_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp('report') / 'scoutsuite_results_aws-test.js'
+    gen_scoutsuite_report.make_report(str(path), resources=20, regions=3, findings=10, seed=7, profile='test')
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def converter_logger(monkeypatch):
+    # a plain logger instead of prepare_logging(), which writes into the log folder of the repo
+    monkeypatch.setattr(ss_converter_aws, 'logger', logging.getLogger('test_ss_converter_aws'))
+
+
+def _convert(results_file, json_out, **kwargs):
+    count = ss_converter_aws.convert_report(results_file, str(json_out), **kwargs)
+    with open(json_out, 'rb') as fp:
+        lines = [RE_TIME.sub('"_time": ""', line.decode()) for line in fp]
+    assert len(lines) == count
+    return lines
+
+
+@pytest.mark.parametrize('stream', [False, True], ids=['default', 'stream'])
+@pytest.mark.parametrize('service_workers', [2, 4])
+def test_service_workers_match_serial(results_file, tmp_path, stream, service_workers):
+    serial = _convert(results_file, tmp_path / 'serial.txt', stream=stream)
+    parallel = _convert(results_file, tmp_path / 'parallel.txt', stream=stream, service_workers=service_workers)
+
+    assert serial
+    assert parallel == serial
+
+
+def test_cache_keyed_by_encoder(results_file, tmp_path):
+    pytest.importorskip('orjson')
+    cache = ss_cache.ConversionCache(str(tmp_path / 'cache'), 'test')
+    for encoder in ('json', 'orjson', 'json'):
+        ss_converter_aws.convert_report(results_file, str(tmp_path / f'{encoder}.txt'), json_encoder=encoder, cache=cache)
+
+    # one entry per encoder, the second json conversion is a hit
+    metas = sorted(path.stem for path in (tmp_path / 'cache').glob('*/*.json'))
+    assert len(metas) == 2
+    assert metas[0].endswith('-json') and metas[1].endswith('-orjson')
@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+
+import pytest
+
+import ss_hec
+
+TOKEN = 'test-token'
+
+
+@pytest.fixture
+def stand_in(tmp_path):
+    '''
+    start a stand-in collector on a free port, yields (server, url)
+    '''
+    servers = []
+
+    def start(fail_rate=0.0):
+        server = ss_hec.make_server(0, TOKEN, str(tmp_path / 'received.txt'), fail_rate)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+        server.out.close()
+
+
+def _events(count, width=0):
+    return b''.join(json.dumps({'id': f'ev{idx}', 'pad': 'x' * (idx % width if width else 0)}).encode() + b'\n'
+                    for idx in range(count))
+
+
+def test_busy_collector_delivers_everything(stand_in, tmp_path):
+    server, url = stand_in(fail_rate=0.3)
+    client = ss_hec.HECClient(url, TOKEN, batch_events=50, retries=20, backoff=0.001)
+    data = _events(1000)
+    with client.sink(str(tmp_path / 'events.spill')) as sink:
+        for line in data.splitlines(keepends=True):
+            sink.write(line)
+    stats = sink.stats()
+    client.close()
+
+    assert stats['delivered'] == 1000
+    assert stats['spilled'] == 0
+    assert stats['retries'] > 0
+    assert server.counts['busy'] > 0
+    assert server.counts['events'] == 1000
+    assert not os.path.exists(tmp_path / 'events.spill')
+
+
+def test_rejected_token_spills(stand_in, tmp_path):
+    server, url = stand_in()
+    client = ss_hec.HECClient(url, 'wrong-token', batch_events=100, retries=2, backoff=0.001)
+    spill = str(tmp_path / 'events.spill')
+    data = _events(500)
+    with client.sink(spill) as sink:
+        for line in data.splitlines(keepends=True):
+            sink.write(line)
+    stats = sink.stats()
+    client.close()
+
+    assert stats['delivered'] == 0
+    assert stats['spilled'] == 500
+    assert 'HTTP 403' in stats['error']
+    assert not os.path.exists(f'{spill}.tmp')
+    with open(spill, 'rb') as f:
+        assert sorted(f.read().splitlines()) == sorted(data.splitlines())
+    assert server.counts['events'] == 0
+
+
+@pytest.mark.parametrize('codec', ['none', 'gzip'])
+@pytest.mark.parametrize('buffer_size, batch_events', [(97, 150), (50000, 20)], ids=['short-reads', 'oversize-reads'])
+def test_send_file_round_trip(stand_in, tmp_path, monkeypatch, codec, buffer_size, batch_events):
+    # short reads end inside most events, long reads hold more events than a batch
+    monkeypatch.setattr(ss_hec.ss_output, 'BUFFER_SIZE', buffer_size)
+    server, url = stand_in()
+    client = ss_hec.HECClient(url, TOKEN, senders=1, batch_bytes=32768, batch_events=batch_events)
+    data = _events(600, width=300)
+    report = str(tmp_path / f'report.scoutsuite.test.txt{ss_hec.ss_output.CODEC_SUFFIXES[codec]}')
+    with ss_hec.ss_output.open_sink(report, codec) as f:
+        f.write(data)
+
+    stats = client.send_file(report, spill=str(tmp_path / 'report.spill'), codec=codec)
+    client.close()
+
+    assert stats['events'] == 600
+    assert stats['delivered'] == 600
+    assert server.counts['events'] == 600
+    assert server.counts['partial'] == 0
+    server.out.flush()
+    with open(tmp_path / 'received.txt', 'rb') as f:
+        assert f.read() == data